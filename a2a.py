@@ -0,0 +1,118 @@
+"""
+JSON-RPC 2.0 / A2A message helpers for the Dad Joke Agent
+Builds the request/response shapes used by message/send and message/stream
+"""
+
+import json
+import uuid
+
+
+JSONRPC_VERSION = "2.0"
+
+# JSON-RPC 2.0 error codes
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INTERNAL_ERROR = -32603
+# Implementation-defined server error: rate limited or overloaded
+SERVER_BUSY = -32000
+
+
+def extract_text(params: dict) -> str:
+    """Return the first text part of a JSON-RPC message/send params object"""
+    message = params.get("message", {}) if isinstance(params, dict) else {}
+    for part in message.get("parts", []):
+        if part.get("kind") == "text":
+            return part.get("text", "")
+    return ""
+
+
+def extract_context_id(params: dict):
+    """Return the A2A contextId of a JSON-RPC message params object, if any"""
+    message = params.get("message", {}) if isinstance(params, dict) else {}
+    return message.get("contextId")
+
+
+def agent_message(text: str) -> dict:
+    """An assistant A2A message holding a single text part"""
+    return {
+        "kind": "message",
+        "parts": [
+            {
+                "kind": "text",
+                "text": text
+            }
+        ],
+        "role": "assistant"
+    }
+
+
+def result_response(request_id, result: dict) -> dict:
+    """A JSON-RPC 2.0 success response"""
+    return {
+        "jsonrpc": JSONRPC_VERSION,
+        "id": request_id,
+        "result": result
+    }
+
+
+def error_response(request_id, code: int, message: str) -> dict:
+    """A JSON-RPC 2.0 error response"""
+    return {
+        "jsonrpc": JSONRPC_VERSION,
+        "id": request_id,
+        "error": {
+            "code": code,
+            "message": message
+        }
+    }
+
+
+class StreamTask:
+    """
+    Event builder for one message/stream call
+
+    Text chunks become `artifact-update` events appended to a single
+    artifact; the stream ends with a final `status-update` event carrying
+    the complete message.
+    """
+
+    def __init__(self, request_id, params: dict):
+        message = params.get("message", {}) if isinstance(params, dict) else {}
+        self.request_id = request_id
+        self.task_id = message.get("taskId") or uuid.uuid4().hex
+        self.context_id = message.get("contextId") or uuid.uuid4().hex
+        self.artifact_id = uuid.uuid4().hex
+        self.chunks = 0
+
+    def chunk(self, text: str) -> dict:
+        event = {
+            "kind": "artifact-update",
+            "taskId": self.task_id,
+            "contextId": self.context_id,
+            "artifact": {
+                "artifactId": self.artifact_id,
+                "parts": [{"kind": "text", "text": text}]
+            },
+            "append": self.chunks > 0,
+            "lastChunk": False
+        }
+        self.chunks += 1
+        return result_response(self.request_id, event)
+
+    def final(self, text: str) -> dict:
+        event = {
+            "kind": "status-update",
+            "taskId": self.task_id,
+            "contextId": self.context_id,
+            "status": {
+                "state": "completed",
+                "message": agent_message(text)
+            },
+            "final": True
+        }
+        return result_response(self.request_id, event)
+
+
+def sse_event(payload: dict) -> bytes:
+    """Encode a JSON payload as one Server-Sent Events `data:` frame"""
+    return b"data: " + json.dumps(payload).encode("utf-8") + b"\n\n"
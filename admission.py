@@ -0,0 +1,185 @@
+"""
+Admission control for the Dad Joke Agent
+Per-caller token-bucket rate limits and load shedding when generation backs up
+
+Rate limits are counted per process, or in the shared state backend
+(SHARED_STATE_URL) when workers share one, so the limit holds across them.
+"""
+
+import time
+from collections import OrderedDict
+
+from logging_setup import get_logger
+
+
+logger = get_logger("admission")
+
+
+# RATE_LIMIT_KEY values
+RATE_LIMIT_KEYS = ("conversation", "channel", "caller")
+# ADMISSION_SHED values
+SHED_MODES = ("joke", "reject")
+
+
+class RateLimiter:
+    """
+    Token bucket per key
+
+    Each key may burst `burst` requests, then gets `rate` requests per
+    second. Buckets of the least recently seen keys are dropped beyond
+    `max_keys` (a dropped key starts again with a full bucket).
+    """
+
+    def __init__(self, rate: float, burst: int = 20, max_keys: int = 100000, clock=time.monotonic):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.max_keys = max(1, max_keys)
+        self._clock = clock
+        self._buckets = OrderedDict()
+
+        # Counters
+        self.allowed = 0
+        self.limited = 0
+
+    async def acquire(self, key: str, cost: int = 1) -> float:
+        """Take `cost` tokens from `key`'s bucket: 0.0 when allowed, else seconds until it would be"""
+        # A batch larger than the burst costs a full bucket
+        cost = min(cost, self.burst)
+        now = self._clock()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [float(self.burst), now]
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+
+        if bucket[0] >= cost:
+            bucket[0] -= cost
+            self.allowed += 1
+            return 0.0
+        self.limited += 1
+        return (cost - bucket[0]) / self.rate
+
+    def stats(self) -> dict:
+        return {
+            "rate_per_second": self.rate,
+            "burst": self.burst,
+            "keys": len(self._buckets),
+            "allowed": self.allowed,
+            "limited": self.limited,
+        }
+
+
+class SharedRateLimiter:
+    """
+    Fixed-window rate limit per key, counted in a shared state backend
+
+    Every worker counts against the same limit. Each window of
+    `burst / rate` seconds admits `burst` requests per key: the same
+    long-run rate and burst as RateLimiter, though a caller can get up to
+    two bursts through around a window boundary. Requests are allowed
+    while the backend is unreachable.
+    """
+
+    def __init__(self, backend, rate: float, burst: int = 20, prefix: str = "ratelimit:", clock=time.time):
+        self.backend = backend
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.window = self.burst / rate
+        self.prefix = prefix
+        # Wall time, so workers (and hosts) agree on the window
+        self._clock = clock
+
+        # Counters
+        self.allowed = 0
+        self.limited = 0
+        self.errors = 0
+
+    async def acquire(self, key: str, cost: int = 1) -> float:
+        """Count `cost` requests for `key`: 0.0 when allowed, else seconds until the next window"""
+        cost = min(cost, self.burst)
+        now = self._clock()
+        window = int(now // self.window)
+        try:
+            count = await self.backend.incr(f"{self.prefix}{key}:{window}", cost, ttl=self.window * 2)
+        except Exception as e:
+            if not self.errors:
+                logger.warning("Shared rate limit unavailable, allowing requests", extra={
+                    "error": type(e).__name__, "detail": str(e)
+                })
+            self.errors += 1
+            self.allowed += 1
+            return 0.0
+        if count <= self.burst:
+            self.allowed += 1
+            return 0.0
+        self.limited += 1
+        return (window + 1) * self.window - now
+
+    def stats(self) -> dict:
+        return {
+            "rate_per_second": self.rate,
+            "burst": self.burst,
+            "shared": True,
+            "window_seconds": round(self.window, 3),
+            "keys": None,
+            "allowed": self.allowed,
+            "limited": self.limited,
+            "errors": self.errors,
+        }
+
+
+def create_rate_limiter(settings, backend, workers: int = 1):
+    """
+    The RATE_LIMIT_RATE limiter, or None when disabled
+
+    With a shared `backend` the limit is counted there. Otherwise each of
+    `workers` processes keeps its own buckets, so each gets an equal share
+    of the rate and burst; the limit then only holds on average, as a
+    caller's connections are spread across the workers.
+    """
+    if settings.rate_limit_key not in RATE_LIMIT_KEYS:
+        raise ValueError(f"Unsupported RATE_LIMIT_KEY: {settings.rate_limit_key}")
+    rate, burst = settings.rate_limit_rate, settings.rate_limit_burst
+    if rate <= 0:
+        return None
+    if backend.shared:
+        return SharedRateLimiter(backend, rate, burst)
+    if workers > 1:
+        rate, burst = rate / workers, max(1, round(burst / workers))
+        logger.info("Rate limit split across workers without shared state", extra={
+            "workers": workers, "rate_per_second": rate, "burst": burst
+        })
+    return RateLimiter(rate, burst)
+
+
+class LoadShedder:
+    """
+    Global admission control for topic jokes
+
+    `pending()` returns the generations in flight or queued; at
+    `max_pending` or more the agent is overloaded and new topic requests
+    are shed: answered with a classic joke (`joke`) or refused with 429
+    (`reject`).
+    """
+
+    def __init__(self, pending, max_pending: int = 64, mode: str = "joke"):
+        if mode not in SHED_MODES:
+            raise ValueError(f"Unsupported ADMISSION_SHED: {mode}")
+        self.pending = pending
+        self.max_pending = max_pending
+        self.mode = mode
+        self.shed = dict.fromkeys(SHED_MODES, 0)
+
+    def overloaded(self) -> bool:
+        return self.pending() >= self.max_pending
+
+    def record(self, action: str):
+        """Count a request shed with `action` (joke or reject)"""
+        self.shed[action] += 1
+
+    def stats(self) -> dict:
+        return {"max_pending": self.max_pending, "pending": self.pending(), "mode": self.mode, "shed": dict(self.shed)}
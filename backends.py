@@ -0,0 +1,356 @@
+"""
+Generation backends for the Dad Joke Agent
+Pluggable topic-joke generators with latency-based routing and hedged requests
+
+`openai` is the OpenAI API, `local` any OpenAI-compatible server
+(LOCAL_MODEL_URL) and `markov` an offline generator trained on the joke
+corpus. GenerationRouter tries them in priority or latency order, fails
+over when one errors and can hedge: when the first backend hasn't answered
+within its recent p90 (GENERATION_HEDGE_QUANTILE) the next one is asked
+too, and whichever answers first wins.
+"""
+
+import asyncio
+import random
+import re
+import time
+from collections import deque
+
+from generation import create_local_generator
+from logging_setup import get_logger
+
+
+logger = get_logger("backends")
+
+# GENERATION_BACKENDS entries
+BACKEND_NAMES = ("openai", "local", "markov")
+# GENERATION_ROUTING values
+ROUTING_MODES = ("priority", "latency")
+
+# Latencies kept per backend for routing and hedge delays
+LATENCY_WINDOW = 256
+# Latencies needed before a backend's percentiles are trusted
+MIN_SAMPLES = 20
+ARTICLE = re.compile(r"^(the|a|an)\s+", re.IGNORECASE)
+# Never hedge sooner than this many seconds, however fast a backend usually is
+MIN_HEDGE_DELAY = 0.05
+
+
+class GenerationBackend:
+    """Interface for topic-joke generators"""
+
+    name = "backend"
+
+    async def generate(self, topic: str) -> str:
+        """A joke about `topic`; raises when the backend can't provide one"""
+        raise NotImplementedError
+
+    def warm(self):
+        """Prepare for the first request (called during warmup)"""
+
+    async def close(self):
+        """Release any connections"""
+
+    def stats(self) -> dict:
+        return {}
+
+
+class OpenAIBackend(GenerationBackend):
+    """
+    A JokeGenerator, for OpenAI or an OpenAI-compatible server
+
+    Generations go through `batcher` (a JokeBatcher) when one is given.
+    """
+
+    def __init__(self, name: str, generator, batcher=None):
+        self.name = name
+        self.generator = generator
+        self.batcher = batcher
+
+    async def generate(self, topic: str) -> str:
+        return await (self.batcher or self.generator).generate(topic)
+
+    def warm(self):
+        return type(self.generator.client).__name__
+
+    async def close(self):
+        await self.generator.close()
+
+    def stats(self) -> dict:
+        return {"model": self.generator.model, "in_flight": self.generator.in_flight,
+                "breaker": self.generator.breaker.state if self.generator.breaker else None}
+
+
+class MarkovBackend(GenerationBackend):
+    """
+    Offline jokes from a word-level Markov chain over the joke corpus
+
+    A joke opens with a question about the topic ("Why did the pirate")
+    and continues along the chain, backing off from two-word to one-word
+    states, and past a word the corpus never uses (usually the topic) as
+    if it were one the corpus has in its place. Jokes are rough but
+    instant and free. The chain is built from up to `max_jokes` corpus jokes on first
+    use (or at warmup).
+    """
+
+    name = "markov"
+
+    OPENINGS = ("Why did the {topic}", "What do you call a {topic}", "How does a {topic}",
+                "What did the {topic} say")
+    END = None
+
+    def __init__(self, corpus, max_words: int = 30, max_jokes: int = 5000, rng: random.Random = None):
+        self.corpus = corpus
+        self.max_words = max_words
+        self.max_jokes = max_jokes
+        self.random = rng or random.Random()
+        self._pairs = None
+        self._words = None
+        self.generated = 0
+
+    def build(self) -> int:
+        """Train the chain; returns the number of two-word states"""
+        pairs, words = {}, {}
+        count = len(self.corpus)
+        step = max(1, count // self.max_jokes) if self.max_jokes else 1
+        for joke_id in range(0, count, step):
+            tokens = self.corpus.joke(joke_id).split() + [self.END]
+            for i in range(1, len(tokens)):
+                words.setdefault(tokens[i - 1].lower(), []).append(tokens[i])
+                if i >= 2:
+                    pairs.setdefault((tokens[i - 2].lower(), tokens[i - 1].lower()), []).append(tokens[i])
+        self._pairs, self._words = pairs, words
+        return len(pairs)
+
+    def warm(self):
+        return self.build() if self._pairs is None else len(self._pairs)
+
+    def _followers(self, previous: str, word: str):
+        return self._pairs.get((previous.lower(), word.lower())) or self._words.get(word.lower())
+
+    def _next(self, words: list):
+        followers = self._followers(words[-2], words[-1])
+        if not followers and len(words) >= 3:
+            stand_in = self.random.choice(self._pairs.get((words[-3].lower(), words[-2].lower())) or [self.END])
+            if stand_in is not self.END:
+                followers = self._followers(words[-2], stand_in)
+        if not followers:
+            return self.END
+        return self.random.choice(followers)
+
+    def compose(self, topic: str, attempts: int = 5) -> str:
+        """A joke about `topic`, preferring one with a question and an answer"""
+        if self._pairs is None:
+            self.build()
+        if not self._words:
+            raise ValueError("Joke corpus is empty")
+        # The openings bring their own article
+        topic = ARTICLE.sub("", topic.strip()) or topic
+        for _ in range(attempts):
+            words = self.random.choice(self.OPENINGS).format(topic=topic).split()
+            # Stop after the answer's first sentence
+            answered = False
+            while len(words) < self.max_words:
+                word = self._next(words)
+                if word is self.END:
+                    break
+                words.append(word)
+                if word[-1] in ".!" and any(w.endswith("?") for w in words[:-1]):
+                    answered = True
+                    break
+            if answered:
+                break
+        joke = " ".join(words)
+        return joke if joke[-1] in ".!?" else joke + "!"
+
+    async def generate(self, topic: str) -> str:
+        joke = self.compose(topic)
+        self.generated += 1
+        return joke
+
+    def stats(self) -> dict:
+        return {"states": len(self._pairs) if self._pairs is not None else None, "generated": self.generated}
+
+
+class GenerationRouter:
+    """
+    Routes topic generations across backends
+
+    With `routing` `priority` backends are tried in the order given; with
+    `latency` the one with the lowest recent median goes first (backends
+    still without `MIN_SAMPLES` latencies are tried first so they get
+    measured). A backend that fails hands over to the next. With
+    `hedge_quantile` set (e.g. 0.9), a first backend that hasn't answered
+    within that quantile of its recent latencies (or `hedge_delay` seconds
+    until enough are known) is joined by the next backend, and the first
+    joke back wins; the loser is cancelled.
+    """
+
+    def __init__(self, backends: list, routing: str = "priority", hedge_quantile: float = 0.0,
+                 hedge_delay: float = 1.0, metrics=None):
+        if routing not in ROUTING_MODES:
+            raise ValueError(f"Unsupported GENERATION_ROUTING: {routing}")
+        self.backends = list(backends)
+        self.routing = routing
+        self.hedge_quantile = hedge_quantile
+        self.hedge_delay = hedge_delay
+        self.metrics = metrics
+        self._latencies = {backend.name: deque(maxlen=LATENCY_WINDOW) for backend in self.backends}
+
+        # Counters
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+
+    def latency(self, backend: GenerationBackend, quantile: float):
+        """`quantile` of the backend's recent successful latencies, or None until MIN_SAMPLES"""
+        samples = self._latencies[backend.name]
+        if len(samples) < MIN_SAMPLES:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(quantile * len(ordered)))]
+
+    def order(self) -> list:
+        if self.routing == "priority":
+            return list(self.backends)
+        # Unmeasured backends first, then fastest median; ties keep their priority
+        return sorted(self.backends, key=lambda backend: self.latency(backend, 0.5) or 0.0)
+
+    def _hedge_after(self, backend: GenerationBackend) -> float:
+        latency = self.latency(backend, self.hedge_quantile)
+        return self.hedge_delay if latency is None else max(latency, MIN_HEDGE_DELAY)
+
+    async def generate(self, topic: str) -> str:
+        """A joke from the first backend to answer; raises the last error if every backend fails"""
+        joke, _ = await self.answer(topic)
+        return joke
+
+    async def answer(self, topic: str) -> tuple:
+        """Like `generate()`, returning `(joke, name)` with the name of the backend that answered"""
+        candidates = self.order()
+        tasks = {}
+        error = None
+
+        def launch():
+            backend = candidates.pop(0)
+            tasks[asyncio.ensure_future(self._call(backend, topic))] = backend
+
+        launch()
+        first = next(iter(tasks.values()))
+        try:
+            while tasks:
+                timeout = None
+                if self.hedge_quantile > 0 and candidates and len(tasks) == 1:
+                    timeout = self._hedge_after(next(iter(tasks.values())))
+                done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # Slower than usual - ask the next backend as well
+                    self.hedged += 1
+                    self._count("hedged")
+                    launch()
+                    continue
+                for task in done:
+                    backend = tasks.pop(task)
+                    try:
+                        joke = task.result()
+                    except Exception as e:
+                        error = e
+                        continue
+                    if tasks and backend is not first:
+                        self.hedge_wins += 1
+                        self._count("hedge_won")
+                    return joke, backend.name
+                if not tasks and candidates:
+                    self.failovers += 1
+                    self._count("failover")
+                    logger.info("Generation backend failed, trying the next", extra={
+                        "error": type(error).__name__, "next": candidates[0].name
+                    })
+                    launch()
+        finally:
+            for task in tasks:
+                task.cancel()
+        raise error
+
+    async def _call(self, backend: GenerationBackend, topic: str) -> str:
+        started = time.perf_counter()
+        try:
+            joke = await backend.generate(topic)
+        except asyncio.CancelledError:
+            self._record(backend, "cancelled")
+            raise
+        except Exception:
+            self._record(backend, "error")
+            raise
+        latency = time.perf_counter() - started
+        self._latencies[backend.name].append(latency)
+        self._record(backend, "ok", latency)
+        return joke
+
+    def _record(self, backend: GenerationBackend, result: str, latency: float = None):
+        if self.metrics:
+            self.metrics.generation_requests.inc(backend.name, result)
+            if latency is not None:
+                self.metrics.generation_duration.observe(latency, backend.name)
+
+    def _count(self, event: str):
+        if self.metrics:
+            self.metrics.generation_routing.inc(event)
+
+    def warm(self) -> dict:
+        return {backend.name: backend.warm() for backend in self.backends}
+
+    async def close(self):
+        for backend in self.backends:
+            await backend.close()
+
+    def stats(self) -> dict:
+        backends = {}
+        for backend in self.backends:
+            p50, p90 = self.latency(backend, 0.5), self.latency(backend, 0.9)
+            backends[backend.name] = {
+                **backend.stats(),
+                "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+                "p90_ms": round(p90 * 1000, 1) if p90 is not None else None,
+            }
+        return {
+            "routing": self.routing,
+            "order": [backend.name for backend in self.order()],
+            "hedge_quantile": self.hedge_quantile,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "failovers": self.failovers,
+            "backends": backends,
+        }
+
+
+def create_router(settings, corpus, openai_generator=None, batcher=None, metrics=None):
+    """
+    Build a GenerationRouter over the GENERATION_BACKENDS that are configured, else None
+
+    `openai` needs OPENAI_API_KEY (`openai_generator`) and `local` needs
+    LOCAL_MODEL_URL; unconfigured entries are skipped.
+    """
+    backends = []
+    for name in settings.generation_backends:
+        if name not in BACKEND_NAMES:
+            raise ValueError(f"Unsupported GENERATION_BACKENDS entry: {name}")
+        if name == "openai" and openai_generator:
+            backends.append(OpenAIBackend("openai", openai_generator, batcher))
+        elif name == "local":
+            generator = create_local_generator(settings)
+            if generator is None:
+                logger.warning("GENERATION_BACKENDS lists local but LOCAL_MODEL_URL is not set")
+            else:
+                backends.append(OpenAIBackend("local", generator))
+        elif name == "markov":
+            backends.append(MarkovBackend(corpus))
+    if not backends:
+        return None
+    return GenerationRouter(
+        backends,
+        routing=settings.generation_routing,
+        hedge_quantile=settings.generation_hedge_quantile,
+        hedge_delay=settings.generation_hedge_delay_ms / 1000,
+        metrics=metrics
+    )
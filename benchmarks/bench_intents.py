@@ -0,0 +1,91 @@
+"""
+Intent classifier micro-benchmark
+Times IntentClassifier.classify per message against the old substring scan
+
+Run from the repository root:
+
+    python benchmarks/bench_intents.py [--budget-ns 1000] [--first-seen-budget-ns 2500]
+
+Repeated messages are answered from the classifier's cache; first-seen
+messages are classified from scratch (cache disabled). Exits non-zero when
+either mean time per message exceeds its budget.
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from intents import IntentClassifier  # noqa: E402
+
+
+# A mix of typical chat traffic: greetings, random requests, topics and help
+MESSAGES = [
+    "hi",
+    "Hello!",
+    "Tell me a dad joke",
+    "tell me a joke about cats",
+    "Give me a food joke",
+    "Joke about programming please",
+    "make me laugh",
+    "/help",
+    "What can you do?",
+    "this whey protein",
+    "surprise me",
+    "Can you tell me a really silly joke about the weather in Amsterdam?",
+]
+
+LEGACY_KEYWORDS = ["random", "any", "surprise", "tell me a joke", "give me a joke",
+                   "dad joke", "make me laugh", "joke please", "hi", "hello", "hey"]
+
+
+def legacy_is_random(user_request: str) -> bool:
+    """The substring scan the classifier replaced"""
+    return not user_request or any(keyword in user_request.lower() for keyword in LEGACY_KEYWORDS)
+
+
+def per_message_ns(func, rounds: int, repeat: int) -> float:
+    def run():
+        for message in MESSAGES:
+            func(message)
+    best = min(timeit.repeat(run, number=rounds, repeat=repeat))
+    return best / (rounds * len(MESSAGES)) * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--budget-ns", type=float, default=1000.0,
+                        help="maximum mean nanoseconds per repeated message")
+    parser.add_argument("--first-seen-budget-ns", type=float, default=2500.0,
+                        help="maximum mean nanoseconds per first-seen message")
+    args = parser.parse_args()
+
+    classify = IntentClassifier().classify
+    for message in MESSAGES:
+        print(f"  {message!r:72} -> {classify(message)}")
+
+    repeated_ns = per_message_ns(classify, args.rounds, args.repeat)
+    first_seen_ns = per_message_ns(IntentClassifier(cache_size=0).classify, args.rounds, args.repeat)
+    legacy_ns = per_message_ns(legacy_is_random, args.rounds, args.repeat)
+    print(f"\nclassify, repeated message:   {repeated_ns:8.1f} ns/message")
+    print(f"classify, first-seen message: {first_seen_ns:8.1f} ns/message")
+    print(f"legacy substring scan:        {legacy_ns:8.1f} ns/message")
+
+    failed = False
+    for label, ns, budget in (("repeated", repeated_ns, args.budget_ns),
+                              ("first-seen", first_seen_ns, args.first_seen_budget_ns)):
+        if ns > budget:
+            print(f"FAIL: {label} messages over budget of {budget:.0f} ns/message")
+            failed = True
+        else:
+            print(f"OK: {label} messages within budget of {budget:.0f} ns/message")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
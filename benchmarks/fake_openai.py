@@ -0,0 +1,149 @@
+"""
+Fake OpenAI server for benchmarks
+Local stand-in for the chat completions API with injectable latency and errors
+
+    python benchmarks/fake_openai.py --port 2199 --latency-ms 300 --jitter-ms 100 --error-rate 0.05
+
+Point the agent at it with:
+
+    OPENAI_API_KEY=fake OPENAI_BASE_URL=http://localhost:2199/v1 python main.py
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+
+from aiohttp import web
+
+
+JOKES = [
+    "Why did the {topic} go to therapy? It had too many unresolved issues!",
+    "I told a {topic} joke once. It didn't land, but it really stuck the pun-ishment!",
+    "What do you call a {topic} that tells dad jokes? A faux pa!",
+]
+
+
+class FakeOpenAI:
+    """
+    Serves POST /v1/chat/completions
+
+    Every call waits `latency_ms` plus up to `jitter_ms`; a fraction
+    `error_rate` of calls fail with HTTP 500 (and `timeout_rate` hang past
+    any sane client timeout). Streaming requests are answered word by word
+    over SSE, spreading the latency across the chunks. Batched prompts (a
+    numbered topic list) get a JSON array of jokes, except for a fraction
+    `bad_batch_rate` answered with prose to exercise the parse fallback.
+    """
+
+    def __init__(self, latency_ms: float = 300, jitter_ms: float = 0, error_rate: float = 0.0,
+                 timeout_rate: float = 0.0, seed: int = None, bad_batch_rate: float = 0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.bad_batch_rate = bad_batch_rate
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.errors = 0
+
+    def _latency(self) -> float:
+        return (self.latency_ms + self.random.uniform(0, self.jitter_ms)) / 1000
+
+    def _joke(self, body: dict) -> str:
+        messages = body.get("messages") or [{}]
+        content = str(messages[-1].get("content", ""))
+        topics = re.findall(r"^\d+\. (.+)$", content, re.MULTILINE)
+        if topics:
+            if self.random.random() < self.bad_batch_rate:
+                return "Here are your jokes! " + " ".join(self.random.choice(JOKES).format(topic=t) for t in topics)
+            return json.dumps([self.random.choice(JOKES).format(topic=topic) for topic in topics])
+        topic = content.split()[-1:] or ["dad"]
+        return self.random.choice(JOKES).format(topic=topic[0].strip(".!?"))
+
+    async def chat_completions(self, request: web.Request) -> web.StreamResponse:
+        self.calls += 1
+        body = await request.json()
+
+        roll = self.random.random()
+        if roll < self.timeout_rate:
+            await asyncio.sleep(3600)
+        if roll < self.timeout_rate + self.error_rate:
+            self.errors += 1
+            await asyncio.sleep(self._latency() / 2)
+            return web.json_response(
+                {"error": {"message": "Injected failure", "type": "server_error"}}, status=500
+            )
+
+        text = self._joke(body)
+        if body.get("stream"):
+            return await self._stream(request, body, text)
+
+        await asyncio.sleep(self._latency())
+        words = len(text.split())
+        return web.json_response({
+            "id": f"chatcmpl-fake-{self.calls}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": text},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 40, "completion_tokens": words, "total_tokens": 40 + words},
+        })
+
+    async def _stream(self, request: web.Request, body: dict, text: str) -> web.StreamResponse:
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        words = text.split(" ")
+        delay = self._latency() / len(words)
+        for i, word in enumerate(words):
+            await asyncio.sleep(delay)
+            chunk = {
+                "id": f"chatcmpl-fake-{self.calls}",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model", "fake"),
+                "choices": [{
+                    "index": 0,
+                    "delta": {"content": word if i == 0 else " " + word},
+                    "finish_reason": None,
+                }],
+            }
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response({"calls": self.calls, "errors": self.errors})
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        app.router.add_get("/stats", self.stats)
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake OpenAI chat completions server")
+    parser.add_argument("--port", type=int, default=2199)
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls answered with HTTP 500")
+    parser.add_argument("--timeout-rate", type=float, default=0.0, help="fraction of calls that never answer")
+    parser.add_argument("--bad-batch-rate", type=float, default=0.0,
+                        help="fraction of batched calls answered with unparseable prose")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    fake = FakeOpenAI(args.latency_ms, args.jitter_ms, args.error_rate, args.timeout_rate, args.seed, args.bad_batch_rate)
+    print(f"Fake OpenAI listening on http://localhost:{args.port}/v1")
+    web.run_app(fake.create_app(), port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Fake Redis server for local testing
+In-memory stand-in speaking enough of the Redis protocol (RESP2) for the agent
+
+    python benchmarks/fake_redis.py --port 6399
+
+Then run the agent with SHARED_STATE_URL / CONVERSATION_STORAGE_URL set to
+redis://localhost:6399/0. Supports PING, AUTH, SELECT, GET, MGET, SET (EX/PX),
+DEL, INCRBY, PEXPIRE, DBSIZE and FLUSHDB; data is kept per database number.
+"""
+
+import argparse
+import asyncio
+import time
+
+
+class FakeRedis:
+    """Command handlers over a dict per database of key -> (value, expires_at)"""
+
+    def __init__(self):
+        self.databases = {}
+
+    def _live(self, db: dict, key: bytes):
+        item = db.get(key)
+        if item is not None and item[1] is not None and item[1] <= time.monotonic():
+            del db[key]
+            return None
+        return item
+
+    def execute(self, session: dict, args: list):
+        command = args[0].upper().decode()
+        db = self.databases.setdefault(session["db"], {})
+        handler = getattr(self, f"cmd_{command.lower()}", None)
+        if handler is None:
+            return Error(f"ERR unknown command '{command}'")
+        try:
+            return handler(session, db, *args[1:])
+        except (TypeError, ValueError, IndexError):
+            return Error(f"ERR wrong arguments for '{command}'")
+
+    def cmd_ping(self, session, db, *args):
+        return args[0] if args else "PONG"
+
+    def cmd_auth(self, session, db, *args):
+        return "OK"
+
+    def cmd_select(self, session, db, index):
+        session["db"] = int(index)
+        return "OK"
+
+    def cmd_get(self, session, db, key):
+        item = self._live(db, key)
+        return item[0] if item else None
+
+    def cmd_mget(self, session, db, *keys):
+        return [self.cmd_get(session, db, key) for key in keys]
+
+    def cmd_set(self, session, db, key, value, *options):
+        expires_at = None
+        options = [option.upper() for option in options]
+        for i, option in enumerate(options):
+            if option == b"PX":
+                expires_at = time.monotonic() + int(options[i + 1]) / 1000
+            elif option == b"EX":
+                expires_at = time.monotonic() + int(options[i + 1])
+        db[key] = (value, expires_at)
+        return "OK"
+
+    def cmd_del(self, session, db, *keys):
+        return sum(1 for key in keys if self._live(db, key) is not None and db.pop(key, None))
+
+    def cmd_incrby(self, session, db, key, amount):
+        item = self._live(db, key)
+        value = int(item[0] if item else 0) + int(amount)
+        db[key] = (str(value).encode(), item[1] if item else None)
+        return value
+
+    def cmd_pexpire(self, session, db, key, milliseconds):
+        item = self._live(db, key)
+        if item is None:
+            return 0
+        db[key] = (item[0], time.monotonic() + int(milliseconds) / 1000)
+        return 1
+
+    def cmd_dbsize(self, session, db):
+        return sum(1 for key in list(db) if self._live(db, key) is not None)
+
+    def cmd_flushdb(self, session, db):
+        db.clear()
+        return "OK"
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        session = {"db": 0}
+        try:
+            while True:
+                args = await read_command(reader)
+                if args is None:
+                    break
+                writer.write(encode(self.execute(session, args)))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+class Error(str):
+    """Error reply"""
+
+
+async def read_command(reader: asyncio.StreamReader):
+    line = await reader.readline()
+    if not line:
+        return None
+    if not line.startswith(b"*"):
+        # Inline command, e.g. from telnet
+        return line.split()
+    args = []
+    for _ in range(int(line[1:-2])):
+        length = int((await reader.readline())[1:-2])
+        args.append((await reader.readexactly(length + 2))[:-2])
+    return args
+
+
+def encode(reply) -> bytes:
+    if reply is None:
+        return b"$-1\r\n"
+    if isinstance(reply, Error):
+        return b"-%s\r\n" % reply.encode()
+    if isinstance(reply, str):
+        return b"+%s\r\n" % reply.encode()
+    if isinstance(reply, int):
+        return b":%d\r\n" % reply
+    if isinstance(reply, bytes):
+        return b"$%d\r\n%s\r\n" % (len(reply), reply)
+    return b"*%d\r\n" % len(reply) + b"".join(encode(item) for item in reply)
+
+
+async def serve(port: int):
+    server = await asyncio.start_server(FakeRedis().handle, "127.0.0.1", port)
+    print(f"Fake Redis listening on redis://localhost:{port}/0")
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Redis server for local testing")
+    parser.add_argument("--port", type=int, default=6399)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
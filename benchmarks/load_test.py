@@ -0,0 +1,332 @@
+"""
+Load test for the Dad Joke Agent
+Drives /api/messages with Activities and JSON-RPC calls and reports latency per route
+
+Against a running agent:
+
+    python benchmarks/load_test.py --url http://localhost:2009 --concurrency 32 --requests 5000
+
+Self-contained, with a fake OpenAI server and the agent started for you:
+
+    python benchmarks/load_test.py --spawn --latency-ms 300 --error-rate 0.05 --duration 30
+
+Exercising request deadlines with upstream calls that never answer:
+
+    python benchmarks/load_test.py --spawn --timeout-rate 0.05 --duration 30
+
+Replaying a recorded trace (one request per line, see README):
+
+    python benchmarks/load_test.py --spawn --trace requests.jsonl --paced
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import uuid
+
+import aiohttp
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_openai import FakeOpenAI  # noqa: E402
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ROUTES = ("activity", "jsonrpc", "stream")
+
+# Half random requests, half topics (the topics go to OpenAI unless cached)
+MESSAGES = [
+    "Tell me a dad joke",
+    "hi",
+    "make me laugh",
+    "random joke please",
+    "tell me a joke about cats",
+    "give me a food joke",
+    "joke about programming",
+    "tell me a joke about the weather",
+]
+
+
+def activity_body(text: str, conversation: str) -> dict:
+    return {
+        "type": "message",
+        "id": uuid.uuid4().hex,
+        "text": text,
+        "from": {"id": "load-test-user", "name": "Load Test"},
+        "recipient": {"id": "dad-joke-agent", "name": "Dad Joke Agent"},
+        "conversation": {"id": conversation},
+        "channelId": "load-test",
+        "serviceUrl": "http://localhost/",
+    }
+
+
+def jsonrpc_body(text: str, conversation: str, method: str = "message/send") -> dict:
+    return {
+        "jsonrpc": "2.0",
+        "id": uuid.uuid4().hex,
+        "method": method,
+        "params": {
+            "message": {
+                "role": "user",
+                "contextId": conversation,
+                "parts": [{"kind": "text", "text": text}],
+            }
+        },
+    }
+
+
+def route_of(body) -> str:
+    """Route name of a recorded request body"""
+    if isinstance(body, list):
+        return "batch"
+    if body.get("jsonrpc"):
+        return "stream" if body.get("method") == "message/stream" else "jsonrpc"
+    return "activity"
+
+
+def generated_requests(routes: list, conversations: int, seed: int = None):
+    """Endless stream of (route, body, offset) with a random message mix"""
+    rng = random.Random(seed)
+    for n in itertools.count():
+        route = routes[n % len(routes)]
+        text = rng.choice(MESSAGES)
+        conversation = f"load-{rng.randrange(conversations)}"
+        if route == "activity":
+            body = activity_body(text, conversation)
+        else:
+            body = jsonrpc_body(text, conversation, "message/stream" if route == "stream" else "message/send")
+        yield route, body, None
+
+
+def trace_requests(path: str):
+    """
+    Requests from a JSONL trace
+
+    Each line is either a request body or an object with "body" and
+    optional "route" and "at" (seconds since the start of the trace).
+    """
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if isinstance(record, dict) and "body" in record:
+                body = record["body"]
+                yield record.get("route") or route_of(body), body, record.get("at")
+            else:
+                yield route_of(record), record, None
+
+
+class Results:
+    """Latency samples and error counts per route"""
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.started = time.perf_counter()
+        self.finished = None
+
+    def add(self, route: str, seconds: float, ok: bool):
+        self.latencies.setdefault(route, []).append(seconds)
+        if not ok:
+            self.errors[route] = self.errors.get(route, 0) + 1
+
+    def summary(self) -> dict:
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        routes = {}
+        everything = []
+        for route, samples in sorted(self.latencies.items()):
+            everything.extend(samples)
+            routes[route] = _describe(samples, self.errors.get(route, 0), elapsed)
+        routes["total"] = _describe(everything, sum(self.errors.values()), elapsed)
+        return {"elapsed_seconds": round(elapsed, 3), "routes": routes}
+
+
+def percentile(ordered: list, fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return 0.0
+    rank = max(0, min(len(ordered) - 1, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def _describe(samples: list, errors: int, elapsed: float) -> dict:
+    ordered = sorted(samples)
+    return {
+        "requests": len(ordered),
+        "errors": errors,
+        "throughput_rps": round(len(ordered) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(ordered, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2) if ordered else 0.0,
+    }
+
+
+def print_report(summary: dict):
+    print(f"\n{'route':10} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for route, row in summary["routes"].items():
+        print(f"{route:10} {row['requests']:9d} {row['errors']:7d} {row['throughput_rps']:8.1f} "
+              f"{row['p50_ms']:9.2f} {row['p95_ms']:9.2f} {row['p99_ms']:9.2f} {row['max_ms']:9.2f}")
+    print(f"\nElapsed: {summary['elapsed_seconds']}s")
+
+
+async def send(session: aiohttp.ClientSession, url: str, route: str, body) -> bool:
+    """POST one request and read the full response; True when it succeeded"""
+    async with session.post(url, json=body) as response:
+        payload = await response.read()
+        if response.status >= 400:
+            return False
+        if route == "jsonrpc" and payload:
+            reply = json.loads(payload)
+            return "error" not in reply
+        if route == "stream":
+            return b'"final": true' in payload
+        return True
+
+
+async def run_load(url: str, requests, concurrency: int, total: int = None, duration: float = None,
+                   paced: bool = False, record: str = None) -> Results:
+    """Send `requests` from `concurrency` workers until `total`/`duration` is reached or they run out"""
+    results = Results()
+    deadline = results.started + duration if duration else None
+    source = iter(requests)
+    if total:
+        source = itertools.islice(source, total)
+    recorder = open(record, "w", encoding="utf-8") if record else None
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=120)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+
+        async def worker():
+            for route, body, at in source:
+                now = time.perf_counter()
+                if deadline and now >= deadline:
+                    return
+                if paced and at is not None:
+                    delay = results.started + at - now
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                if recorder:
+                    recorder.write(json.dumps({"route": route, "at": round(now - results.started, 4), "body": body}) + "\n")
+                started = time.perf_counter()
+                try:
+                    ok = await send(session, url, route, body)
+                except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+                    ok = False
+                results.add(route, time.perf_counter() - started, ok)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    results.finished = time.perf_counter()
+    if recorder:
+        recorder.close()
+    return results
+
+
+async def wait_healthy(base_url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(f"{base_url}/health") as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"Agent at {base_url} did not become healthy")
+
+
+async def main_async(args):
+    runner = agent = None
+    base_url = args.url.rstrip("/")
+    try:
+        if args.spawn:
+            # Fake OpenAI in this process, agent in a child process
+            fake = FakeOpenAI(args.latency_ms, args.jitter_ms, args.error_rate, args.timeout_rate, seed=args.seed)
+            # Calls hung by --timeout-rate would otherwise hold up cleanup
+            runner = web.AppRunner(fake.create_app(), shutdown_timeout=1)
+            await runner.setup()
+            await web.TCPSite(runner, "localhost", args.openai_port).start()
+
+            env = {
+                **os.environ,
+                "PORT": str(args.port),
+                "BASE_URL": f"http://localhost:{args.port}",
+                "OPENAI_API_KEY": "fake",
+                "OPENAI_BASE_URL": f"http://localhost:{args.openai_port}/v1",
+                "LOG_LEVEL": os.environ.get("LOG_LEVEL", "WARNING"),
+            }
+            agent = subprocess.Popen([sys.executable, "main.py"], cwd=ROOT, env=env,
+                                     stdout=subprocess.DEVNULL)
+            base_url = f"http://localhost:{args.port}"
+        await wait_healthy(base_url)
+
+        if args.trace:
+            requests = trace_requests(args.trace)
+        else:
+            requests = generated_requests(args.routes.split(","), args.conversations, args.seed)
+
+        total = args.requests if not args.duration else None
+        print(f"Sending to {base_url}/api/messages with concurrency {args.concurrency}...")
+        results = await run_load(f"{base_url}/api/messages", requests, args.concurrency,
+                                 total=total, duration=args.duration, paced=args.paced,
+                                 record=args.record)
+        summary = results.summary()
+        if args.json:
+            print(json.dumps(summary, indent=2))
+        else:
+            print_report(summary)
+        return summary
+    finally:
+        if agent is not None:
+            agent.terminate()
+            agent.wait(timeout=30)
+        if runner is not None:
+            await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the Dad Joke Agent's /api/messages")
+    parser.add_argument("--url", default="http://localhost:2009", help="agent base URL (ignored with --spawn)")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=1000, help="number of requests to send")
+    parser.add_argument("--duration", type=float, help="send for this many seconds instead of --requests")
+    parser.add_argument("--routes", default="activity,jsonrpc",
+                        help=f"comma-separated mix of {', '.join(ROUTES)}")
+    parser.add_argument("--conversations", type=int, default=100, help="distinct conversation ids")
+    parser.add_argument("--trace", help="replay a JSONL trace instead of generating requests")
+    parser.add_argument("--paced", action="store_true", help="honour the trace's \"at\" offsets")
+    parser.add_argument("--record", help="write every request sent to this JSONL trace")
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON")
+    parser.add_argument("--seed", type=int)
+
+    spawn = parser.add_argument_group("spawned agent and fake OpenAI")
+    spawn.add_argument("--spawn", action="store_true", help="start a fake OpenAI server and the agent")
+    spawn.add_argument("--port", type=int, default=2109, help="port for the spawned agent")
+    spawn.add_argument("--openai-port", type=int, default=2199)
+    spawn.add_argument("--latency-ms", type=float, default=300)
+    spawn.add_argument("--jitter-ms", type=float, default=100)
+    spawn.add_argument("--error-rate", type=float, default=0.0)
+    spawn.add_argument("--timeout-rate", type=float, default=0.0, help="fraction of OpenAI calls that never answer")
+    args = parser.parse_args()
+
+    for route in args.routes.split(","):
+        if route not in ROUTES:
+            parser.error(f"unknown route {route!r}")
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Circuit breaker for the Dad Joke Agent
+Stops calling an unhealthy upstream and lets a single probe test its recovery
+"""
+
+import time
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the upstream while the circuit is open"""
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker
+
+    After `failure_threshold` failures in a row the circuit opens and
+    `check()` raises CircuitOpenError for `reset_timeout` seconds. Then it
+    is half-open: one probe call is let through, and its success closes the
+    circuit while its failure opens it again. A probe that ends some other
+    way (a local timeout, a 4xx) calls `release()` so the next call probes
+    instead; one that never reports back is replaced after another
+    `reset_timeout`.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0, clock=time.monotonic):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._failures = 0
+        self._opened_at = None
+        self._probe_started = None
+
+        # Counters
+        self.trips = 0
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return self.CLOSED
+        if self._clock() - self._opened_at < self.reset_timeout:
+            return self.OPEN
+        return self.HALF_OPEN
+
+    def check(self):
+        """Raise CircuitOpenError unless a call may go through now"""
+        state = self.state
+        if state == self.CLOSED:
+            return
+        if state == self.HALF_OPEN:
+            now = self._clock()
+            if self._probe_started is None or now - self._probe_started >= self.reset_timeout:
+                self._probe_started = now
+                return
+        self.rejected += 1
+        raise CircuitOpenError(f"Circuit open after {self._failures} consecutive failures")
+
+    def record_success(self):
+        self._failures = 0
+        self._opened_at = None
+        self._probe_started = None
+
+    def release(self):
+        """End a call that neither succeeded nor failed upstream, letting the next call probe"""
+        self._probe_started = None
+
+    def record_failure(self):
+        state = self.state
+        if state == self.OPEN:
+            # A call started before the circuit opened; don't extend the open period
+            return
+        self._failures += 1
+        if state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+            self.trips += 1
+            self._opened_at = self._clock()
+            self._probe_started = None
+
+    def stats(self) -> dict:
+        state = self.state
+        stats = {
+            "state": state,
+            "consecutive_failures": self._failures,
+            "failure_threshold": self.failure_threshold,
+            "reset_timeout_seconds": self.reset_timeout,
+            "trips": self.trips,
+            "rejected": self.rejected,
+        }
+        if state == self.OPEN:
+            stats["retry_in_seconds"] = round(self.reset_timeout - (self._clock() - self._opened_at), 1)
+        return stats
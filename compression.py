@@ -0,0 +1,137 @@
+"""
+Response compression for the Dad Joke Agent
+Negotiates gzip or brotli from Accept-Encoding for JSON response bodies
+
+Static documents are compressed once, at the highest levels, whenever they
+are (re)loaded; dynamic replies are compressed per response at faster
+levels. Brotli is offered when the `brotli` package is installed
+(`pip install brotli`); gzip always works.
+"""
+
+import gzip
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# COMPRESSION values
+COMPRESSION_MODES = ("auto", "gzip", "off")
+# Bodies smaller than this aren't worth compressing
+DEFAULT_MIN_SIZE = 256
+
+# (static, dynamic) compression levels
+GZIP_LEVELS = (9, 6)
+BROTLI_QUALITY = (11, 5)
+
+
+def resolve_encodings(mode: str = "auto") -> tuple:
+    """Content codings offered for COMPRESSION `auto` (br if installed, then gzip), `gzip` or `off`"""
+    if mode not in COMPRESSION_MODES:
+        raise ValueError(f"Unsupported COMPRESSION: {mode}")
+    if mode == "off":
+        return ()
+    if mode == "auto" and brotli is not None:
+        return ("br", "gzip")
+    return ("gzip",)
+
+
+def accepted_encodings(header: str) -> dict:
+    """Map each coding in an Accept-Encoding header to its q-value"""
+    accepted = {}
+    for item in (header or "").split(","):
+        coding, _, params = item.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+def compress(body: bytes, coding: str, static: bool = False) -> bytes:
+    level = 0 if static else 1
+    if coding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY[level])
+    # mtime=0 keeps gzip output (and so the ETag) stable across reloads
+    return gzip.compress(body, compresslevel=GZIP_LEVELS[level], mtime=0)
+
+
+class ResponseCompression:
+    """
+    Content negotiation and compression for JSON responses
+
+    `encodings` are offered in order of preference; a client's highest
+    q-value wins, ties going to the earlier encoding. Bodies under
+    `min_size` bytes are sent as they are.
+    """
+
+    def __init__(self, mode: str = "auto", min_size: int = DEFAULT_MIN_SIZE):
+        self.mode = mode
+        self.encodings = resolve_encodings(mode)
+        self.min_size = min_size
+
+        # Counters
+        self.responses = dict.fromkeys(self.encodings, 0)
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def negotiate(self, request, size: int, offered=None):
+        """The coding to send a `size`-byte body in, or None for identity"""
+        offered = self.encodings if offered is None else offered
+        if not offered or size < self.min_size:
+            return None
+        header = request.headers.get("Accept-Encoding")
+        if not header:
+            return None
+        accepted = accepted_encodings(header)
+        best, best_q = None, 0.0
+        for coding in offered:
+            q = accepted.get(coding, accepted.get("*", 0.0))
+            if q > best_q:
+                best, best_q = coding, q
+        return best
+
+    def variants(self, body: bytes) -> dict:
+        """Pre-compressed copies of a static body, keeping only those that are smaller"""
+        if len(body) < self.min_size:
+            return {}
+        variants = {}
+        for coding in self.encodings:
+            compressed = compress(body, coding, static=True)
+            if len(compressed) < len(body):
+                variants[coding] = compressed
+        return variants
+
+    def dynamic(self, request, body: bytes):
+        """`(body, coding)` for a per-response body; coding is None when sent uncompressed"""
+        coding = self.negotiate(request, len(body))
+        if coding is None:
+            return body, None
+        compressed = compress(body, coding)
+        if len(compressed) >= len(body):
+            return body, None
+        self.record(coding, len(body), len(compressed))
+        return compressed, coding
+
+    def record(self, coding: str, size: int, compressed: int):
+        self.responses[coding] += 1
+        self.bytes_in += size
+        self.bytes_out += compressed
+
+    def stats(self) -> dict:
+        return {
+            "encodings": list(self.encodings),
+            "min_size": self.min_size,
+            "responses": dict(self.responses),
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+        }
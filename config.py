@@ -1,17 +1,218 @@
 """
 Configuration helper for Dad Joke Agent
-Loads BASE_URL from environment and generates endpoint URLs
+Loads settings from the environment and generates endpoint URLs
 """
 
 import os
+from dataclasses import dataclass
 from dotenv import load_dotenv
 
+from documents import substitute_base_url
+
 load_dotenv()
 
+
+def _int(name: str, default: int) -> int:
+    return int(os.getenv(name, default))
+
+
+def _float(name: str, default: float) -> float:
+    return float(os.getenv(name, default))
+
+
+@dataclass
+class Settings:
+    """
+    All agent settings in one place
+
+    `Settings.from_env()` reads them from the environment (and .env);
+    tests and embedding applications can build one directly or use
+    `dataclasses.replace()` to override individual fields.
+    """
+
+    port: int = 2009
+    base_url: str = "http://localhost:2009"
+
+    # Topic joke generation
+    openai_api_key: str = None
+    openai_model: str = "gpt-3.5-turbo"
+    openai_max_concurrency: int = 8
+    openai_timeout: float = 15.0
+    openai_attempt_timeout: float = 5.0
+    openai_retries: int = 2
+    openai_breaker_failures: int = 5
+    openai_breaker_reset: float = 30.0
+    openai_keepalive_expiry: float = 60.0
+    # Micro-batching: topics per batched completion (1 = off) and how long to collect them
+    openai_batch_size: int = 8
+    openai_batch_window_ms: float = 10.0
+
+    # Generation backends in priority order (openai, local, markov), routing and hedging (0 = off)
+    generation_backends: tuple = ("openai",)
+    generation_routing: str = "priority"
+    generation_hedge_quantile: float = 0.0
+    generation_hedge_delay_ms: float = 1000.0
+    # OpenAI-compatible local model server (Ollama, vLLM, llama.cpp ...)
+    local_model_url: str = None
+    local_model_name: str = "llama3.2"
+    local_model_api_key: str = "local"
+    local_model_max_concurrency: int = 4
+
+    # Seconds a request may take before upstream calls give up (0 = no limit)
+    request_deadline: float = 10.0
+
+    # Local joke corpus
+    joke_corpus_path: str = None
+    joke_history_size: int = 100
+    joke_max_conversations: int = 10000
+
+    # Conversation state
+    conversation_storage_url: str = "memory://"
+    conversation_state_ttl: float = 86400.0
+    conversation_state_max: int = 10000
+    conversation_flush_interval: float = 0.25
+
+    # Topic joke cache
+    joke_cache_size: int = 1024
+    joke_cache_ttl: float = 3600.0
+    joke_cache_pool: int = 5
+
+    # Warm pool of pre-generated jokes for popular and seed topics
+    warm_pool_topics: int = 20
+    warm_pool_seed: tuple = ()
+    warm_pool_depth: int = 5
+    warm_pool_low_water: int = 2
+    warm_pool_token_budget: int = 20000
+    warm_pool_interval: float = 30.0
+
+    # Discovery documents
+    document_max_age: int = 300
+    document_watch_interval: float = 0.0
+
+    # JSON-RPC and response encoding
+    max_batch_size: int = 50
+    json_encoder: str = "auto"
+    compression: str = "auto"
+    compression_min_size: int = 256
+
+    # Inbound HTTP connections
+    http_keepalive_timeout: float = 75.0
+    http_backlog: int = 128
+
+    # Rate limiting per conversation, channel or caller (0 = off) and load shedding
+    rate_limit_rate: float = 0.0
+    rate_limit_burst: int = 20
+    rate_limit_key: str = "conversation"
+    admission_max_pending: int = 64
+    admission_shed: str = "joke"
+
+    # Proactive replies: off, topic (only jokes that may need OpenAI) or all
+    proactive_replies: str = "off"
+    proactive_workers: int = 8
+    proactive_queue_size: int = 1000
+    proactive_retries: int = 3
+    proactive_timeout: float = 10.0
+
+    # Workers and shared state
+    workers: int = 1
+    worker_shutdown_timeout: float = 30.0
+    # Seconds between SIGTERM (readiness fails) and the server no longer accepting connections
+    drain_delay: float = 5.0
+    shared_state_url: str = "memory://"
+
+    # Logging
+    log_level: str = "INFO"
+    log_format: str = "text"
+    log_body_sample_rate: float = 0.0
+
+    # Startup
+    startup_budget_ms: float = 1000.0
+    # Seconds warmup may wait for the warm pool's first fill before accepting traffic
+    warmup_timeout: float = 10.0
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        port = _int("PORT", 2009)
+        return cls(
+            port=port,
+            base_url=os.getenv("BASE_URL", f"http://localhost:{port}"),
+            openai_api_key=os.getenv("OPENAI_API_KEY"),
+            openai_model=os.getenv("OPENAI_MODEL", "gpt-3.5-turbo"),
+            openai_max_concurrency=_int("OPENAI_MAX_CONCURRENCY", 8),
+            openai_timeout=_float("OPENAI_TIMEOUT", 15),
+            openai_attempt_timeout=_float("OPENAI_ATTEMPT_TIMEOUT", 5),
+            openai_retries=_int("OPENAI_RETRIES", 2),
+            openai_breaker_failures=_int("OPENAI_BREAKER_FAILURES", 5),
+            openai_breaker_reset=_float("OPENAI_BREAKER_RESET", 30),
+            openai_keepalive_expiry=_float("OPENAI_KEEPALIVE_EXPIRY", 60),
+            generation_backends=tuple(
+                b.strip().lower() for b in os.getenv("GENERATION_BACKENDS", "openai").split(",") if b.strip()
+            ),
+            generation_routing=os.getenv("GENERATION_ROUTING", "priority").lower(),
+            generation_hedge_quantile=_float("GENERATION_HEDGE_QUANTILE", 0),
+            generation_hedge_delay_ms=_float("GENERATION_HEDGE_DELAY_MS", 1000),
+            local_model_url=os.getenv("LOCAL_MODEL_URL") or None,
+            local_model_name=os.getenv("LOCAL_MODEL_NAME", "llama3.2"),
+            local_model_api_key=os.getenv("LOCAL_MODEL_API_KEY", "local"),
+            local_model_max_concurrency=_int("LOCAL_MODEL_MAX_CONCURRENCY", 4),
+            openai_batch_size=_int("OPENAI_BATCH_SIZE", 8),
+            openai_batch_window_ms=_float("OPENAI_BATCH_WINDOW_MS", 10),
+            request_deadline=_float("REQUEST_DEADLINE", 10),
+            joke_corpus_path=os.getenv("JOKE_CORPUS_PATH") or None,
+            joke_history_size=_int("JOKE_HISTORY_SIZE", 100),
+            joke_max_conversations=_int("JOKE_MAX_CONVERSATIONS", 10000),
+            conversation_storage_url=os.getenv("CONVERSATION_STORAGE_URL", "memory://"),
+            conversation_state_ttl=_float("CONVERSATION_STATE_TTL", 86400),
+            conversation_state_max=_int("CONVERSATION_STATE_MAX", 10000),
+            conversation_flush_interval=_float("CONVERSATION_FLUSH_INTERVAL", 0.25),
+            joke_cache_size=_int("JOKE_CACHE_SIZE", 1024),
+            joke_cache_ttl=_float("JOKE_CACHE_TTL", 3600),
+            joke_cache_pool=_int("JOKE_CACHE_POOL", 5),
+            warm_pool_topics=_int("WARM_POOL_TOPICS", 20),
+            warm_pool_seed=tuple(t.strip() for t in os.getenv("WARM_POOL_SEED", "").split(",") if t.strip()),
+            warm_pool_depth=_int("WARM_POOL_DEPTH", 5),
+            warm_pool_low_water=_int("WARM_POOL_LOW_WATER", 2),
+            warm_pool_token_budget=_int("WARM_POOL_TOKEN_BUDGET", 20000),
+            warm_pool_interval=_float("WARM_POOL_INTERVAL", 30),
+            document_max_age=_int("DOCUMENT_MAX_AGE", 300),
+            document_watch_interval=_float("DOCUMENT_WATCH_INTERVAL", 0),
+            max_batch_size=_int("MAX_BATCH_SIZE", 50),
+            json_encoder=os.getenv("JSON_ENCODER", "auto"),
+            compression=os.getenv("COMPRESSION", "auto").lower(),
+            compression_min_size=_int("COMPRESSION_MIN_SIZE", 256),
+            http_keepalive_timeout=_float("HTTP_KEEPALIVE_TIMEOUT", 75),
+            http_backlog=_int("HTTP_BACKLOG", 128),
+            rate_limit_rate=_float("RATE_LIMIT_RATE", 0),
+            rate_limit_burst=_int("RATE_LIMIT_BURST", 20),
+            rate_limit_key=os.getenv("RATE_LIMIT_KEY", "conversation").lower(),
+            admission_max_pending=_int("ADMISSION_MAX_PENDING", 64),
+            admission_shed=os.getenv("ADMISSION_SHED", "joke").lower(),
+            proactive_replies=os.getenv("PROACTIVE_REPLIES", "off").lower(),
+            proactive_workers=_int("PROACTIVE_WORKERS", 8),
+            proactive_queue_size=_int("PROACTIVE_QUEUE_SIZE", 1000),
+            proactive_retries=_int("PROACTIVE_RETRIES", 3),
+            proactive_timeout=_float("PROACTIVE_TIMEOUT", 10),
+            workers=_int("WORKERS", 1),
+            worker_shutdown_timeout=_float("WORKER_SHUTDOWN_TIMEOUT", 30),
+            drain_delay=_float("DRAIN_DELAY", 5),
+            shared_state_url=os.getenv("SHARED_STATE_URL", "memory://"),
+            log_level=os.getenv("LOG_LEVEL", "INFO"),
+            log_format=os.getenv("LOG_FORMAT", "text"),
+            log_body_sample_rate=_float("LOG_BODY_SAMPLE_RATE", 0),
+            startup_budget_ms=_float("STARTUP_BUDGET_MS", 1000),
+            warmup_timeout=_float("WARMUP_TIMEOUT", 10),
+        )
+
+    @property
+    def openai_enabled(self) -> bool:
+        return bool(self.openai_api_key) and self.openai_api_key != "your_openai_api_key_here"
+
+
 # Configuration
-PORT = int(os.getenv("PORT", 2009))
-BASE_URL = os.getenv("BASE_URL", f"http://localhost:{PORT}")
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+SETTINGS = Settings.from_env()
+PORT = SETTINGS.port
+BASE_URL = SETTINGS.base_url
+OPENAI_API_KEY = SETTINGS.openai_api_key
 
 
 def get_endpoint_urls():
@@ -34,9 +235,5 @@ def update_json_urls(json_data: dict) -> dict:
     Replace URL placeholders in JSON with actual BASE_URL
     Useful for dynamically serving manifest files
     """
-    import json
-
-    # Convert to string, replace placeholder, convert back
-    json_str = json.dumps(json_data)
-    json_str = json_str.replace("{BASE_URL}", BASE_URL)
-    return json.loads(json_str)
+    # Same single-pass substitution the agent uses for its precomputed documents
+    return substitute_base_url(json_data, BASE_URL)
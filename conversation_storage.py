@@ -0,0 +1,387 @@
+"""
+Conversation state storage for the Dad Joke Agent
+Bounded, persistent or shared replacements for the SDK's MemoryStorage
+
+Every backend implements the Microsoft 365 Agents SDK storage protocol
+(`read(keys, target_cls=...)`, `write(changes)`, `delete(keys)`) on top of
+plain JSON methods the agent uses directly for its own per-conversation
+state. `create_storage()` picks a backend from CONVERSATION_STORAGE_URL:
+
+    memory://                      bounded in-process LRU with TTL
+    sqlite:///var/lib/dadjoke.db   local SQLite file, shared by workers on one host
+    redis://localhost:6379/0       Redis-protocol server, shared by every worker
+"""
+
+import asyncio
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from logging_setup import get_logger
+from shared_state import RedisBackend
+
+
+logger = get_logger("storage")
+
+
+class ConversationStorage:
+    """
+    Base class: SDK storage protocol over JSON reads and writes
+
+    Subclasses implement `read_json`, `write_json` and `delete_json`;
+    values are JSON-serializable dicts.
+    """
+
+    # True when the state survives restarts or is visible to other workers
+    persistent = False
+
+    async def read_json(self, keys: list) -> dict:
+        """Values for the `keys` that exist; missing or expired keys are omitted"""
+        raise NotImplementedError
+
+    async def write_json(self, changes: dict):
+        """Store each key's value, replacing what was there"""
+        raise NotImplementedError
+
+    async def delete_json(self, keys: list):
+        """Remove `keys`, ignoring any that don't exist"""
+        raise NotImplementedError
+
+    async def close(self):
+        """Flush pending writes and release connections"""
+
+    def stats(self) -> dict:
+        return {"backend": type(self).__name__, "persistent": self.persistent}
+
+    # Microsoft 365 Agents SDK Storage protocol
+
+    async def read(self, keys: list, *, target_cls=None, **kwargs) -> dict:
+        _check_keys(keys, "read")
+        if not target_cls:
+            raise ValueError("Storage.read(): target_cls cannot be None.")
+        items = await self.read_json(list(keys))
+        return {key: target_cls.from_json_to_store_item(value) for key, value in items.items()}
+
+    async def write(self, changes: dict):
+        if not changes:
+            raise ValueError("Storage.write(): changes cannot be empty")
+        _check_keys(list(changes), "write")
+        await self.write_json({key: item.store_item_to_json() for key, item in changes.items()})
+
+    async def delete(self, keys: list):
+        _check_keys(keys, "delete")
+        await self.delete_json(list(keys))
+
+
+def _check_keys(keys, operation: str):
+    if not keys:
+        raise ValueError(f"Storage.{operation}(): keys are required")
+    if any(key == "" for key in keys):
+        raise ValueError(f"Storage.{operation}(): key cannot be empty")
+
+
+class LRUStorage(ConversationStorage):
+    """
+    In-process storage bounded by item count and age
+
+    The least recently used items are evicted past `max_items`; items
+    expire `ttl` seconds after they were last written.
+    """
+
+    def __init__(self, max_items: int = 10000, ttl: float = 86400.0):
+        self.max_items = max(1, max_items)
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self.evictions = 0
+        self.expirations = 0
+
+    def _live(self, key: str):
+        item = self._items.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._items[key]
+            self.expirations += 1
+            return None
+        self._items.move_to_end(key)
+        return value
+
+    async def read_json(self, keys: list) -> dict:
+        items = {}
+        for key in keys:
+            value = self._live(key)
+            if value is not None:
+                items[key] = value
+        return items
+
+    async def write_json(self, changes: dict):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        for key, value in changes.items():
+            self._items[key] = (value, expires_at)
+            self._items.move_to_end(key)
+        while len(self._items) > self.max_items:
+            self._items.popitem(last=False)
+            self.evictions += 1
+
+    async def delete_json(self, keys: list):
+        for key in keys:
+            self._items.pop(key, None)
+
+    def stats(self) -> dict:
+        return {
+            **super().stats(),
+            "items": len(self._items),
+            "max_items": self.max_items,
+            "ttl_seconds": self.ttl,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class SQLiteStorage(ConversationStorage):
+    """
+    State in a local SQLite file
+
+    Queries run on one background thread so the event loop never blocks
+    on disk. WAL mode lets the worker processes on a host share the file.
+    """
+
+    persistent = True
+
+    # Expired rows are skipped by reads and purged every this many writes
+    PURGE_EVERY = 500
+
+    def __init__(self, path: str = "conversations.db", ttl: float = 86400.0):
+        self.path = path
+        self.ttl = ttl
+        self._writes = 0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="dadjoke-sqlite")
+        self._db = None
+
+    def _connect(self):
+        if self._db is None:
+            db = sqlite3.connect(self.path, check_same_thread=False, timeout=5.0)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS conversation_state "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+            )
+            self._db = db
+        return self._db
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _read(self, keys: list) -> dict:
+        db = self._connect()
+        marks = ",".join("?" * len(keys))
+        rows = db.execute(
+            f"SELECT key, value FROM conversation_state WHERE key IN ({marks}) "
+            "AND (expires_at IS NULL OR expires_at > ?)",
+            (*keys, time.time())
+        ).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def _write(self, changes: dict):
+        db = self._connect()
+        expires_at = time.time() + self.ttl if self.ttl else None
+        with db:
+            db.executemany(
+                "INSERT OR REPLACE INTO conversation_state (key, value, expires_at) VALUES (?, ?, ?)",
+                [(key, json.dumps(value), expires_at) for key, value in changes.items()]
+            )
+            self._writes += 1
+            if self._writes % self.PURGE_EVERY == 0:
+                db.execute("DELETE FROM conversation_state WHERE expires_at <= ?", (time.time(),))
+
+    def _delete(self, keys: list):
+        db = self._connect()
+        with db:
+            db.executemany("DELETE FROM conversation_state WHERE key = ?", [(key,) for key in keys])
+
+    async def read_json(self, keys: list) -> dict:
+        return await self._run(self._read, keys)
+
+    async def write_json(self, changes: dict):
+        await self._run(self._write, changes)
+
+    async def delete_json(self, keys: list):
+        await self._run(self._delete, keys)
+
+    async def close(self):
+        if self._db is not None:
+            await self._run(self._db.close)
+            self._db = None
+        self._executor.shutdown(wait=False)
+
+    def stats(self) -> dict:
+        return {**super().stats(), "path": self.path, "ttl_seconds": self.ttl}
+
+
+class RedisStorage(ConversationStorage):
+    """State as JSON strings on a Redis-protocol server, expiring after `ttl`"""
+
+    persistent = True
+
+    def __init__(self, backend: RedisBackend, ttl: float = 86400.0, prefix: str = "state:"):
+        self.backend = backend
+        self.ttl = ttl
+        self.prefix = backend.prefix + prefix
+
+    async def read_json(self, keys: list) -> dict:
+        values = await self.backend.execute("MGET", *(self.prefix + key for key in keys))
+        return {key: json.loads(value) for key, value in zip(keys, values) if value is not None}
+
+    async def write_json(self, changes: dict):
+        expiry = ("PX", str(int(self.ttl * 1000))) if self.ttl else ()
+        # One SET per key (MSET can't expire keys), spread over the connection pool
+        await asyncio.gather(*(
+            self.backend.execute("SET", self.prefix + key, json.dumps(value), *expiry)
+            for key, value in changes.items()
+        ))
+
+    async def delete_json(self, keys: list):
+        await self.backend.execute("DEL", *(self.prefix + key for key in keys))
+
+    async def close(self):
+        await self.backend.close()
+
+    def stats(self) -> dict:
+        return {**super().stats(), "server": self.backend.describe(), "ttl_seconds": self.ttl}
+
+
+# Marks a key whose delete is waiting to be flushed
+_DELETED = object()
+
+
+class WriteBehindStorage(ConversationStorage):
+    """
+    Batch writes to a slower storage off the turn's latency path
+
+    Writes and deletes land in a pending buffer and return at once; a
+    background task flushes the buffer every `flush_interval` seconds, or
+    sooner once `max_pending` keys are waiting. Reads see pending values
+    first, so a conversation always reads its own writes. Failed flushes
+    are retried on the next interval.
+    """
+
+    def __init__(self, inner: ConversationStorage, flush_interval: float = 0.25, max_pending: int = 500):
+        self.inner = inner
+        self.persistent = inner.persistent
+        self.flush_interval = flush_interval
+        self.max_pending = max(1, max_pending)
+        self._pending = {}
+        self._wakeup = None
+        self._flusher = None
+        self.flushes = 0
+        self.flush_errors = 0
+
+    def _schedule(self):
+        if self._flusher is None or self._flusher.done():
+            self._wakeup = asyncio.Event()
+            self._flusher = asyncio.create_task(self._flush_loop())
+        if len(self._pending) >= self.max_pending:
+            self._wakeup.set()
+
+    async def _flush_loop(self):
+        while self._pending:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        """Write everything pending to the inner storage now"""
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        writes = {key: value for key, value in batch.items() if value is not _DELETED}
+        deletes = [key for key, value in batch.items() if value is _DELETED]
+        try:
+            if writes:
+                await self.inner.write_json(writes)
+            if deletes:
+                await self.inner.delete_json(deletes)
+            self.flushes += 1
+        except Exception as e:
+            self.flush_errors += 1
+            logger.warning("Conversation state flush failed", extra={
+                "error": type(e).__name__, "detail": str(e), "keys": len(batch)
+            })
+            # Retry later, unless newer changes replaced them meanwhile
+            for key, value in batch.items():
+                self._pending.setdefault(key, value)
+            await asyncio.sleep(self.flush_interval)
+
+    async def read_json(self, keys: list) -> dict:
+        items = {}
+        missing = []
+        for key in keys:
+            value = self._pending.get(key)
+            if value is None:
+                missing.append(key)
+            elif value is not _DELETED:
+                items[key] = value
+        if missing:
+            items.update(await self.inner.read_json(missing))
+        return items
+
+    async def write_json(self, changes: dict):
+        self._pending.update(changes)
+        self._schedule()
+
+    async def delete_json(self, keys: list):
+        for key in keys:
+            self._pending[key] = _DELETED
+        self._schedule()
+
+    async def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+        await self.inner.close()
+
+    def stats(self) -> dict:
+        return {
+            **self.inner.stats(),
+            "write_behind": {
+                "flush_interval": self.flush_interval,
+                "pending": len(self._pending),
+                "flushes": self.flushes,
+                "flush_errors": self.flush_errors,
+            },
+        }
+
+
+def create_storage(url: str = None, ttl: float = 86400.0, max_items: int = 10000,
+                   flush_interval: float = 0.25) -> ConversationStorage:
+    """
+    Build conversation storage from a URL
+
+    SQLite and Redis storage are wrapped in write-behind batching unless
+    `flush_interval` is 0.
+    """
+    if not url or url.startswith("memory:"):
+        return LRUStorage(max_items=max_items, ttl=ttl)
+    if url.startswith("sqlite:"):
+        # sqlite:///relative.db or sqlite:////absolute/path.db
+        path = urlparse(url).path[1:] or "conversations.db"
+        storage = SQLiteStorage(path, ttl=ttl)
+    elif url.startswith("redis:"):
+        storage = RedisStorage(RedisBackend.from_url(url), ttl=ttl)
+    else:
+        raise ValueError(f"Unsupported CONVERSATION_STORAGE_URL: {url}")
+    if flush_interval > 0:
+        storage = WriteBehindStorage(storage, flush_interval=flush_interval)
+    return storage
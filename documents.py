@@ -0,0 +1,191 @@
+"""
+Discovery documents for the Dad Joke Agent
+Loads the agent card, discovery, manifest and declarative agent JSON once,
+substitutes {BASE_URL}, and serves the pre-encoded bytes with ETag caching
+and pre-compressed gzip/brotli variants
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import signal
+
+from aiohttp.web import Response, json_response
+
+from logging_setup import get_logger
+
+
+logger = get_logger("documents")
+
+
+BASE_URL_PLACEHOLDER = "{BASE_URL}"
+
+
+def substitute_base_url(data, base_url: str):
+    """Return a copy of `data` with every {BASE_URL} placeholder replaced"""
+    if isinstance(data, str):
+        return data.replace(BASE_URL_PLACEHOLDER, base_url)
+    if isinstance(data, dict):
+        return {
+            substitute_base_url(key, base_url): substitute_base_url(value, base_url)
+            for key, value in data.items()
+        }
+    if isinstance(data, list):
+        return [substitute_base_url(item, base_url) for item in data]
+    return data
+
+
+class Document:
+    """A single JSON document, kept as final encoded bytes plus its ETag and compressed variants"""
+
+    __slots__ = ("filename", "label", "substitute", "data", "body", "etag", "variants", "mtime", "error")
+
+    def __init__(self, filename: str, label: str, substitute: bool):
+        self.filename = filename
+        self.label = label
+        self.substitute = substitute
+        self.data = None
+        self.body = None
+        self.etag = None
+        # Content coding -> (compressed body, ETag)
+        self.variants = {}
+        self.mtime = None
+        self.error = None
+
+    def etags(self) -> list:
+        return [self.etag] + [etag for _, etag in self.variants.values()]
+
+
+class DocumentStore:
+    """
+    Precomputed discovery documents
+
+    Documents are read, encoded and (with `compression`) compressed once
+    at startup. `reload()` re-reads them (triggered by SIGHUP or the
+    optional mtime watcher); a document that fails to reload keeps serving
+    its last good version.
+    """
+
+    def __init__(self, base_url: str, base_dir: str = None, max_age: int = 300, compression=None):
+        self.base_url = base_url
+        self.base_dir = base_dir or os.path.dirname(os.path.abspath(__file__))
+        self.cache_control = f"public, max-age={max_age}"
+        self.compression = compression
+        self.documents = {}
+
+    def add(self, name: str, filename: str, label: str, substitute: bool = False):
+        """Register a document; `label` names it in the 404 error message"""
+        document = Document(filename, label, substitute)
+        self.documents[name] = document
+        self._load(document)
+        return document
+
+    def get(self, name: str):
+        """Return the decoded document data, or None if it never loaded"""
+        return self.documents[name].data
+
+    def reload(self, force: bool = False) -> list:
+        """Re-read every document whose file changed (or all of them with `force`)"""
+        reloaded = []
+        for name, document in self.documents.items():
+            changed = force or self._mtime(document) != document.mtime
+            if changed and self._load(document):
+                reloaded.append(name)
+        return reloaded
+
+    def handler(self, name: str):
+        """Build an aiohttp GET handler serving the named document"""
+        document = self.documents[name]
+
+        async def serve(request):
+            if document.body is None:
+                return json_response(
+                    {"error": f"{document.label} not found", "message": document.error},
+                    status=404
+                )
+            body, etag, coding = document.body, document.etag, None
+            headers = {"Cache-Control": self.cache_control}
+            if self.compression and self.compression.encodings:
+                headers["Vary"] = "Accept-Encoding"
+                coding = self.compression.negotiate(request, len(body), document.variants)
+                if coding is not None:
+                    body, etag = document.variants[coding]
+                    headers["Content-Encoding"] = coding
+            headers["ETag"] = etag
+            # Every variant has the same content, so any of their tags is still fresh
+            if_none_match = request.headers.get("If-None-Match")
+            if if_none_match and any(_etag_matches(if_none_match, tag) for tag in document.etags()):
+                return Response(status=304, headers=headers)
+            if coding is not None:
+                self.compression.record(coding, len(document.body), len(body))
+            return Response(body=body, content_type="application/json", headers=headers)
+
+        serve.__name__ = f"serve_{name}"
+        serve.__doc__ = f"Serve the precomputed {document.label}"
+        return serve
+
+    def install_sighup(self, loop=None):
+        """Reload documents on SIGHUP (no-op where the signal is unavailable)"""
+        if not hasattr(signal, "SIGHUP"):
+            return False
+        loop = loop or asyncio.get_running_loop()
+        try:
+            loop.add_signal_handler(signal.SIGHUP, self.reload, True)
+        except (NotImplementedError, RuntimeError):
+            return False
+        return True
+
+    async def watch(self, interval: float):
+        """Poll document mtimes every `interval` seconds and reload changes"""
+        while True:
+            await asyncio.sleep(interval)
+            self.reload()
+
+    def _path(self, document: Document) -> str:
+        return os.path.join(self.base_dir, document.filename)
+
+    def _mtime(self, document: Document):
+        try:
+            return os.stat(self._path(document)).st_mtime_ns
+        except OSError:
+            return None
+
+    def _load(self, document: Document) -> bool:
+        mtime = self._mtime(document)
+        try:
+            with open(self._path(document), "r") as f:
+                data = json.load(f)
+        except Exception as e:
+            document.mtime = mtime
+            document.error = str(e)
+            logger.warning("Could not load document", extra={"file": document.filename, "error": str(e)})
+            return False
+
+        if document.substitute:
+            data = substitute_base_url(data, self.base_url)
+        body = json.dumps(data).encode("utf-8")
+        document.data = data
+        document.body = body
+        digest = hashlib.sha1(body).hexdigest()
+        document.etag = f'"{digest}"'
+        document.variants = {
+            coding: (compressed, f'"{digest}-{coding}"')
+            for coding, compressed in (self.compression.variants(body) if self.compression else {}).items()
+        }
+        document.mtime = mtime
+        document.error = None
+        return True
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    """Check an If-None-Match header (which may list several tags) against an ETag"""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == "*" or candidate == etag:
+            return True
+    return False
@@ -0,0 +1,543 @@
+"""
+Joke generation for the Dad Joke Agent
+Runs OpenAI completions on the async client with a bounded concurrency pool
+
+Calls share one pooled HTTP transport, are bounded by the deadline of the
+request being served, retry transient failures with jittered backoff and
+stop altogether while a circuit breaker sees OpenAI failing. Topics that
+arrive together can be micro-batched into one completion (JokeBatcher).
+"""
+
+import asyncio
+import json
+import random
+import time
+from contextvars import ContextVar
+
+from circuit_breaker import CircuitBreaker
+from logging_setup import get_logger
+
+
+logger = get_logger("generation")
+
+
+SYSTEM_PROMPT = "You are a dad joke expert. Generate a single, clean, family-friendly dad joke. Only return the joke itself, no explanations or additional text."
+
+BATCH_PROMPT = "You are a dad joke expert. For each numbered topic, write one clean, family-friendly dad joke. Reply with only a JSON array of strings: one joke per topic, in the same order, and nothing else."
+
+# Completion tokens allowed per joke in a batched call
+BATCH_TOKENS_PER_JOKE = 80
+
+# An attempt needs at least this many seconds of the deadline left to be worth making
+MIN_ATTEMPT_TIME = 0.1
+
+# Event loop time by which the request being served must be answered (set by the HTTP layer)
+request_deadline = ContextVar("request_deadline", default=None)
+
+
+def parse_batch(content: str, count: int) -> list:
+    """The `count` jokes in a batched reply, raising ValueError if it isn't a JSON list of them"""
+    text = (content or "").strip()
+    if text.startswith("```"):
+        # Tolerate a fenced ```json block
+        text = text.strip("`").strip()
+        if text.startswith("json"):
+            text = text[len("json"):]
+    try:
+        jokes = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Batched reply is not JSON: {e}") from None
+    if isinstance(jokes, dict):
+        jokes = jokes.get("jokes")
+    if (not isinstance(jokes, list) or len(jokes) != count
+            or not all(isinstance(joke, str) and joke.strip() for joke in jokes)):
+        raise ValueError(f"Batched reply does not hold {count} jokes")
+    return [joke.strip() for joke in jokes]
+
+
+def is_retryable(error: Exception) -> bool:
+    """Timeouts, connection errors and 408/409/429/5xx answers are worth another attempt"""
+    if isinstance(error, asyncio.TimeoutError):
+        return True
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        return status in (408, 409, 429) or status >= 500
+    return type(error).__name__ in ("APIConnectionError", "APITimeoutError")
+
+
+def is_upstream_failure(error: Exception) -> bool:
+    """Timeouts, connection errors and 429/5xx answers count against the circuit breaker; other 4xx don't"""
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        return status == 429 or status >= 500
+    return is_retryable(error)
+
+
+class JokeGenerator:
+    """
+    Generate topic jokes through the AsyncOpenAI client
+
+    At most `max_concurrency` completions are in flight at once; further
+    callers wait for a slot. Each call must finish within `timeout` seconds
+    (including the time spent waiting for a slot) or by `request_deadline`,
+    whichever comes first. Attempts are capped at `attempt_timeout` seconds
+    and transient failures are retried up to `retries` times while the
+    deadline allows. While `breaker` is open calls raise CircuitOpenError
+    at once. With `metrics` (an `AgentMetrics`) call latency, token usage,
+    errors and retries are recorded.
+    """
+
+    def __init__(self, client=None, model: str = "gpt-3.5-turbo",
+                 max_concurrency: int = 8, timeout: float = 15.0, client_factory=None,
+                 metrics=None, retries: int = 2, attempt_timeout: float = None,
+                 backoff: float = 0.25, breaker: CircuitBreaker = None):
+        self._client = client
+        self._client_factory = client_factory
+        self.metrics = metrics
+        self.model = model
+        self.max_concurrency = max(1, max_concurrency)
+        self.timeout = timeout
+        self.retries = max(0, retries)
+        self.attempt_timeout = attempt_timeout or timeout
+        self.backoff = backoff
+        self.breaker = breaker
+        # Built on first use, inside the running loop (Python 3.9 binds it at construction)
+        self._semaphore = None
+
+        # Pool counters
+        self.in_flight = 0
+        self.waiting = 0
+        self.peak_waiting = 0
+        self.completed = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.retried = 0
+        self._total_latency = 0.0
+
+    @property
+    def client(self):
+        """The OpenAI client, built by `client_factory` on first use"""
+        if self._client is None:
+            self._client = self._client_factory()
+        return self._client
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        """The pool's slots, created on first use"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def close(self):
+        """Close the pooled HTTP transport"""
+        if self._client is not None:
+            await self._client.close()
+
+    def deadline(self) -> float:
+        """Loop time by which the current call must finish"""
+        deadline = asyncio.get_running_loop().time() + self.timeout
+        request = request_deadline.get()
+        return deadline if request is None else min(deadline, request)
+
+    def _check_circuit(self):
+        if self.breaker:
+            self.breaker.check()
+
+    async def generate(self, topic: str) -> str:
+        """Generate a joke about `topic`, raising on timeout, upstream error or an open circuit"""
+        joke, _ = await self.generate_with_usage(topic)
+        return joke
+
+    async def generate_with_usage(self, topic: str) -> tuple:
+        """Like `generate()`, returning `(joke, tokens)`; tokens is None if the API reported no usage"""
+        response, started = await self._call(lambda: self._request(topic))
+        usage = getattr(response, "usage", None)
+        self._succeeded("generate", started, usage)
+        return response.choices[0].message.content.strip(), getattr(usage, "total_tokens", None)
+
+    async def _call(self, request):
+        """Await `request()` in a pool slot by the deadline, returning `(response, started)`"""
+        self._check_circuit()
+        try:
+            deadline = self.deadline()
+            await self._acquire_by(deadline)
+            try:
+                return await self._attempts(request, deadline)
+            finally:
+                self._release()
+        except BaseException:
+            self._abandoned()
+            raise
+
+    async def _attempts(self, request, deadline: float):
+        """
+        Await `request()` until it succeeds, returning `(response, started)`
+
+        Transient failures are retried after a jittered exponential backoff
+        as long as the retry would still start `MIN_ATTEMPT_TIME` before
+        `deadline`. Giving up records a breaker failure only if an attempt
+        hit a 429/5xx or connection error, or timed out after its full
+        `attempt_timeout`; a deadline used up elsewhere isn't the upstream's.
+        """
+        loop = asyncio.get_running_loop()
+        attempt = 0
+        upstream_failed = False
+        while True:
+            timeout = min(deadline - loop.time(), self.attempt_timeout)
+            if timeout < MIN_ATTEMPT_TIME:
+                # The deadline ran out while waiting, not because of the upstream
+                self._timed_out()
+                raise asyncio.TimeoutError()
+            started = time.perf_counter()
+            try:
+                return await asyncio.wait_for(request(), timeout=timeout), started
+            except asyncio.TimeoutError as e:
+                self._timed_out()
+                error = e
+                # Only an attempt given its full time says the upstream is slow
+                upstream_failed = upstream_failed or timeout >= self.attempt_timeout
+            except Exception as e:
+                self._failed(e)
+                error = e
+                upstream_failed = upstream_failed or is_upstream_failure(e)
+
+            delay = random.uniform(0, self.backoff * 2 ** attempt)
+            attempt += 1
+            if (attempt > self.retries or not is_retryable(error)
+                    or loop.time() + delay + MIN_ATTEMPT_TIME >= deadline):
+                if upstream_failed:
+                    self._upstream_failed()
+                raise error
+            self.retried += 1
+            if self.metrics:
+                self.metrics.openai_retries.inc()
+            await asyncio.sleep(delay)
+
+    async def _acquire_by(self, deadline: float):
+        """Wait for a pool slot until `deadline`"""
+        try:
+            await asyncio.wait_for(self._acquire(), timeout=deadline - asyncio.get_running_loop().time())
+        except asyncio.TimeoutError:
+            self._timed_out()
+            raise
+
+    async def _acquire(self):
+        self.waiting += 1
+        self.peak_waiting = max(self.peak_waiting, self.waiting)
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+
+    def _release(self):
+        self.in_flight -= 1
+        self.semaphore.release()
+
+    def _timed_out(self):
+        self.timeouts += 1
+        if self.metrics:
+            self.metrics.openai_errors.inc("timeout")
+
+    def _failed(self, error: Exception):
+        self.errors += 1
+        if self.metrics:
+            self.metrics.openai_errors.inc(type(error).__name__)
+
+    def _upstream_failed(self):
+        if self.breaker:
+            self.breaker.record_failure()
+
+    def _abandoned(self):
+        # A call that ends without a success may have been the half-open probe
+        if self.breaker:
+            self.breaker.release()
+
+    def _succeeded(self, mode: str, started: float, usage):
+        latency = time.perf_counter() - started
+        if self.breaker:
+            self.breaker.record_success()
+        self.completed += 1
+        self._total_latency += latency
+        if self.metrics:
+            self.metrics.openai_duration.observe(latency, mode)
+            if usage is not None:
+                self.metrics.openai_tokens.inc("prompt", amount=usage.prompt_tokens or 0)
+                self.metrics.openai_tokens.inc("completion", amount=usage.completion_tokens or 0)
+
+    def _request(self, topic: str, **kwargs):
+        return self.client.chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": f"Tell me a dad joke about: {topic}"}
+            ],
+            max_tokens=150,
+            temperature=0.8,
+            **kwargs
+        )
+
+    def _batch_request(self, topics: list):
+        numbered = "\n".join(f"{n}. {topic}" for n, topic in enumerate(topics, 1))
+        return self.client.chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": BATCH_PROMPT},
+                {"role": "user", "content": f"Topics:\n{numbered}"}
+            ],
+            max_tokens=BATCH_TOKENS_PER_JOKE * len(topics),
+            temperature=0.8
+        )
+
+    async def generate_batch(self, topics: list) -> list:
+        """
+        Generate one joke per topic in a single completion, in order
+
+        Raises ValueError when the reply can't be parsed into that many
+        jokes, and like `generate()` on timeouts, errors or an open circuit.
+        """
+        response, started = await self._call(lambda: self._batch_request(topics))
+        self._succeeded("batch", started, getattr(response, "usage", None))
+        return parse_batch(response.choices[0].message.content, len(topics))
+
+    async def stream(self, topic: str):
+        """
+        Generate a joke about `topic`, yielding text deltas as they arrive
+
+        The whole stream, including the wait for a slot, shares the same
+        deadline as `generate()`. Opening the stream is retried like a
+        `generate()` call; once text has arrived it is not.
+        """
+        self._check_circuit()
+        loop = asyncio.get_running_loop()
+        deadline = self.deadline()
+        try:
+            await self._acquire_by(deadline)
+        except BaseException:
+            self._abandoned()
+            raise
+
+        response = None
+        usage = None
+        try:
+            # The final chunk carries token usage (and no choices)
+            response, started = await self._attempts(
+                lambda: self._request(topic, stream=True, stream_options={"include_usage": True}),
+                deadline
+            )
+            try:
+                chunks = response.__aiter__()
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(chunks.__anext__(), timeout=deadline - loop.time())
+                    except StopAsyncIteration:
+                        break
+                    if getattr(chunk, "usage", None) is not None:
+                        usage = chunk.usage
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+            except asyncio.TimeoutError:
+                self._timed_out()
+                self._upstream_failed()
+                raise
+            except (asyncio.CancelledError, GeneratorExit):
+                raise
+            except Exception as e:
+                self._failed(e)
+                if is_upstream_failure(e):
+                    self._upstream_failed()
+                raise
+            self._succeeded("stream", started, usage)
+            response = None
+        except BaseException:
+            self._abandoned()
+            raise
+        finally:
+            self._release()
+            # Close the upstream stream if the consumer stopped early or it failed
+            if response is not None:
+                await response.close()
+
+    def stats(self) -> dict:
+        """Snapshot of pool occupancy and outcome counters"""
+        return {
+            "model": self.model,
+            "max_concurrency": self.max_concurrency,
+            "timeout_seconds": self.timeout,
+            "attempt_timeout_seconds": self.attempt_timeout,
+            "retries": self.retries,
+            "in_flight": self.in_flight,
+            "queue_depth": self.waiting,
+            "peak_queue_depth": self.peak_waiting,
+            "completed": self.completed,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "retried": self.retried,
+            "avg_latency_ms": round(1000 * self._total_latency / self.completed, 1) if self.completed else None,
+            "breaker": self.breaker.stats() if self.breaker else None,
+        }
+
+
+class JokeBatcher:
+    """
+    Coalesce topic generations that arrive together into one completion
+
+    `generate(topic)` waits up to `window` seconds for other topics (or
+    until `max_batch` are waiting), then asks for all of them in one
+    `JokeGenerator.generate_batch()` call and hands each caller its joke.
+    A lone topic is generated on its own. If the batched reply can't be
+    parsed, every topic in it is generated individually instead. The batch
+    keeps the earliest request deadline among its callers.
+    """
+
+    def __init__(self, generator: JokeGenerator, window: float = 0.01, max_batch: int = 8):
+        self.generator = generator
+        self.window = window
+        self.max_batch = max(2, max_batch)
+        self._waiting = []
+        self._timer = None
+        # The loop only keeps weak references to tasks; hold running batches here
+        self._running = set()
+
+        # Counters
+        self.batches = 0
+        self.batched_topics = 0
+        self.singles = 0
+        self.parse_failures = 0
+
+    async def generate(self, topic: str) -> str:
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.append((topic, future, request_deadline.get()))
+        if len(self._waiting) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._flush)
+        return await future
+
+    @property
+    def waiting(self) -> int:
+        """Topics collected for the next batch"""
+        return len(self._waiting)
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._waiting = self._waiting, []
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch: list):
+        deadlines = [deadline for _, _, deadline in batch if deadline is not None]
+        request_deadline.set(min(deadlines) if deadlines else None)
+        topics = [topic for topic, _, _ in batch]
+        futures = [future for _, future, _ in batch]
+
+        if len(batch) == 1:
+            self.singles += 1
+            await self._settle(futures[0], self.generator.generate(topics[0]))
+            return
+        try:
+            jokes = await self.generator.generate_batch(topics)
+        except ValueError as e:
+            # Unusable reply - one call per topic instead
+            self.parse_failures += 1
+            logger.warning("Batched generation reply unusable, generating individually",
+                           extra={"topics": len(topics), "detail": str(e)})
+            await asyncio.gather(*(
+                self._settle(future, self.generator.generate(topic)) for topic, future in zip(topics, futures)
+            ))
+            return
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.batches += 1
+        self.batched_topics += len(topics)
+        for future, joke in zip(futures, jokes):
+            if not future.done():
+                future.set_result(joke)
+
+    async def _settle(self, future, generation):
+        try:
+            joke = await generation
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+        else:
+            if not future.done():
+                future.set_result(joke)
+
+    def stats(self) -> dict:
+        return {
+            "window_ms": round(self.window * 1000, 1),
+            "max_batch": self.max_batch,
+            "waiting": self.waiting,
+            "batches": self.batches,
+            "batched_topics": self.batched_topics,
+            "singles": self.singles,
+            "parse_failures": self.parse_failures,
+        }
+
+
+def _client_factory(settings, api_key: str, connections: int, base_url: str = None):
+    def create_client():
+        import httpx
+        from openai import AsyncOpenAI
+
+        # The async client keeps slow generations off the event loop; one
+        # keep-alive connection per pool slot, and retries are ours
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=connections, max_keepalive_connections=connections,
+                                keepalive_expiry=settings.openai_keepalive_expiry),
+            timeout=httpx.Timeout(settings.openai_timeout, connect=min(settings.openai_timeout, 5.0))
+        )
+        return AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=http_client, max_retries=0)
+
+    return create_client
+
+
+def create_joke_generator(settings, metrics=None):
+    """
+    Build a JokeGenerator when an OpenAI key is configured, else None
+
+    The openai package is only imported when the first topic joke is
+    generated, so cold starts and random-joke traffic never pay for it.
+    """
+    if not settings.openai_enabled:
+        return None
+    return JokeGenerator(
+        model=settings.openai_model,
+        max_concurrency=settings.openai_max_concurrency,
+        timeout=settings.openai_timeout,
+        client_factory=_client_factory(settings, settings.openai_api_key, settings.openai_max_concurrency),
+        metrics=metrics,
+        retries=settings.openai_retries,
+        attempt_timeout=settings.openai_attempt_timeout,
+        breaker=CircuitBreaker(settings.openai_breaker_failures, settings.openai_breaker_reset)
+    )
+
+
+def create_local_generator(settings):
+    """
+    Build a JokeGenerator for an OpenAI-compatible server at LOCAL_MODEL_URL, else None
+
+    Ollama, vLLM, llama.cpp and LM Studio all serve /v1/chat/completions.
+    Its calls use the OPENAI_* timeouts and retries but its own pool and
+    circuit breaker, and stay out of the OpenAI metrics.
+    """
+    if not settings.local_model_url:
+        return None
+    return JokeGenerator(
+        model=settings.local_model_name,
+        max_concurrency=settings.local_model_max_concurrency,
+        timeout=settings.openai_timeout,
+        client_factory=_client_factory(settings, settings.local_model_api_key,
+                                       settings.local_model_max_concurrency, settings.local_model_url),
+        retries=settings.openai_retries,
+        attempt_timeout=settings.openai_attempt_timeout,
+        breaker=CircuitBreaker(settings.openai_breaker_failures, settings.openai_breaker_reset)
+    )
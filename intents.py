@@ -0,0 +1,120 @@
+"""
+Intent routing for the Dad Joke Agent
+Classifies a user message as help, random joke or topic joke and extracts the topic
+"""
+
+HELP = "help"
+RANDOM = "random"
+TOPIC = "topic"
+
+# Intent table. HELP phrases must be the whole message; RANDOM words count
+# anywhere in it as whole words ("hi" matches "hi there", not "this").
+INTENT_TABLE = (
+    (HELP, ("/help", "help", "what can you do")),
+    (RANDOM, (
+        "random", "any", "anything", "surprise", "joke", "jokes", "laugh",
+        "hi", "hello", "hey", "another",
+    )),
+)
+
+# Words that introduce a topic after "joke": "a joke about cats"
+TOPIC_MARKERS = frozenset(("about", "on", "regarding", "involving", "with"))
+
+# Words that name the subject of a request: "a food joke", "puns about pirates"
+JOKE_WORDS = frozenset(("joke", "jokes", "pun", "puns"))
+
+# Words before "joke" that describe the joke rather than its topic ("a good joke")
+NOT_TOPICS = frozenset("""
+a an another any bad best classic corny dad funny give good great hear like
+love me my need new one quick random short silly some tell terrible the want your
+""".split())
+
+_FILLER = frozenset(("a", "an", "the", "please"))
+
+# Messages whose intent is remembered; chat traffic repeats a few phrasings
+CACHE_SIZE = 4096
+# Longer messages are rarely sent twice and aren't remembered
+MAX_CACHED_LENGTH = 100
+
+
+# Results without a topic are shared rather than rebuilt per message
+_HELP_INTENT = (HELP, "")
+_RANDOM_INTENT = (RANDOM, "")
+
+
+class IntentClassifier:
+    """
+    Table-driven message classifier
+
+    The table is compiled once into a dict of whole-message shortcuts and
+    a set of words; a message is split with a couple of C-level string
+    operations and every check is a hash lookup, so the cost does not grow
+    with the size of the table. `classify()` returns a `(kind, topic)` tuple: HELP, RANDOM, or
+    TOPIC with the extracted topic ("tell me a joke about cats" -> "cats").
+    Messages that match nothing are treated as a topic in their own right.
+    The results for up to `cache_size` short messages are remembered, so a
+    repeated message costs a single dict lookup.
+    """
+
+    def __init__(self, table=INTENT_TABLE, cache_size: int = CACHE_SIZE):
+        self.table = table
+        self.cache_size = cache_size
+        self._cache = {}
+        self._random = frozenset(word for kind, words in table if kind == RANDOM for word in words)
+        # Whole-message shortcuts: help phrases, one-word random requests ("hi") and ""
+        self._exact = dict.fromkeys(self._random, _RANDOM_INTENT)
+        self._exact[""] = _RANDOM_INTENT
+        self._exact.update((phrase, _HELP_INTENT) for kind, phrases in table if kind == HELP for phrase in phrases)
+
+    def classify(self, text: str) -> tuple:
+        intent = self._cache.get(text)
+        if intent is None:
+            intent = self._classify(text)
+            if self.cache_size and text and len(text) <= MAX_CACHED_LENGTH:
+                if len(self._cache) >= self.cache_size:
+                    # Forget the oldest message
+                    del self._cache[next(iter(self._cache))]
+                self._cache[text] = intent
+        return intent
+
+    def _classify(self, text: str) -> tuple:
+        if not text:
+            return _RANDOM_INTENT
+        lowered = text.lower().strip(" \t\r\n?!.")
+        exact = self._exact.get(lowered)
+        if exact:
+            return exact
+
+        # Commas are the only punctuation commonly found inside a request
+        words = lowered.replace(",", " ").split()
+        if not JOKE_WORDS.isdisjoint(words):
+            topic = _topic(words)
+            if topic:
+                return TOPIC, topic
+        if not self._random.isdisjoint(words):
+            return _RANDOM_INTENT
+        return TOPIC, lowered
+
+
+def _topic(words: list) -> str:
+    """Topic of a message mentioning a joke, or "" when it names none"""
+    for i, word in enumerate(words):
+        if word not in JOKE_WORDS:
+            continue
+        if i + 1 < len(words) and words[i + 1] in TOPIC_MARKERS:
+            # "joke about (the) cats (please)"
+            start, end = i + 2, len(words)
+            while start < end and words[start] in _FILLER:
+                start += 1
+            while end > start and words[end - 1] in _FILLER:
+                end -= 1
+            if start < end:
+                return " ".join(words[start:end])
+        elif i > 0 and words[i - 1] not in NOT_TOPICS and words[i - 1] not in JOKE_WORDS:
+            # "a food joke"
+            return words[i - 1]
+    return ""
+
+
+# Shared classifier used by every message path
+classify = IntentClassifier().classify
@@ -0,0 +1,209 @@
+"""
+Topic joke cache for the Dad Joke Agent
+LRU + TTL cache of generated jokes keyed on the normalized topic,
+with single-flight de-duplication of concurrent misses and an optional
+shared backend so worker processes reuse each other's jokes
+"""
+
+import asyncio
+import json
+import random
+import re
+import time
+from collections import OrderedDict
+
+
+_NON_WORD = re.compile(r"[^\w\s]+")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_topic(topic: str) -> str:
+    """Normalize a topic so "Cats!", " cats " and "CATS" share a cache entry"""
+    topic = _NON_WORD.sub(" ", topic.lower())
+    return _SPACES.sub(" ", topic).strip()
+
+
+class _Entry:
+    __slots__ = ("jokes", "expires_at")
+
+    def __init__(self, expires_at: float):
+        self.jokes = []
+        self.expires_at = expires_at
+
+
+class TopicJokeCache:
+    """
+    Cache a small pool of generated jokes per topic
+
+    Until a topic's pool holds `pool_size` jokes every lookup generates a
+    new one, so early answers still vary; after that lookups are served
+    from the pool. Entries expire `ttl` seconds after their first joke and
+    the least recently used topic is evicted beyond `max_topics`.
+
+    With a shared `backend` (see shared_state), pools are also written
+    there and local misses check it before calling the model, so other
+    workers' jokes are reused.
+    """
+
+    def __init__(self, max_topics: int = 1024, ttl: float = 3600.0, pool_size: int = 5,
+                 backend=None):
+        self.max_topics = max(1, max_topics)
+        self.ttl = ttl
+        self.pool_size = max(1, pool_size)
+        self.backend = backend
+        self._entries = OrderedDict()
+        self._pending = {}
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.shared_hits = 0
+        self.shared_errors = 0
+
+    async def get_or_generate(self, topic: str, generate) -> str:
+        """
+        Return a joke for `topic`, calling `await generate(topic)` on a miss
+
+        Concurrent misses for the same normalized topic share a single
+        upstream call. Errors from `generate` propagate to every waiter.
+        """
+        key = normalize_topic(topic) or topic
+        entry = self._lookup(key)
+        if entry is not None and len(entry.jokes) >= self.pool_size:
+            self.hits += 1
+            return random.choice(entry.jokes)
+
+        pending = self._pending.get(key)
+        if pending is not None:
+            self.coalesced += 1
+            return await asyncio.shield(pending)
+
+        self.misses += 1
+        task = asyncio.ensure_future(self._fill(key, topic, generate))
+        task.add_done_callback(_consume_exception)
+        self._pending[key] = task
+        return await asyncio.shield(task)
+
+    async def get(self, topic: str):
+        """Return a pooled joke for `topic` if its pool is full, else None"""
+        key = normalize_topic(topic) or topic
+        entry = self._lookup(key)
+        if entry is not None and len(entry.jokes) >= self.pool_size:
+            self.hits += 1
+            return random.choice(entry.jokes)
+        joke = await self._shared_joke(key)
+        if joke is not None:
+            self.hits += 1
+        return joke
+
+    def pending(self, topic: str):
+        """Return the in-flight fill for `topic`, if any, to await its joke"""
+        task = self._pending.get(normalize_topic(topic) or topic)
+        if task is not None:
+            self.coalesced += 1
+        return task
+
+    async def put(self, topic: str, joke: str):
+        """Store a joke generated outside get_or_generate (counted as a miss)"""
+        self.misses += 1
+        key = normalize_topic(topic) or topic
+        self._store(key, joke)
+        await self._share(key)
+
+    async def _fill(self, key: str, topic: str, generate) -> str:
+        try:
+            joke = await self._shared_joke(key)
+            if joke is not None:
+                return joke
+            joke = await generate(topic)
+            self._store(key, joke)
+            await self._share(key)
+            return joke
+        finally:
+            self._pending.pop(key, None)
+
+    async def _shared_joke(self, key: str):
+        """Adopt a full pool another worker stored in the shared backend"""
+        if self.backend is None or not self.backend.shared:
+            return None
+        try:
+            value = await self.backend.get(f"jokes:{key}")
+            jokes = json.loads(value) if value else []
+        except Exception:
+            # Unreachable backend, or a corrupt or foreign value: a miss
+            self.shared_errors += 1
+            return None
+        if not isinstance(jokes, list) or not all(isinstance(joke, str) for joke in jokes):
+            self.shared_errors += 1
+            return None
+        if len(jokes) < self.pool_size:
+            return None
+        entry = self._lookup(key) or self._new_entry(key)
+        entry.jokes = jokes[:self.pool_size]
+        self.shared_hits += 1
+        return random.choice(entry.jokes)
+
+    async def _share(self, key: str):
+        """Publish a topic's pool to the shared backend"""
+        if self.backend is None or not self.backend.shared:
+            return
+        entry = self._entries.get(key)
+        if entry is None:
+            return
+        remaining = entry.expires_at - time.monotonic()
+        try:
+            await self.backend.set(f"jokes:{key}", json.dumps(entry.jokes), ttl=max(remaining, 1))
+        except Exception:
+            self.shared_errors += 1
+
+    def _lookup(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= time.monotonic():
+            del self._entries[key]
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _new_entry(self, key: str) -> _Entry:
+        entry = _Entry(time.monotonic() + self.ttl)
+        self._entries[key] = entry
+        while len(self._entries) > self.max_topics:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        return entry
+
+    def _store(self, key: str, joke: str):
+        entry = self._lookup(key) or self._new_entry(key)
+        if len(entry.jokes) < self.pool_size:
+            entry.jokes.append(joke)
+
+    def stats(self) -> dict:
+        """Snapshot of cache size and hit/miss/coalesce counters"""
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "topics": len(self._entries),
+            "max_topics": self.max_topics,
+            "ttl_seconds": self.ttl,
+            "pool_size": self.pool_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "in_flight": len(self._pending),
+            "shared_hits": self.shared_hits,
+            "shared_errors": self.shared_errors,
+            "hit_ratio": round((self.hits + self.coalesced) / lookups, 3) if lookups else None,
+        }
+
+
+def _consume_exception(task):
+    """Mark a finished fill task's exception as retrieved when nobody awaited it"""
+    if not task.cancelled():
+        task.exception()
@@ -0,0 +1,239 @@
+"""
+Joke corpus for the Dad Joke Agent
+Compact, memory-mapped joke store with a keyword index for topic lookup
+and per-conversation rotation so users don't hear the same joke twice
+"""
+
+import mmap
+import random
+import re
+from array import array
+from collections import OrderedDict
+
+
+_WORD = re.compile(r"[a-z0-9']+")
+
+# Words that never identify a topic, including the ways people ask for jokes
+STOP_WORDS = frozenset("""
+a about an and any are as at be but by can could dad did do does for from funny
+get give go had has have he her him his how i if in into is it its joke jokes
+just laugh let make me my no not of on one or our pun puns please say she so
+some tell that the their them then there they this to told us was we what when
+where who why will with would you your
+""".split())
+
+
+def keywords(text: str) -> list:
+    """Index terms of `text`: lowercase words minus stop words, crudely singularized"""
+    terms = []
+    for word in _WORD.findall(text.lower()):
+        word = word.strip("'")
+        if len(word) < 3 or word in STOP_WORDS:
+            continue
+        if word.endswith("ies") and len(word) > 4:
+            word = word[:-3] + "y"
+        elif word.endswith("s") and not word.endswith("ss") and len(word) > 3:
+            word = word[:-1]
+        terms.append(word)
+    return terms
+
+
+class JokeCorpus:
+    """
+    Read-only joke store
+
+    The jokes live in one bytes-like buffer (a read-only mmap of the joke
+    file, or an in-memory blob) addressed by an `array` of (start, end)
+    offset pairs, so tens of thousands of jokes cost a few hundred KB of
+    index on top of the text. An inverted index maps keywords to `array`s
+    of joke ids.
+    """
+
+    def __init__(self, buffer, offsets: array, source: str):
+        self._buffer = buffer
+        self._offsets = offsets
+        self.source = source
+        self.index = {}
+        self._build_index()
+
+    @classmethod
+    def from_jokes(cls, jokes, source: str = "built-in"):
+        """Build a corpus from an in-memory list of jokes"""
+        blob = bytearray()
+        offsets = array("Q")
+        for joke in jokes:
+            offsets.append(len(blob))
+            blob += joke.strip().encode("utf-8")
+            offsets.append(len(blob))
+        return cls(bytes(blob), offsets, source)
+
+    @classmethod
+    def load(cls, path: str):
+        """
+        Memory-map a joke file: UTF-8 text, one joke per line
+
+        Blank lines and lines starting with `#` are skipped.
+        """
+        with open(path, "rb") as f:
+            try:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # mmap refuses empty files
+                buffer = b""
+
+        offsets = array("Q")
+        position, size = 0, len(buffer)
+        while position < size:
+            end = buffer.find(b"\n", position)
+            if end == -1:
+                end = size
+            line_end = end
+            while line_end > position and buffer[line_end - 1:line_end] in (b"\r", b" ", b"\t"):
+                line_end -= 1
+            if line_end > position and buffer[position:position + 1] != b"#":
+                offsets.append(position)
+                offsets.append(line_end)
+            position = end + 1
+        return cls(buffer, offsets, path)
+
+    def __len__(self) -> int:
+        return len(self._offsets) // 2
+
+    def joke(self, joke_id: int) -> str:
+        """Decode joke number `joke_id`"""
+        start, end = self._offsets[2 * joke_id], self._offsets[2 * joke_id + 1]
+        return bytes(self._buffer[start:end]).decode("utf-8", "replace")
+
+    def _build_index(self):
+        postings = {}
+        for joke_id in range(len(self)):
+            for term in set(keywords(self.joke(joke_id))):
+                postings.setdefault(term, array("I")).append(joke_id)
+        self.index = postings
+
+    def find(self, topic: str):
+        """
+        Ids of jokes matching every keyword of `topic`, as a sorted sequence
+
+        Empty when the topic has no keywords or any keyword is missing from
+        the index. Single-keyword topics return the index posting itself,
+        which callers must not modify.
+        """
+        terms = set(keywords(topic))
+        if not terms:
+            return []
+        postings = sorted((self.index.get(term) for term in terms), key=lambda p: len(p) if p else 0)
+        if not postings[0]:
+            return []
+        if len(postings) == 1:
+            return postings[0]
+        matches = set(postings[0])
+        for posting in postings[1:]:
+            matches.intersection_update(posting)
+            if not matches:
+                return []
+        return sorted(matches)
+
+    def stats(self) -> dict:
+        return {
+            "source": self.source,
+            "jokes": len(self),
+            "keywords": len(self.index),
+        }
+
+
+class JokeRotation:
+    """
+    Per-conversation no-repeat picking
+
+    Each conversation remembers the last `history` joke ids it was told.
+    Picks avoid those ids; when every candidate has been told, the
+    conversation's history for them is forgotten and the rotation starts
+    over. Conversations are kept in an LRU bounded by `max_conversations`.
+
+    With a persistent or shared `storage` (see conversation_storage.py),
+    `load()` and `save()` keep each conversation's history there so it
+    survives restarts and is seen by every worker.
+    """
+
+    def __init__(self, history: int = 100, max_conversations: int = 10000, storage=None):
+        self.history = max(1, history)
+        self.max_conversations = max(1, max_conversations)
+        self.storage = storage
+        self._told = OrderedDict()
+
+    def _seen(self, conversation_id: str) -> OrderedDict:
+        seen = self._told.get(conversation_id)
+        if seen is None:
+            seen = self._told[conversation_id] = OrderedDict()
+            while len(self._told) > self.max_conversations:
+                self._told.popitem(last=False)
+        else:
+            self._told.move_to_end(conversation_id)
+        return seen
+
+    def pick(self, conversation_id: str, candidates) -> int:
+        """
+        Choose a joke id from `candidates` (a sequence of ids, or an int
+        meaning `range(candidates)`) that this conversation hasn't heard
+        """
+        count = candidates if isinstance(candidates, int) else len(candidates)
+        if count == 0:
+            raise ValueError("No jokes to pick from")
+        if not conversation_id:
+            choice = random.randrange(count)
+            return choice if isinstance(candidates, int) else candidates[choice]
+
+        seen = self._seen(conversation_id)
+        joke_id = None
+        if count > 2 * len(seen):
+            # Plenty of unseen jokes: a few random probes find one cheaply
+            for _ in range(8):
+                probe = random.randrange(count)
+                probe = probe if isinstance(candidates, int) else candidates[probe]
+                if probe not in seen:
+                    joke_id = probe
+                    break
+        if joke_id is None:
+            pool = range(count) if isinstance(candidates, int) else candidates
+            unseen = [candidate for candidate in pool if candidate not in seen]
+            if not unseen:
+                # Told them all - start the rotation over for these jokes
+                for candidate in pool:
+                    seen.pop(candidate, None)
+                unseen = list(pool)
+            joke_id = random.choice(unseen)
+
+        seen[joke_id] = None
+        while len(seen) > self.history:
+            seen.popitem(last=False)
+        return joke_id
+
+    async def load(self, conversation_id: str):
+        """Refresh a conversation's history from storage before picking"""
+        if self.storage is None or not conversation_id:
+            return
+        key = _rotation_key(conversation_id)
+        stored = (await self.storage.read_json([key])).get(key)
+        seen = self._seen(conversation_id)
+        seen.clear()
+        for joke_id in (stored or {}).get("told", [])[-self.history:]:
+            seen[joke_id] = None
+
+    async def save(self, conversation_id: str):
+        """Write a conversation's history back to storage after picking"""
+        if self.storage is None or not conversation_id:
+            return
+        seen = self._told.get(conversation_id)
+        if seen is not None:
+            await self.storage.write_json({_rotation_key(conversation_id): {"told": list(seen)}})
+
+    def stats(self) -> dict:
+        return {
+            "conversations": len(self._told),
+            "history": self.history,
+        }
+
+
+def _rotation_key(conversation_id: str) -> str:
+    return f"rotation/{conversation_id}"
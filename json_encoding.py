@@ -0,0 +1,31 @@
+"""
+JSON encoding for the Dad Joke Agent
+Uses orjson for request and response bodies when it is installed
+"""
+
+import json
+
+
+def _stdlib_dumps(payload) -> bytes:
+    return json.dumps(payload).encode("utf-8")
+
+
+def resolve_json(name: str = "auto"):
+    """
+    Return `(dumps, loads, name)` for JSON_ENCODER `auto`, `orjson` or `json`
+
+    `dumps` returns UTF-8 bytes ready to use as a response body. `auto`
+    picks orjson when it is installed (`pip install orjson`) and the
+    standard library otherwise.
+    """
+    if name in ("auto", "orjson"):
+        try:
+            import orjson
+        except ImportError:
+            if name == "orjson":
+                raise ImportError("JSON_ENCODER=orjson but orjson is not installed (pip install orjson)")
+        else:
+            return orjson.dumps, orjson.loads, "orjson"
+    elif name != "json":
+        raise ValueError(f"Unsupported JSON_ENCODER: {name}")
+    return _stdlib_dumps, json.loads, "json"
@@ -0,0 +1,112 @@
+"""
+Process lifecycle for the Dad Joke Agent
+Warmup before traffic, liveness and readiness, and draining on SIGTERM
+
+A process is `starting` until its warmup steps have run, then `ready`.
+Warmup runs from `on_startup`, before the server listens, so probes never
+see `starting`.
+SIGTERM moves it to `draining`: readiness fails at once so load balancers
+stop sending new requests, and after `drain_delay` seconds the server
+stops listening and gives in-flight requests the shutdown timeout to finish.
+"""
+
+import asyncio
+import inspect
+import signal
+import time
+
+from aiohttp.web_runner import GracefulExit
+
+from logging_setup import elapsed_ms, get_logger
+
+
+logger = get_logger("lifecycle")
+
+STARTING = "starting"
+READY = "ready"
+DRAINING = "draining"
+
+
+def _graceful_exit():
+    # Same exit aiohttp's run_app uses for SIGINT
+    raise GracefulExit()
+
+
+class Lifecycle:
+    """
+    Warmup, readiness and draining for one process
+
+    Readiness fails while the process is starting or draining, or while any
+    check added with `add_check()` reports a problem (e.g. overload).
+    """
+
+    def __init__(self, drain_delay: float = 5.0):
+        self.drain_delay = drain_delay
+        self.state = STARTING
+        self.in_flight = 0
+        self.warmup = {}
+        self._checks = []
+        self._started = time.monotonic()
+
+    def add_check(self, name: str, failing):
+        """Fail readiness with reason `name` while `failing()` is true"""
+        self._checks.append((name, failing))
+
+    async def run_warmup(self, steps):
+        """
+        Run `(name, step)` warmup steps in order, then become ready
+
+        A step may be sync or async; its result and duration are reported
+        under `warmup`. A failing step is logged and does not stop the
+        others.
+        """
+        started = time.perf_counter()
+        for name, step in steps:
+            step_started = time.perf_counter()
+            try:
+                result = step()
+                if inspect.isawaitable(result):
+                    result = await result
+            except Exception as e:
+                logger.warning("Warmup step failed", extra={"step": name, "error": type(e).__name__, "detail": str(e)})
+                result = f"failed: {type(e).__name__}"
+            self.warmup[name] = {"result": result, "ms": elapsed_ms(step_started)}
+        if self.state == STARTING:
+            self.state = READY
+        logger.info("Warmup complete", extra={"duration_ms": elapsed_ms(started)})
+
+    def readiness(self) -> tuple:
+        """`(ready, reasons)`: reasons names everything keeping the process out of rotation"""
+        reasons = [] if self.state == READY else [self.state]
+        reasons.extend(name for name, failing in self._checks if failing())
+        return not reasons, reasons
+
+    @property
+    def draining(self) -> bool:
+        return self.state == DRAINING
+
+    def install_sigterm(self, loop=None) -> bool:
+        """Drain on SIGTERM instead of stopping at once (no-op where the signal is unavailable)"""
+        loop = loop or asyncio.get_running_loop()
+        try:
+            loop.add_signal_handler(signal.SIGTERM, self.drain)
+        except (NotImplementedError, RuntimeError):
+            return False
+        return True
+
+    def drain(self):
+        """Fail readiness now and stop the server after `drain_delay` seconds"""
+        if self.state == DRAINING:
+            return
+        self.state = DRAINING
+        logger.info("Draining", extra={"in_flight": self.in_flight, "drain_delay": self.drain_delay})
+        asyncio.get_running_loop().call_later(self.drain_delay, _graceful_exit)
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "uptime_seconds": round(time.monotonic() - self._started, 1),
+            "in_flight": self.in_flight,
+            "drain_delay_seconds": self.drain_delay,
+            "warmup": self.warmup,
+        }
@@ -0,0 +1,142 @@
+"""
+Logging for the Dad Joke Agent
+Structured, leveled logging through a queue so the event loop never
+blocks on stdout, plus sampling helpers for full request/response dumps
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+
+
+LOGGER_NAME = "dad_joke_agent"
+
+# Attributes every LogRecord has; anything else was passed via `extra=`
+_STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_listener = None
+
+
+def get_logger(name: str = None) -> logging.Logger:
+    """Return the agent logger, or a child of it for `name`"""
+    return logging.getLogger(f"{LOGGER_NAME}.{name}" if name else LOGGER_NAME)
+
+
+def _extra_fields(record: logging.LogRecord) -> dict:
+    return {key: value for key, value in vars(record).items() if key not in _STANDARD_ATTRS}
+
+
+class TextFormatter(logging.Formatter):
+    """`time level logger message key=value ...` lines for humans"""
+
+    def format(self, record):
+        line = f"{self.formatTime(record)} {record.levelname:<7} {record.name} {record.getMessage()}"
+        for key, value in _extra_fields(record).items():
+            line += f" {key}={value}"
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line for log shippers"""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update(_extra_fields(record))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level: str = "INFO", fmt: str = "text", stream=None):
+    """
+    Route the agent logger through a QueueHandler
+
+    Records are formatted and written to `stream` (stdout by default) by a
+    background QueueListener thread, so logging calls on the event loop
+    only enqueue. Safe to call again: the previous listener is stopped
+    (flushing what it still holds) and its handlers replaced.
+    """
+    global _listener
+
+    if _listener is not None:
+        _listener.stop()
+    else:
+        atexit.register(_stop_listener)
+
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+
+    log_queue = queue.SimpleQueue()
+    logger = get_logger()
+    logger.handlers[:] = [logging.handlers.QueueHandler(log_queue)]
+    logger.setLevel(level.upper())
+    logger.propagate = False
+
+    _listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    _listener.start()
+    return logger
+
+
+def _stop_listener():
+    """Flush queued records at interpreter exit"""
+    if _listener is not None:
+        _listener.stop()
+
+
+def _restart_listener_after_fork():
+    """The listener thread does not survive fork(); start a fresh one in the child"""
+    global _listener
+    if _listener is None:
+        return
+    _listener = logging.handlers.QueueListener(
+        _listener.queue, *_listener.handlers, respect_handler_level=True
+    )
+    _listener.start()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_listener_after_fork)
+
+
+def mask_headers(headers) -> dict:
+    """Copy request headers with the Authorization value masked"""
+    return {
+        header: "Bearer ***masked***" if header.lower() == "authorization" else value
+        for header, value in headers.items()
+    }
+
+
+class BodySampler:
+    """
+    Decide whether a request gets its full headers/body dumped
+
+    Only a `rate` fraction of requests (0.0 - 1.0) are sampled, and only
+    when DEBUG logging is enabled, so the dumps cost nothing otherwise.
+    """
+
+    def __init__(self, logger: logging.Logger, rate: float = 0.0):
+        self.logger = logger
+        self.rate = rate
+
+    def sample(self) -> bool:
+        if self.rate <= 0 or not self.logger.isEnabledFor(logging.DEBUG):
+            return False
+        return self.rate >= 1 or random.random() < self.rate
+
+
+def elapsed_ms(started: float) -> float:
+    """Milliseconds since a `time.perf_counter()` timestamp"""
+    return round((time.perf_counter() - started) * 1000, 2)
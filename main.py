@@ -1,35 +1,63 @@
 """
 Dad Joke Agent using Microsoft 365 Agents SDK
 Supports Activity Protocol and Agent-to-Agent communication with Copilot Studio
+
+`create_app(settings)` builds the aiohttp application; run this module to
+serve it. The OpenAI client and the microsoft_agents SDK are imported on
+first use to keep cold starts fast.
 """
 
-import os
-import random
-from dotenv import load_dotenv
-from openai import OpenAI
-
-from aiohttp.web import Application, Request, Response, run_app, json_response
-from microsoft_agents.hosting.core import (
-    AgentApplication,
-    AgentAuthConfiguration,
-    MemoryStorage,
-    TurnState,
-)
-from microsoft_agents.hosting.aiohttp import CloudAdapter
-from microsoft_agents.activity import Activity, ActivityTypes
+from __future__ import annotations
+
+import time
 
-# Load environment variables
-load_dotenv()
+_IMPORT_STARTED = time.perf_counter()
 
-# Configuration
-PORT = int(os.getenv("PORT", 2009))
-BASE_URL = os.getenv("BASE_URL", f"http://localhost:{PORT}")
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+import asyncio
+import json
+import math
+from typing import TYPE_CHECKING
 
-# Initialize OpenAI client if API key is available
-openai_client = None
-if OPENAI_API_KEY and OPENAI_API_KEY != "your_openai_api_key_here":
-    openai_client = OpenAI(api_key=OPENAI_API_KEY)
+from aiohttp.web import Application, HTTPException, Response, StreamResponse, json_response, middleware, run_app
+
+from a2a import (
+    INTERNAL_ERROR,
+    INVALID_REQUEST,
+    METHOD_NOT_FOUND,
+    SERVER_BUSY,
+    StreamTask,
+    agent_message,
+    error_response,
+    extract_context_id,
+    extract_text,
+    result_response,
+    sse_event,
+)
+from admission import LoadShedder, create_rate_limiter
+from backends import create_router
+from circuit_breaker import CircuitOpenError
+from compression import ResponseCompression
+from config import Settings
+from conversation_storage import create_storage
+from documents import DocumentStore
+from generation import JokeBatcher, create_joke_generator, request_deadline
+from joke_cache import TopicJokeCache
+from intents import HELP, TOPIC, classify
+from joke_corpus import JokeCorpus, JokeRotation
+from json_encoding import resolve_json
+from lifecycle import Lifecycle
+from metrics import CONTENT_TYPE, AgentMetrics
+from proactive import ProactiveReplies
+from logging_setup import BodySampler, configure_logging, elapsed_ms, get_logger, mask_headers
+from shared_state import create_backend
+from warm_pool import WarmPool
+from workers import current_worker, resolve_worker_count, run_workers
+
+if TYPE_CHECKING:
+    from microsoft_agents.activity import Activity
+    from microsoft_agents.hosting.core import TurnState
+
+logger = get_logger()
 
 # Random Dad Jokes Collection
 DAD_JOKES = [
@@ -51,83 +79,351 @@ DAD_JOKES = [
 ]
 
 
-# Create the AgentApplication with CloudAdapter
-# For local development without authentication
-AGENT_APP = AgentApplication[TurnState](
-    storage=MemoryStorage(),
-    adapter=CloudAdapter()
-)
+class AgentServices:
+    """Long-lived collaborators of the agent, built from Settings"""
+
+    def __init__(self, settings: Settings):
+        self.settings = settings
+        self.metrics = AgentMetrics()
+
+        # Local joke corpus with keyword index and per-conversation no-repeat rotation
+        self.corpus = load_corpus(settings.joke_corpus_path)
+        # Conversation state for the SDK and the joke rotation (memory://, sqlite://, redis://)
+        self.conversation_storage = create_storage(
+            settings.conversation_storage_url,
+            ttl=settings.conversation_state_ttl,
+            max_items=settings.conversation_state_max,
+            flush_interval=settings.conversation_flush_interval
+        )
+        # In-memory storage would only duplicate the rotation's own LRU
+        self.rotation = JokeRotation(
+            history=settings.joke_history_size,
+            max_conversations=settings.joke_max_conversations,
+            storage=self.conversation_storage if self.conversation_storage.persistent else None
+        )
+
+        # OpenAI generation (None when no OpenAI key is configured or GENERATION_BACKENDS leaves it out)
+        self.joke_generator = None
+        if "openai" in settings.generation_backends:
+            self.joke_generator = create_joke_generator(settings, self.metrics)
+        # Topics requested together share one completion
+        self.joke_batcher = None
+        if self.joke_generator and settings.openai_batch_size > 1:
+            self.joke_batcher = JokeBatcher(
+                self.joke_generator,
+                window=settings.openai_batch_window_ms / 1000,
+                max_batch=settings.openai_batch_size
+            )
+        # Topic jokes from OpenAI, a local model or the corpus chain, routed by priority or latency
+        self.generation = create_router(settings, self.corpus, self.joke_generator, self.joke_batcher, self.metrics)
+
+        # Shared state (joke pools, counters) - use redis:// so multiple workers stay consistent
+        self.shared_state = create_backend(settings.shared_state_url)
+
+        # Cache generated topic jokes so popular topics don't hit OpenAI every time
+        self.joke_cache = TopicJokeCache(
+            max_topics=settings.joke_cache_size,
+            ttl=settings.joke_cache_ttl,
+            pool_size=settings.joke_cache_pool,
+            backend=self.shared_state
+        )
+
+        # Ready jokes for popular and seed topics, generated while OpenAI has free slots
+        self.warm_pool = None
+        if self.joke_generator and (settings.warm_pool_topics > 0 or settings.warm_pool_seed):
+            generator = self.joke_generator
+            self.warm_pool = WarmPool(
+                generator.generate_with_usage,
+                max_topics=settings.warm_pool_topics,
+                seed_topics=settings.warm_pool_seed,
+                depth=settings.warm_pool_depth,
+                low_water=settings.warm_pool_low_water,
+                token_budget=settings.warm_pool_token_budget,
+                interval=settings.warm_pool_interval,
+                backend=self.shared_state,
+                busy=lambda: generator.waiting > 0
+            )
+
+        # Per-caller rate limits, and shedding topic requests while generation is backed up
+        self.rate_limiter = create_rate_limiter(settings, self.shared_state, resolve_worker_count(settings.workers))
+        self.load_shedder = None
+        if self.joke_generator and settings.admission_max_pending > 0:
+            generator, batcher = self.joke_generator, self.joke_batcher
+            self.load_shedder = LoadShedder(
+                lambda: generator.in_flight + generator.waiting + (batcher.waiting if batcher else 0),
+                max_pending=settings.admission_max_pending,
+                mode=settings.admission_shed
+            )
+
+        # Turns answered with 202 and delivered to the channel in the background
+        if settings.proactive_replies not in PROACTIVE_MODES:
+            raise ValueError(f"Unsupported PROACTIVE_REPLIES: {settings.proactive_replies}")
+        self.proactive = None
+        if settings.proactive_replies != "off":
+            self.proactive = ProactiveReplies(
+                dispatch_activity,
+                lambda activity, response: reply_activities(activity, [response])[0],
+                workers=settings.proactive_workers,
+                max_queue=settings.proactive_queue_size,
+                retries=settings.proactive_retries,
+                timeout=settings.proactive_timeout,
+                metrics=self.metrics
+            )
+
+        # Warmup, readiness and draining; overload takes the process out of rotation
+        self.lifecycle = Lifecycle(drain_delay=settings.drain_delay)
+        if self.load_shedder:
+            self.lifecycle.add_check("overloaded", self.load_shedder.overloaded)
+        if self.proactive:
+            proactive = self.proactive
+            self.lifecycle.add_check("proactive_queue_full", lambda: proactive.queue_depth() >= proactive.max_queue)
+        self._collect_metrics()
+
+    def _collect_metrics(self):
+        """Expose pool, cache and corpus state as scrape-time metrics"""
+        registry = self.metrics.registry
+        worker = current_worker
+        registry.collect("dadjoke_worker_info", "gauge", "Worker that answered this scrape",
+                         lambda: {(str(worker()["id"]), str(worker()["pid"])): 1}, ("worker", "pid"))
+        registry.collect("dadjoke_corpus_jokes", "gauge", "Jokes in the local corpus",
+                         lambda: len(self.corpus))
+        lifecycle = self.lifecycle
+        registry.collect("dadjoke_ready", "gauge", "1 while /health/ready reports ready, else 0",
+                         lambda: int(lifecycle.readiness()[0]))
+        registry.collect("dadjoke_http_in_flight", "gauge", "HTTP requests being handled",
+                         lambda: lifecycle.in_flight)
+        if self.joke_generator:
+            generator = self.joke_generator
+            registry.collect("dadjoke_openai_in_flight", "gauge", "OpenAI calls in flight",
+                             lambda: generator.in_flight)
+            registry.collect("dadjoke_openai_queue_depth", "gauge", "Requests waiting for an OpenAI slot",
+                             lambda: generator.waiting)
+            registry.collect("dadjoke_openai_circuit_open", "gauge",
+                             "1 while the OpenAI circuit breaker is open or half-open, else 0",
+                             lambda: int(generator.breaker.state != "closed") if generator.breaker else None)
+            cache = self.joke_cache
+            registry.collect("dadjoke_joke_cache_topics", "gauge", "Topics in the joke cache",
+                             lambda: cache.stats()["topics"])
+            registry.collect("dadjoke_joke_cache_lookups_total", "counter", "Joke cache lookups by result",
+                             lambda: {(result,): cache.stats()[result] for result in ("hits", "misses", "coalesced")},
+                             ("result",))
+        limits = {}
+        if self.rate_limiter:
+            limiter = self.rate_limiter
+            limits.update({("rate_per_second",): limiter.rate, ("burst",): limiter.burst})
+            registry.collect("dadjoke_rate_limit_keys", "gauge", "Callers with a rate-limit bucket",
+                             lambda: limiter.stats()["keys"])
+        if self.load_shedder:
+            limits[("max_pending",)] = self.load_shedder.max_pending
+        if limits:
+            registry.collect("dadjoke_admission_limit", "gauge", "Configured rate and admission limits",
+                             lambda: limits, ("limit",))
+        if self.warm_pool:
+            warm_pool = self.warm_pool
+            registry.collect("dadjoke_warm_pool_jokes", "gauge", "Ready jokes in the warm pool",
+                             warm_pool.ready)
+            registry.collect("dadjoke_warm_pool_tokens_total", "counter", "OpenAI tokens spent filling the warm pool",
+                             lambda: warm_pool.tokens_spent)
+        if self.proactive:
+            proactive = self.proactive
+            registry.collect("dadjoke_proactive_queue_depth", "gauge", "Proactive turns waiting for a worker",
+                             proactive.queue_depth)
+
+    async def close(self):
+        if self.generation:
+            await self.generation.close()
+        await self.conversation_storage.close()
+        await self.shared_state.close()
+
+
+# PROACTIVE_REPLIES values
+PROACTIVE_MODES = ("off", "topic", "all")
+
+
+def load_corpus(path: str = None) -> JokeCorpus:
+    """Load the joke file at `path`, falling back to the built-in DAD_JOKES"""
+    if path:
+        try:
+            corpus = JokeCorpus.load(path)
+            if len(corpus):
+                logger.info("Joke corpus loaded", extra=corpus.stats())
+                return corpus
+            logger.warning("Joke corpus is empty, using built-in jokes", extra={"path": path})
+        except OSError as e:
+            logger.warning("Could not load joke corpus, using built-in jokes", extra={"path": path, "error": str(e)})
+    return JokeCorpus.from_jokes(DAD_JOKES)
+
+
+# Services used by the joke functions and activity handlers; create_app() installs them
+services = None
+_agent_app = None
+
+
+def get_services() -> AgentServices:
+    """The active services, built from the environment if no app created them yet"""
+    global services
+    if services is None:
+        services = AgentServices(Settings.from_env())
+    return services
 
 
-async def get_dad_joke(user_request: str) -> str:
-    """Get a dad joke - random from list or generated via OpenAI"""
+async def pick_joke(conversation_id: str, candidates) -> str:
+    """Pick from `candidates` (ids or a count) with the conversation's stored rotation"""
+    svc = get_services()
+    await svc.rotation.load(conversation_id)
+    joke_id = svc.rotation.pick(conversation_id, candidates)
+    await svc.rotation.save(conversation_id)
+    return svc.corpus.joke(joke_id)
 
-    # Check if user wants a random joke or no specific topic
-    random_keywords = ["random", "any", "surprise", "tell me a joke", "give me a joke",
-                      "dad joke", "make me laugh", "joke please", "hi", "hello", "hey"]
 
-    is_random_request = (
-        not user_request or
-        any(keyword in user_request.lower() for keyword in random_keywords)
-    )
+async def classic_joke(conversation_id: str = None) -> str:
+    """A joke from the local corpus that this conversation hasn't heard yet"""
+    return await pick_joke(conversation_id, len(get_services().corpus))
 
-    if is_random_request:
+
+async def corpus_topic_joke(topic: str, conversation_id: str = None):
+    """A local corpus joke matching `topic`, or None when the index has none"""
+    matches = get_services().corpus.find(topic)
+    if not matches:
+        return None
+    return await pick_joke(conversation_id, matches)
+
+
+async def get_dad_joke(user_request: str, conversation_id: str = None, intent: tuple = None) -> str:
+    """
+    Get a dad joke - from the local corpus or generated via OpenAI
+
+    `intent` is the `classify()` result when the caller already has it.
+    """
+    metrics = get_services().metrics
+    started = time.perf_counter()
+    joke, source = await _choose_joke(user_request, conversation_id, intent)
+    metrics.stage_duration.time_since(started, "joke")
+    metrics.jokes.inc(source)
+    return joke
+
+
+async def _choose_joke(user_request: str, conversation_id: str, intent: tuple) -> tuple:
+    """
+    The joke text and where it came from
+
+    The source is random, corpus, warm, cache, shed, fallback, or the
+    generation backend that answered (openai, local or markov).
+    """
+    kind, topic = intent or classify(user_request)
+    if kind != TOPIC:
         # Return a random joke from our collection
-        return f"🤣 {random.choice(DAD_JOKES)}"
+        return f"🤣 {await classic_joke(conversation_id)}", "random"
+
+    # User asked for a specific topic - a local corpus match is served first
+    joke = await corpus_topic_joke(topic, conversation_id)
+    if joke is not None:
+        return f"🤣 {joke}", "corpus"
+
+    # Otherwise generate one if a backend is available
+    svc = get_services()
+    if svc.generation:
+        # Popular topics are served from the warm pool without waiting on the model
+        if svc.warm_pool:
+            joke = svc.warm_pool.take(topic)
+            if joke is not None:
+                return f"🤣 {joke}", "warm"
+        # Too many generations pending - a cached joke or a classic instead of joining the queue
+        if svc.load_shedder and svc.load_shedder.overloaded():
+            joke = await svc.joke_cache.get(topic)
+            if joke is not None:
+                return f"🤣 {joke}", "cache"
+            svc.load_shedder.record("joke")
+            svc.metrics.shed.inc("joke")
+            return f"🤣 {await classic_joke(conversation_id)}\n\n_(Lots of requests right now, so here's a classic!)_", "shed"
+        # Cache hits and requests sharing another's generation have no backend of their own
+        answered_by = []
+
+        async def generate(topic: str) -> str:
+            joke, backend = await svc.generation.answer(topic)
+            answered_by.append(backend)
+            return joke
 
-    # User asked for a specific topic - try to use OpenAI if available
-    if openai_client:
         try:
-            response = openai_client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a dad joke expert. Generate a single, clean, family-friendly dad joke. Only return the joke itself, no explanations or additional text."
-                    },
-                    {
-                        "role": "user",
-                        "content": f"Tell me a dad joke about: {user_request}"
-                    }
-                ],
-                max_tokens=150,
-                temperature=0.8
-            )
-            joke = response.choices[0].message.content.strip()
-            return f"🤣 {joke}"
+            joke = await svc.joke_cache.get_or_generate(topic, generate)
+            return f"🤣 {joke}", answered_by[0] if answered_by else "cache"
+        except CircuitOpenError:
+            # OpenAI is failing - answer from the corpus without waiting on it
+            return f"🤣 {await classic_joke(conversation_id)}\n\n_(Had trouble with a custom joke, so here's a classic!)_", "fallback"
         except Exception as e:
-            print(f"Error generating joke with OpenAI: {e}")
+            logger.warning("Topic joke generation failed", extra={"error": type(e).__name__, "detail": str(e)})
             # Fallback to random joke
-            return f"🤣 {random.choice(DAD_JOKES)}\n\n_(Had trouble with a custom joke, so here's a classic!)_"
+            return f"🤣 {await classic_joke(conversation_id)}\n\n_(Had trouble with a custom joke, so here's a classic!)_", "fallback"
     else:
-        # No OpenAI available, return random joke
-        return f"🤣 {random.choice(DAD_JOKES)}\n\n_(For custom jokes, add your OpenAI API key to .env!)_"
+        # No generation backend available, return random joke
+        return f"🤣 {await classic_joke(conversation_id)}\n\n_(For custom jokes, add your OpenAI API key to .env!)_", "fallback"
 
 
-# Handle conversation updates (member added)
-@AGENT_APP.activity("conversationUpdate")
-async def on_conversation_update(context: TurnState, activity: Activity):
-    """Handle conversation updates (member added/removed)"""
-    if activity.members_added:
-        for member in activity.members_added:
-            if member.id != activity.recipient.id:
-                welcome_message = """👋 Welcome to the Dad Joke Agent!
+async def stream_dad_joke(user_request: str, conversation_id: str = None):
+    """
+    Stream a dad joke as text chunks
 
-I'm here to brighten your day with the finest dad jokes around! Just ask me for a joke, or specify a topic you'd like a joke about.
+    Random jokes, corpus and cached topic jokes, and jokes without OpenAI
+    arrive as a single chunk; new topic jokes are streamed token by token
+    and cached once complete.
+    """
+    svc = get_services()
+    intent = kind, topic = classify(user_request)
+    shedding = svc.load_shedder and svc.load_shedder.overloaded()
+    # Only OpenAI streams, and only when routing would pick it first
+    streams = svc.joke_generator and svc.generation.order()[0].name == "openai"
+    if kind != TOPIC or not streams or svc.corpus.find(topic) or shedding:
+        yield await get_dad_joke(user_request, conversation_id, intent)
+        return
 
-Type `/help` for more information. Let's get this party started! 🎉"""
-                await context.send_activity(welcome_message)
+    joke = svc.warm_pool.take(topic) if svc.warm_pool else None
+    if joke is not None:
+        svc.metrics.jokes.inc("warm")
+        yield f"🤣 {joke}"
+        return
 
+    joke = await svc.joke_cache.get(topic)
+    if joke is None:
+        pending = svc.joke_cache.pending(topic)
+        if pending is not None:
+            try:
+                joke = await asyncio.shield(pending)
+            except Exception:
+                pass
+    if joke is not None:
+        svc.metrics.jokes.inc("cache")
+        yield f"🤣 {joke}"
+        return
 
-# Handle messages
-@AGENT_APP.activity("message")
-async def on_message(context: TurnState, activity: Activity):
-    """Handle incoming message activities"""
-    user_message = activity.text.strip() if activity.text else ""
+    parts = []
+    try:
+        async for delta in svc.joke_generator.stream(topic):
+            if not parts:
+                delta = "🤣 " + delta.lstrip()
+            parts.append(delta)
+            yield delta
+    except Exception as e:
+        if not isinstance(e, CircuitOpenError):
+            logger.warning("OpenAI joke streaming failed", extra={"error": type(e).__name__, "detail": str(e)})
+        if not parts:
+            # Nothing sent yet - fall back to a classic joke
+            svc.metrics.jokes.inc("fallback")
+            yield f"🤣 {await classic_joke(conversation_id)}\n\n_(Had trouble with a custom joke, so here's a classic!)_"
+        return
+
+    svc.metrics.jokes.inc("openai")
+    joke = "".join(parts)[len("🤣 "):].strip()
+    if joke:
+        await svc.joke_cache.put(topic, joke)
 
-    # Check for help command
-    if user_message.lower() in ["/help", "help"]:
-        help_text = """🤣 **Dad Joke Agent** 🤣
+
+# Activity types dispatched by messages_endpoint; anything else is labelled "other"
+# (and requests refused by rate limiting or load shedding "rejected")
+ACTIVITY_TYPES = ("message", "conversationUpdate", "event", "invoke")
+
+
+# Reply to /help
+HELP_TEXT = """🤣 **Dad Joke Agent** 🤣
 
 I'm your friendly Dad Joke delivery service! Here's what I can do:
 
@@ -143,16 +439,47 @@ I'm your friendly Dad Joke delivery service! Here's what I can do:
 - "Random joke please"
 
 Ready to groan? Ask away! 😄"""
-        await context.send_activity(help_text)
+
+
+def conversation_id(activity):
+    """The conversation id of an activity, if it has one"""
+    conversation = getattr(activity, "conversation", None)
+    if isinstance(conversation, dict):
+        return conversation.get("id")
+    return getattr(conversation, "id", None)
+
+
+# Handle conversation updates (member added)
+async def on_conversation_update(context: TurnState, activity: Activity):
+    """Handle conversation updates (member added/removed)"""
+    if activity.members_added:
+        for member in activity.members_added:
+            if member.id != activity.recipient.id:
+                welcome_message = """👋 Welcome to the Dad Joke Agent!
+
+I'm here to brighten your day with the finest dad jokes around! Just ask me for a joke, or specify a topic you'd like a joke about.
+
+Type `/help` for more information. Let's get this party started! 🎉"""
+                await context.send_activity(welcome_message)
+
+
+# Handle messages
+async def on_message(context: TurnState, activity: Activity):
+    """Handle incoming message activities"""
+    user_message = activity.text.strip() if activity.text else ""
+
+    # Check for help command (a lean RawActivity was classified already)
+    intent = getattr(activity, "intent", None) or classify(user_message)
+    if intent[0] == HELP:
+        await context.send_activity(HELP_TEXT)
         return
 
     # Generate or retrieve a dad joke
-    joke = await get_dad_joke(user_message)
+    joke = await get_dad_joke(user_message, conversation_id(activity), intent)
     await context.send_activity(joke)
 
 
 # Handle event activities
-@AGENT_APP.activity("event")
 async def on_event(context: TurnState, activity: Activity):
     """Handle event activities"""
     event_name = activity.name if hasattr(activity, 'name') else None
@@ -165,6 +492,17 @@ async def on_event(context: TurnState, activity: Activity):
         await context.send_activity(f"Received event: {event_name}")
 
 
+def handoff_request(handoff_context):
+    """The user's request carried by a handoff context, if any"""
+    if not handoff_context or not isinstance(handoff_context, dict):
+        return None
+    # Support multiple context field names for compatibility
+    return (handoff_context.get("request") or
+            handoff_context.get("message") or
+            handoff_context.get("userMessage") or
+            handoff_context.get("text"))
+
+
 # Handle handoff activities
 async def handle_handoff(context: TurnState, activity: Activity):
     """
@@ -176,9 +514,9 @@ async def handle_handoff(context: TurnState, activity: Activity):
         handoff_context = activity.value if hasattr(activity, 'value') else {}
 
         # Log handoff for debugging
-        print(f"Handoff received - Activity Type: {activity.type}")
+        logger.info("Handoff received", extra={"activity_type": activity.type})
         if handoff_context:
-            print(f"Handoff Context: {handoff_context}")
+            logger.debug("Handoff context", extra={"context": handoff_context})
 
         # Send acknowledgment
         response = """🤝 **Handoff Received!**
@@ -190,24 +528,20 @@ I'm here to make you laugh with some quality dad jokes! What kind of joke would
         await context.send_activity(response)
 
         # If there's a specific request in the handoff context, handle it
-        if handoff_context and isinstance(handoff_context, dict):
-            # Support multiple context field names for compatibility
-            request = (handoff_context.get("request") or
-                      handoff_context.get("message") or
-                      handoff_context.get("userMessage") or
-                      handoff_context.get("text"))
-
-            if request:
-                joke = await get_dad_joke(request)
-                await context.send_activity(joke)
+        request = handoff_request(handoff_context)
+        if request:
+            intent = classify(request)
+            if intent[0] == HELP:
+                await context.send_activity(HELP_TEXT)
+            else:
+                await context.send_activity(await get_dad_joke(request, conversation_id(activity), intent))
 
-    except Exception as e:
-        print(f"Error handling handoff: {e}")
+    except Exception:
+        logger.exception("Error handling handoff")
         await context.send_activity("I received the handoff, but encountered an issue. Let's start fresh - ask me for a joke!")
 
 
 # Handle invoke activities for A2A
-@AGENT_APP.activity("invoke")
 async def on_invoke(context: TurnState, activity: Activity):
     """
     Handle invoke activities for agent-to-agent protocol
@@ -217,9 +551,10 @@ async def on_invoke(context: TurnState, activity: Activity):
         invoke_name = activity.name if hasattr(activity, 'name') else None
         invoke_value = activity.value if hasattr(activity, 'value') else {}
 
-        print(f"Invoke received - Name: {invoke_name}, Value: {invoke_value}")
+        logger.info("Invoke received", extra={"invoke_name": invoke_name})
+        logger.debug("Invoke value", extra={"value": invoke_value})
 
-        if invoke_name == "application/vnd.microsoft.activity.handoff":
+        if invoke_name == HANDOFF_INVOKE:
             # Standard A2A handoff invoke
             await handle_handoff(context, activity)
         else:
@@ -231,65 +566,375 @@ async def on_invoke(context: TurnState, activity: Activity):
                     "invokeName": invoke_name
                 }
             }
-            await context.send_activity(Activity(
-                type=ActivityTypes.invoke_response,
-                value=response_value
-            ))
+            await context.send_activity(_invoke_response(response_value))
     except Exception as e:
-        print(f"Error handling invoke: {e}")
+        logger.exception("Error handling invoke")
         error_response = {
             "status": 500,
             "body": {"error": str(e)}
         }
-        await context.send_activity(Activity(
-            type=ActivityTypes.invoke_response,
-            value=error_response
-        ))
+        await context.send_activity(_invoke_response(error_response))
 
 
-if __name__ == "__main__":
-    print("🤣 Dad Joke Agent Starting...")
-    print(f"📡 Listening on http://localhost:{PORT}/api/messages")
-    print(f"🔑 OpenAI Integration: {'Enabled' if openai_client else 'Disabled (using random jokes only)'}")
-    print("\nPress Ctrl+C to stop the agent\n")
+# Invoke name of a standard A2A handoff
+HANDOFF_INVOKE = "application/vnd.microsoft.activity.handoff"
+
+
+async def dispatch_activity(context, activity):
+    """Route an activity to the handler for its type"""
+    if activity.type == "message":
+        await on_message(context, activity)
+    elif activity.type == "conversationUpdate":
+        await on_conversation_update(context, activity)
+    elif activity.type == "event":
+        await on_event(context, activity)
+    elif activity.type == "invoke":
+        await on_invoke(context, activity)
+    else:
+        logger.warning("Unknown activity type", extra={"activity_type": activity.type})
+
+
+def proactive_request(activity):
+    """
+    The user text of a message or handoff that can be answered proactively
+
+    None for every other activity, and for activities without a serviceUrl
+    and conversation id to deliver the replies to.
+    """
+    if not activity.service_url or not conversation_id(activity):
+        return None
+    if activity.type == "message":
+        return activity.text.strip() if activity.text else ""
+    name = getattr(activity, "name", None)
+    if (activity.type, name) in (("event", "handoff"), ("invoke", HANDOFF_INVOKE)):
+        return handoff_request(activity.value) or ""
+    return None
+
+
+def wants_proactive(activity, mode: str) -> bool:
+    """Whether PROACTIVE_REPLIES `mode` moves this activity off the request path"""
+    if mode == "off":
+        return False
+    request = proactive_request(activity)
+    if request is None:
+        return False
+    if mode == "all":
+        return True
+    # topic: only jokes that may wait on OpenAI, not ones the corpus answers at once
+    kind, topic = classify(request)
+    return kind == TOPIC and not get_services().corpus.find(topic)
+
+
+def rate_limit_key(body, by: str, caller: str) -> str:
+    """The bucket a request counts against: its conversation or channel, else the caller's address"""
+    key = None
+    if isinstance(body, dict):
+        if by == "conversation":
+            if body.get("jsonrpc"):
+                key = extract_context_id(body.get("params", {}))
+            elif isinstance(body.get("conversation"), dict):
+                key = body["conversation"].get("id")
+        elif by == "channel" and not body.get("jsonrpc"):
+            key = body.get("channelId")
+    return f"{by}:{key}" if key else f"caller:{caller}"
+
+
+def request_texts(body) -> list:
+    """The user texts a request asks jokes for: JSON-RPC calls, messages and handoffs"""
+    texts = []
+    for call in body if isinstance(body, list) else [body]:
+        if not isinstance(call, dict):
+            continue
+        if call.get("jsonrpc"):
+            texts.append(extract_text(call.get("params", {})))
+        elif call.get("type") == "message":
+            texts.append(call.get("text"))
+        elif call.get("type") in ("event", "invoke"):
+            texts.append(handoff_request(call.get("value")))
+    return [text.strip() for text in texts if isinstance(text, str)]
+
+
+def needs_generation(text: str) -> bool:
+    """Whether answering `text` may call OpenAI (a topic the corpus can't answer)"""
+    kind, topic = classify(text)
+    return kind == TOPIC and not get_services().corpus.find(topic)
+
+
+def _invoke_response(value: dict):
+    """Build an invokeResponse activity (the SDK is imported on first use)"""
+    from microsoft_agents.activity import Activity, ActivityTypes
+
+    return Activity(type=ActivityTypes.invoke_response, value=value)
+
+
+def get_agent_app():
+    """
+    The SDK AgentApplication with the activity handlers registered
+
+    Built on first use so importing this module doesn't load the
+    microsoft_agents hosting stack. /api/messages dispatches to the
+    handlers directly and does not need it.
+    """
+    global _agent_app
+    if _agent_app is None:
+        from microsoft_agents.hosting.aiohttp import CloudAdapter
+        from microsoft_agents.hosting.core import AgentApplication, TurnState
+
+        # Create the AgentApplication with CloudAdapter
+        # For local development without authentication
+        agent_app = AgentApplication[TurnState](
+            storage=get_services().conversation_storage,
+            adapter=CloudAdapter()
+        )
+        agent_app.activity("conversationUpdate")(on_conversation_update)
+        agent_app.activity("message")(on_message)
+        agent_app.activity("event")(on_event)
+        agent_app.activity("invoke")(on_invoke)
+        _agent_app = agent_app
+    return _agent_app
+
+
+class SimpleTurnContext:
+    """
+    Minimal turn context that collects replies
+
+    For local dev /api/messages bypasses the full adapter pipeline and
+    calls the agent handlers directly with this context.
+    """
+
+    __slots__ = ("activity", "responses")
+
+    def __init__(self, activity):
+        self.activity = activity
+        self.responses = []
+
+    async def send_activity(self, text_or_activity):
+        if isinstance(text_or_activity, str):
+            self.responses.append({"type": "message", "text": text_or_activity})
+        elif hasattr(text_or_activity, "type"):
+            self.responses.append({"type": text_or_activity.type, "text": getattr(text_or_activity, 'text', '')})
+        else:
+            self.responses.append({"type": "message", "text": str(text_or_activity)})
+
+
+class RawActivity:
+    """
+    Unvalidated view of a message activity body
+
+    Random-joke and help messages are answered straight from the request
+    dict, skipping `Activity(**body)` validation; this exposes the
+    attributes `on_message` and `reply_activities` read, and the intent
+    `lean()` classified.
+    """
+
+    __slots__ = ("type", "id", "text", "conversation", "from_property", "recipient", "service_url", "channel_id",
+                 "intent")
+
+    def __init__(self, body: dict):
+        self.type = body.get("type")
+        self.id = body.get("id")
+        self.text = body.get("text")
+        self.conversation = body.get("conversation")
+        self.from_property = body.get("from")
+        self.recipient = body.get("recipient")
+        self.service_url = body.get("serviceUrl")
+        self.channel_id = body.get("channelId")
+        self.intent = None
+
+    @classmethod
+    def lean(cls, body: dict):
+        """A RawActivity when `body` is a well-formed non-topic message, else None"""
+        if body.get("type") != "message":
+            return None
+        text = body.get("text")
+        if text is not None and not isinstance(text, str):
+            return None
+        for key in ("conversation", "from", "recipient"):
+            if not isinstance(body.get(key), (dict, type(None))):
+                return None
+        intent = classify(text.strip() if text else "")
+        if intent[0] == TOPIC:
+            return None
+        activity = cls(body)
+        # Saves on_message classifying the text again
+        activity.intent = intent
+        return activity
+
+
+def _identity(value):
+    """An account or conversation as a JSON-ready dict"""
+    if value is None or isinstance(value, dict):
+        return value
+    return value.model_dump(by_alias=True, exclude_none=True)
+
+
+def reply_activities(activity, responses: list) -> list:
+    """
+    Bot Framework reply activities for the collected responses
+
+    The identity and conversation fields are serialized once per turn and
+    shared by every reply.
+    """
+    shared = {
+        "from": _identity(activity.recipient),
+        "recipient": _identity(activity.from_property),
+        "replyToId": activity.id,
+        "serviceUrl": activity.service_url,
+        "channelId": activity.channel_id,
+        "conversation": _identity(activity.conversation),
+    }
+    return [
+        {"type": response.get("type", "message"), "text": response.get("text", ""), **shared}
+        for response in responses
+    ]
+
+
+def create_app(settings: Settings = None) -> Application:
+    """
+    Build the agent's aiohttp Application
+
+    Serve it with run_app, an aiohttp/gunicorn worker (see `app_factory`),
+    or mount it inside another application with `add_subapp`. The
+    services it builds from `settings` become the ones the joke functions
+    and activity handlers use.
+    """
+    global services
+    started = time.perf_counter()
+    settings = settings or Settings.from_env()
+    svc = services = AgentServices(settings)
+    startup = {"budget_ms": settings.startup_budget_ms}
+    body_sampler = BodySampler(logger, settings.log_body_sample_rate)
+    metrics = svc.metrics
+    proactive = svc.proactive
+    rate_limiter = svc.rate_limiter
+    load_shedder = svc.load_shedder
+    lifecycle = svc.lifecycle
+
+    # gzip/brotli for JSON bodies: discovery documents are compressed once, replies per response
+    compression = ResponseCompression(settings.compression, settings.compression_min_size)
+    metrics.registry.collect("dadjoke_compressed_responses_total", "counter",
+                             "Responses sent compressed by content coding",
+                             lambda: {(coding,): count for coding, count in compression.responses.items()},
+                             ("encoding",))
+    metrics.registry.collect("dadjoke_compression_bytes_total", "counter",
+                             "Body bytes of compressed responses before (in) and after (out) compression",
+                             lambda: {("in",): compression.bytes_in, ("out",): compression.bytes_out},
+                             ("stage",))
 
     # Create request logging middleware
-    from aiohttp.web import middleware
+    access_logger = get_logger("access")
 
     @middleware
     async def request_logger(request, handler):
-        """Log all incoming requests for debugging"""
-        print(f"\n🌐 {request.method} {request.path} from {request.remote}")
-        response = await handler(request)
-        print(f"   → Response: {response.status}")
-        return response
+        """Log one structured line per request and record its metrics"""
+        started = time.perf_counter()
+        status = 500
+        lifecycle.in_flight += 1
+        try:
+            response = await handler(request)
+            status = response.status
+            # Keep-alive clients reconnect to a process that isn't going away
+            if lifecycle.draining:
+                response.force_close()
+            return response
+        except HTTPException as e:
+            status = e.status
+            raise
+        finally:
+            lifecycle.in_flight -= 1
+            # Label by route pattern, not raw path, to keep the series bounded
+            resource = request.match_info.route.resource
+            route = resource.canonical if resource is not None else "unmatched"
+            metrics.http_requests.inc(route, request.method, str(status))
+            metrics.http_duration.time_since(started, route)
+            access_logger.info("request", extra={
+                "method": request.method,
+                "path": request.path,
+                "status": status,
+                "duration_ms": elapsed_ms(started),
+                "remote": request.remote,
+            })
 
     # Create the web application with middleware
     app = Application(middlewares=[request_logger])
 
     # Add health check endpoint (no auth required)
     async def health_check(request):
-        return json_response({"status": "healthy", "agent": "Dad Joke Agent"})
+        health = {
+            "status": "healthy",
+            "ready": lifecycle.readiness()[0],
+            "agent": "Dad Joke Agent",
+            "worker": current_worker(),
+            "startup": startup,
+            "lifecycle": lifecycle.stats(),
+            "shared_state": svc.shared_state.describe(),
+            "corpus": {**svc.corpus.stats(), **svc.rotation.stats()},
+            "conversation_storage": svc.conversation_storage.stats(),
+        }
+        if svc.proactive:
+            health["proactive"] = {"mode": settings.proactive_replies, **svc.proactive.stats()}
+        if svc.joke_generator:
+            health["generation"] = svc.joke_generator.stats()
+            if svc.joke_batcher:
+                health["generation"]["batching"] = svc.joke_batcher.stats()
+            health["cache"] = svc.joke_cache.stats()
+        if svc.warm_pool:
+            health["warm_pool"] = svc.warm_pool.stats()
+        if svc.generation:
+            health["generation_routing"] = svc.generation.stats()
+        if compression.encodings:
+            health["compression"] = compression.stats()
+        if svc.rate_limiter or svc.load_shedder:
+            health["admission"] = {
+                "rate_limit": {"key": settings.rate_limit_key, **svc.rate_limiter.stats()} if svc.rate_limiter else None,
+                "load_shedding": svc.load_shedder.stats() if svc.load_shedder else None,
+            }
+        return json_response(health)
 
     app.router.add_get("/health", health_check)
 
-    # Add agent card endpoint
-    async def agent_card(request):
-        """Serve the agent card for discovery and integration"""
-        import json
-        try:
-            with open("agent-card.json", "r") as f:
-                card_data = json.load(f)
-            # Replace {BASE_URL} placeholder with actual BASE_URL
-            card_str = json.dumps(card_data).replace("{BASE_URL}", BASE_URL)
-            card_data = json.loads(card_str)
-            return json_response(card_data)
-        except Exception as e:
-            return json_response(
-                {"error": "Agent card not found", "message": str(e)},
-                status=404
-            )
+    # Liveness: the event loop is answering
+    async def liveness(request):
+        return json_response({"status": "alive"})
+
+    # Readiness: warmed up, not draining and not overloaded
+    async def readiness(request):
+        ready, reasons = lifecycle.readiness()
+        if ready:
+            return json_response({"status": "ready"})
+        return json_response({"status": "not_ready", "reasons": reasons}, status=503)
+
+    app.router.add_get("/health/live", liveness)
+    app.router.add_get("/health/ready", readiness)
+
+    # Prometheus metrics for this worker
+    async def metrics_endpoint(request):
+        return Response(body=metrics.render().encode("utf-8"), headers={"Content-Type": CONTENT_TYPE})
+
+    app.router.add_get("/metrics", metrics_endpoint)
+
+    # Discovery documents are loaded and {BASE_URL}-substituted once at startup
+    # and served as pre-encoded, pre-compressed bytes with ETag / Cache-Control headers
+    documents = DocumentStore(settings.base_url, max_age=settings.document_max_age, compression=compression)
+    documents.add("card", "agent-card.json", "Agent card", substitute=True)
+    documents.add("discovery", "agent-discovery.json", "Agent discovery document", substitute=True)
+    documents.add("manifest", "agent-manifest.json", "Agent manifest")
+    documents.add("declarative", "declarative-agent.json", "Declarative agent definition")
+
+    async def start_document_reload(app):
+        """Reload documents on SIGHUP and, optionally, when the files change"""
+        documents.install_sighup()
+        watcher = None
+        if settings.document_watch_interval > 0:
+            watcher = asyncio.create_task(documents.watch(settings.document_watch_interval))
+        yield
+        if watcher:
+            watcher.cancel()
+
+    app.cleanup_ctx.append(start_document_reload)
 
+    # Add agent card endpoint
+    agent_card = documents.handler("card")
     app.router.add_get("/api/card", agent_card)
 
     # Add well-known agent card endpoint (A2A protocol standard) - GET only for now
@@ -297,211 +942,277 @@ if __name__ == "__main__":
     app.router.add_get("/.well-known/agent-card.json", agent_card)
 
     # Add agent discovery endpoint (comprehensive A2A metadata)
-    async def agent_discovery(request):
-        """Serve the agent discovery document for A2A protocol"""
-        import json
-        try:
-            with open("agent-discovery.json", "r") as f:
-                discovery_data = json.load(f)
-            # Replace {BASE_URL} placeholder with actual BASE_URL
-            discovery_str = json.dumps(discovery_data).replace("{BASE_URL}", BASE_URL)
-            discovery_data = json.loads(discovery_str)
-            return json_response(discovery_data)
-        except Exception as e:
-            return json_response(
-                {"error": "Agent discovery document not found", "message": str(e)},
-                status=404
-            )
-
+    agent_discovery = documents.handler("discovery")
     app.router.add_get("/api/discovery", agent_discovery)
     app.router.add_get("/.well-known/agent-discovery.json", agent_discovery)
 
-    # Add agent manifest endpoint
-    async def agent_manifest(request):
-        """Serve the agent manifest for Teams/Copilot Studio integration"""
-        import json
-        try:
-            with open("agent-manifest.json", "r") as f:
-                manifest_data = json.load(f)
-            return json_response(manifest_data)
-        except Exception as e:
-            return json_response(
-                {"error": "Agent manifest not found", "message": str(e)},
-                status=404
-            )
+    # Add agent manifest endpoint (Teams/Copilot Studio integration)
+    app.router.add_get("/api/manifest", documents.handler("manifest"))
 
-    app.router.add_get("/api/manifest", agent_manifest)
+    # Add declarative agent endpoint (Copilot Studio)
+    app.router.add_get("/api/declarative-agent", documents.handler("declarative"))
 
-    # Add declarative agent endpoint
-    async def declarative_agent(request):
-        """Serve the declarative agent definition for Copilot Studio"""
-        import json
+    async def stream_endpoint(request, body):
+        """
+        Answer a JSON-RPC message/stream call with Server-Sent Events
+
+        Each text chunk is sent as an artifact-update event as soon as it
+        arrives; a final status-update event carries the whole joke.
+        """
+        task = StreamTask(body.get("id"), body.get("params", {}))
+        text = extract_text(body.get("params", {}))
+        context_id = extract_context_id(body.get("params", {}))
+
+        response = StreamResponse(headers={
+            "Content-Type": "text/event-stream",
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+        })
+        await response.prepare(request)
+
+        chunks = []
         try:
-            with open("declarative-agent.json", "r") as f:
-                declarative_data = json.load(f)
-            return json_response(declarative_data)
-        except Exception as e:
-            return json_response(
-                {"error": "Declarative agent definition not found", "message": str(e)},
-                status=404
+            async for chunk in stream_dad_joke(text, context_id):
+                chunks.append(chunk)
+                # Hold the first chunk back: a joke that arrives in one piece
+                # (random or cached) only needs the final event
+                if len(chunks) == 2:
+                    await response.write(sse_event(task.chunk(chunks[0])))
+                if len(chunks) >= 2:
+                    await response.write(sse_event(task.chunk(chunk)))
+
+            await response.write(sse_event(task.final("".join(chunks).strip())))
+            await response.write_eof()
+        except ConnectionResetError:
+            logger.info("Stream client disconnected", extra={"chunks": len(chunks)})
+        return response
+
+    async def batch_call(call):
+        """Run one entry of a JSON-RPC batch; returns None for notifications"""
+        if not isinstance(call, dict) or call.get("jsonrpc") != "2.0" or "method" not in call:
+            return error_response(None, INVALID_REQUEST, "Invalid Request")
+
+        request_id = call.get("id")
+        if call["method"] == "message/send":
+            try:
+                params = call.get("params", {})
+                joke = await get_dad_joke(extract_text(params), extract_context_id(params))
+                response = result_response(request_id, {"message": agent_message(joke)})
+            except Exception as e:
+                logger.exception("Error processing batch entry", extra={"error": type(e).__name__})
+                response = error_response(request_id, INTERNAL_ERROR, str(e))
+        else:
+            response = error_response(
+                request_id, METHOD_NOT_FOUND, f"Method not supported in a batch: {call['method']}"
             )
 
-    app.router.add_get("/api/declarative-agent", declarative_agent)
+        # Notifications (no id) get no response entry
+        return response if "id" in call else None
+
+    async def batch_endpoint(request, body):
+        """
+        Answer a JSON-RPC 2.0 batch
+
+        message/send entries run concurrently; responses come back in
+        request order with per-entry errors.
+        """
+        if not body:
+            return json_response(error_response(None, INVALID_REQUEST, "Invalid Request: empty batch"))
+        if len(body) > settings.max_batch_size:
+            return json_response(error_response(
+                None, INVALID_REQUEST, f"Batch too large: {len(body)} calls (max {settings.max_batch_size})"
+            ))
+
+        responses = await asyncio.gather(*(batch_call(call) for call in body))
+        responses = [response for response in responses if response is not None]
+        if not responses:
+            return Response(status=204)
+        return serialized(request, responses)
+
+    # orjson when installed (JSON_ENCODER=auto), else the standard library
+    dumps, loads, json_encoder = resolve_json(settings.json_encoder)
+
+    def too_many_requests(body, retry_after: float, reason: str) -> Response:
+        """429 with Retry-After; JSON-RPC callers also get a JSON-RPC error"""
+        headers = {"Retry-After": str(max(1, math.ceil(retry_after)))}
+        if isinstance(body, list) or (isinstance(body, dict) and body.get("jsonrpc")):
+            request_id = body.get("id") if isinstance(body, dict) else None
+            return Response(body=dumps(error_response(request_id, SERVER_BUSY, reason)), status=429,
+                            content_type="application/json", headers=headers)
+        return Response(text=reason, status=429, headers=headers)
+
+    def serialized(request, payload) -> Response:
+        """JSON response, compressed when the client accepts it; timed as the serialize stage"""
+        started = time.perf_counter()
+        body, coding = compression.dynamic(request, dumps(payload))
+        headers = {"Vary": "Accept-Encoding"} if compression.encodings else None
+        if coding is not None:
+            headers["Content-Encoding"] = coding
+        response = Response(body=body, content_type="application/json", headers=headers)
+        metrics.stage_duration.time_since(started, "serialize")
+        return response
 
     # Add simple message endpoint with manual activity processing
     async def messages_endpoint(request):
         """Handle Bot Framework messages and JSON-RPC 2.0 A2A messages"""
+        started = time.perf_counter()
+        dispatch = "invalid"
+        if settings.request_deadline > 0:
+            # Upstream calls made for this request give up in time for a fallback
+            request_deadline.set(asyncio.get_running_loop().time() + settings.request_deadline)
         try:
-            # Add detailed logging for troubleshooting Copilot Studio connection
-            print("\n" + "="*60)
-            print("📨 INCOMING REQUEST")
-            print("="*60)
-            print(f"Method: {request.method}")
-            print(f"Path: {request.path}")
-            print(f"Query: {request.query_string}")
-            print(f"\nHeaders:")
-            for header, value in request.headers.items():
-                # Mask authorization tokens for security
-                if header.lower() == 'authorization':
-                    print(f"  {header}: Bearer ***masked***")
-                else:
-                    print(f"  {header}: {value}")
-
             # Parse the incoming message
-            body = await request.json()
-            print(f"\nBody:")
-            import json
-            print(json.dumps(body, indent=2))
-            print("="*60 + "\n")
+            body = await request.json(loads=loads)
+            metrics.stage_duration.time_since(started, "parse")
+
+            # Full dumps for troubleshooting Copilot Studio connections are sampled
+            # (LOG_BODY_SAMPLE_RATE) and only emitted at DEBUG level
+            dump = body_sampler.sample()
+            if dump:
+                logger.debug("Incoming request", extra={
+                    "path": request.path,
+                    "query": request.query_string,
+                    "headers": mask_headers(request.headers),
+                    "body": json.dumps(body),
+                })
+
+            # Per-caller token buckets (a batch costs one token per call)
+            if rate_limiter:
+                key = rate_limit_key(body, settings.rate_limit_key, request.remote)
+                wait = await rate_limiter.acquire(key, len(body) if isinstance(body, list) else 1)
+                if wait:
+                    dispatch = "rejected"
+                    metrics.rate_limited.inc(settings.rate_limit_key)
+                    return too_many_requests(body, wait, "Rate limit exceeded")
+
+            # Refuse new topic requests while generation is backed up (ADMISSION_SHED=reject)
+            if (load_shedder and load_shedder.mode == "reject" and load_shedder.overloaded()
+                    and any(map(needs_generation, request_texts(body)))):
+                dispatch = "rejected"
+                load_shedder.record("reject")
+                metrics.shed.inc("reject")
+                return too_many_requests(body, 1, "Server busy, try again shortly")
+
+            # Check if this is a JSON-RPC 2.0 batch
+            if isinstance(body, list):
+                logger.debug("Detected JSON-RPC 2.0 batch", extra={"calls": len(body)})
+                dispatch = "batch"
+                return await batch_endpoint(request, body)
+
+            # Check if this is a JSON-RPC 2.0 A2A streaming message
+            if body.get("jsonrpc") == "2.0" and body.get("method") == "message/stream":
+                logger.debug("Detected JSON-RPC 2.0 A2A stream")
+                dispatch = "message/stream"
+                return await stream_endpoint(request, body)
 
             # Check if this is a JSON-RPC 2.0 A2A message
             if body.get("jsonrpc") == "2.0" and body.get("method") == "message/send":
-                print("🔀 Detected JSON-RPC 2.0 A2A message")
+                logger.debug("Detected JSON-RPC 2.0 A2A message")
+                dispatch = "message/send"
 
-                # Extract the message from JSON-RPC params
+                # Extract the text from the JSON-RPC params and generate the dad joke
                 params = body.get("params", {})
-                message = params.get("message", {})
-
-                # Extract the text from parts
-                text = ""
-                parts = message.get("parts", [])
-                for part in parts:
-                    if part.get("kind") == "text":
-                        text = part.get("text", "")
-                        break
-
-                print(f"📝 Extracted text: {text}")
-
-                # Generate the dad joke
-                joke = await get_dad_joke(text)
+                joke = await get_dad_joke(extract_text(params), extract_context_id(params))
 
                 # Build JSON-RPC 2.0 response
-                jsonrpc_response = {
-                    "jsonrpc": "2.0",
-                    "id": body.get("id"),
-                    "result": {
-                        "message": {
-                            "kind": "message",
-                            "parts": [
-                                {
-                                    "kind": "text",
-                                    "text": joke
-                                }
-                            ],
-                            "role": "assistant"
-                        }
-                    }
-                }
-
-                print(f"📤 Sending JSON-RPC 2.0 response")
-                print(json.dumps(jsonrpc_response, indent=2))
-                return json_response(jsonrpc_response)
-
-            # Otherwise, treat as Bot Framework Activity
-            print("🔀 Detected Bot Framework Activity")
-            activity = Activity(**body)
-
-            # Create a simple turn context and call the agent handlers directly
-            # For local dev, we bypass the full adapter pipeline
-
-            # Create a mock context that can send responses
-            class SimpleTurnContext:
-                def __init__(self, activity):
-                    self.activity = activity
-                    self.responses = []
-
-                async def send_activity(self, text_or_activity):
-                    if isinstance(text_or_activity, str):
-                        self.responses.append({"type": "message", "text": text_or_activity})
-                    elif isinstance(text_or_activity, Activity):
-                        self.responses.append({"type": text_or_activity.type, "text": getattr(text_or_activity, 'text', '')})
-                    else:
-                        self.responses.append({"type": "message", "text": str(text_or_activity)})
-
+                jsonrpc_response = result_response(body.get("id"), {"message": agent_message(joke)})
+
+                if dump:
+                    logger.debug("JSON-RPC response", extra={"body": json.dumps(jsonrpc_response)})
+                return serialized(request, jsonrpc_response)
+
+            # Otherwise, treat as Bot Framework Activity. Random-joke and help
+            # messages skip model validation; everything else is validated
+            validate_started = time.perf_counter()
+            activity = RawActivity.lean(body)
+            if activity is None:
+                from microsoft_agents.activity import Activity
+
+                activity = Activity(**body)
+            metrics.stage_duration.time_since(validate_started, "validate")
+            dispatch = activity.type if activity.type in ACTIVITY_TYPES else "other"
+
+            # Acknowledge now and deliver the replies to the channel in the background
+            if proactive and wants_proactive(activity, settings.proactive_replies):
+                if proactive.submit(activity):
+                    if activity.type == "invoke":
+                        return serialized(request, {"status": 200, "body": {"message": "Handoff accepted"}})
+                    return Response(status=202)
+                logger.warning("Proactive queue full, replying inline", extra={"queued": proactive.queue_depth()})
+
+            # Call the agent handlers directly with a context that collects replies
             context = SimpleTurnContext(activity)
+            await dispatch_activity(context, activity)
 
-            # Route to the appropriate handler based on activity type
-            print(f"🔀 Routing activity type: {activity.type}")
-            if activity.type == ActivityTypes.message:
-                print("  → Routing to on_message handler")
-                await on_message(context, activity)
-            elif activity.type == ActivityTypes.conversation_update:
-                print("  → Routing to on_conversation_update handler")
-                await on_conversation_update(context, activity)
-            elif activity.type == "event" or activity.type == ActivityTypes.event:
-                print("  → Routing to on_event handler")
-                await on_event(context, activity)
-            elif activity.type == "invoke" or activity.type == ActivityTypes.invoke:
-                print("  → Routing to on_invoke handler")
-                await on_invoke(context, activity)
-            else:
-                print(f"  ⚠️  Unknown activity type: {activity.type}")
-
-            print(f"✅ Request processed successfully")
-            print(f"📤 Responses generated: {len(context.responses)}")
-            if context.responses:
-                print(f"   Response preview: {context.responses[0] if context.responses else 'None'}")
+            logger.debug("Activity processed", extra={
+                "activity_type": activity.type,
+                "responses": len(context.responses),
+            })
 
             # Build Bot Framework response activities
-            response_activities = []
-            for resp in context.responses:
-                # Get the from field (note: Pydantic uses 'from' not 'from_')
-                from_field = getattr(activity, 'from', None) or getattr(activity, 'from_', None)
-
-                response_activity = {
-                    "type": resp.get("type", "message"),
-                    "text": resp.get("text", ""),
-                    "from": activity.recipient.model_dump() if hasattr(activity.recipient, 'model_dump') else activity.recipient,
-                    "recipient": from_field.model_dump() if hasattr(from_field, 'model_dump') else from_field,
-                    "replyToId": activity.id,
-                    "serviceUrl": activity.service_url,
-                    "channelId": activity.channel_id,
-                    "conversation": activity.conversation.model_dump() if hasattr(activity.conversation, 'model_dump') else activity.conversation
-                }
-                response_activities.append(response_activity)
-
-            # Return Bot Framework response
-            if response_activities:
-                print(f"📤 Sending {len(response_activities)} activities back to Copilot Studio")
+            if context.responses:
+                response_activities = reply_activities(activity, context.responses)
+                if dump:
+                    logger.debug("Activity response", extra={"body": json.dumps(response_activities)})
                 # For single response, return the activity directly
                 if len(response_activities) == 1:
-                    return json_response(response_activities[0])
+                    return serialized(request, response_activities[0])
                 else:
                     # For multiple responses, return as array
-                    return json_response({"activities": response_activities})
+                    return serialized(request, {"activities": response_activities})
             else:
                 # No responses, just return success
                 return Response(status=200)
 
         except Exception as e:
-            print(f"\n❌ ERROR PROCESSING MESSAGE")
-            print(f"Error type: {type(e).__name__}")
-            print(f"Error message: {e}")
-            print("\nFull traceback:")
-            import traceback
-            traceback.print_exc()
-            print("="*60 + "\n")
+            logger.exception("Error processing message", extra={"error": type(e).__name__})
             return Response(text=str(e), status=500)
+        finally:
+            metrics.dispatch_duration.time_since(started, dispatch)
+
+    async def run_proactive(app):
+        """Start the proactive workers and let queued turns finish on shutdown"""
+        await proactive.start()
+        yield
+        await proactive.stop()
+
+    if proactive:
+        app.cleanup_ctx.append(run_proactive)
+
+    async def run_warm_pool(app):
+        """Fill the warm pool in the background while the app is running"""
+        await svc.warm_pool.start()
+        yield
+        await svc.warm_pool.stop()
+
+    if svc.warm_pool:
+        app.cleanup_ctx.append(run_warm_pool)
+
+    def import_sdk():
+        # The Activity model validates full Bot Framework activities and builds invoke responses
+        from microsoft_agents.activity import Activity  # noqa: F401
+
+        return "imported"
+
+    async def fill_warm_pool():
+        filled = await svc.warm_pool.wait_filled(settings.warmup_timeout)
+        return svc.warm_pool.ready() if filled else "timed out"
+
+    async def warmup(app):
+        """Preload what the first requests would otherwise pay for, before the server listens"""
+        steps = [
+            ("documents", lambda: sum(document.body is not None for document in documents.documents.values())),
+            ("corpus", lambda: len(svc.corpus)),
+            ("agents_sdk", import_sdk),
+        ]
+        if svc.generation:
+            steps.append(("generation", svc.generation.warm))
+        if svc.warm_pool:
+            steps.append(("warm_pool", fill_warm_pool))
+        await lifecycle.run_warmup(steps)
+
+    # After the background services have started, so warmup can wait on them
+    app.on_startup.append(warmup)
 
     app.router.add_post("/api/messages", messages_endpoint)
     app.router.add_get("/api/messages", lambda _: Response(status=200))
@@ -510,6 +1221,78 @@ if __name__ == "__main__":
     # This allows Copilot Studio to POST to /.well-known/agent-card.json for A2A messaging
     app.router.add_post("/.well-known/agent-card.json", messages_endpoint)
 
+    async def close_services(app):
+        await svc.close()
+
+    app.on_cleanup.append(close_services)
+
+    # Startup-time budget: module import plus app construction
+    create_ms = elapsed_ms(started)
+    total_ms = round((time.perf_counter() - _IMPORT_STARTED) * 1000, 2)
+    startup.update(import_ms=round(total_ms - create_ms, 2), create_app_ms=create_ms, total_ms=total_ms)
+    if total_ms > settings.startup_budget_ms:
+        logger.warning("Startup exceeded budget", extra=startup)
+    else:
+        logger.info("Agent app created", extra=startup)
+    return app
+
+
+async def drain_on_sigterm(app):
+    """Let SIGTERM drain the process (see Lifecycle) when run with run_app"""
+    services.lifecycle.install_sigterm()
+
+
+async def app_factory(argv=None) -> Application:
+    """
+    Application factory for external servers, e.g.
+
+        gunicorn main:app_factory --bind 0.0.0.0:2009 --worker-class aiohttp.GunicornWebWorker
+        python -m aiohttp.web -H 0.0.0.0 -P 2009 main:app_factory
+
+    These servers never call `main()`, so logging is configured here.
+    """
+    settings = Settings.from_env()
+    configure_logging(settings.log_level, settings.log_format)
+    return create_app(settings)
+
+
+def main():
+    """Run the agent from the command line"""
+    settings = Settings.from_env()
+    configure_logging(settings.log_level, settings.log_format)
+    workers = resolve_worker_count(settings.workers)
+
+    print("🤣 Dad Joke Agent Starting...")
+    print(f"📡 Listening on http://localhost:{settings.port}/api/messages")
+    print(f"🔑 OpenAI Integration: {'Enabled' if settings.openai_enabled else 'Disabled (using random jokes only)'}")
+    if workers > 1:
+        print(f"👷 Workers: {workers}")
+    print("\nPress Ctrl+C to stop the agent\n")
+
+    app = create_app(settings)
+    # SIGTERM fails readiness for DRAIN_DELAY seconds, then in-flight requests
+    # get WORKER_SHUTDOWN_TIMEOUT seconds to finish; Ctrl+C stops without the delay
+    app.on_startup.append(drain_on_sigterm)
+
     # Run the app
     # Bind to 0.0.0.0 to allow external connections (like VS Code tunnel)
-    run_app(app, host="0.0.0.0", port=PORT)
+    if workers > 1:
+        if not services.shared_state.shared:
+            logger.warning("Workers do not share the joke cache or counters; set SHARED_STATE_URL=redis://...")
+        run_workers(
+            app, host="0.0.0.0", port=settings.port, workers=workers,
+            shutdown_timeout=settings.drain_delay + settings.worker_shutdown_timeout,
+            backlog=settings.http_backlog,
+            run_kwargs={
+                "shutdown_timeout": max(settings.worker_shutdown_timeout - 5, 1),
+                "keepalive_timeout": settings.http_keepalive_timeout,
+                "backlog": settings.http_backlog,
+            }
+        )
+    else:
+        run_app(app, host="0.0.0.0", port=settings.port, shutdown_timeout=settings.worker_shutdown_timeout,
+                keepalive_timeout=settings.http_keepalive_timeout, backlog=settings.http_backlog)
+
+
+if __name__ == "__main__":
+    main()
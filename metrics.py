@@ -0,0 +1,210 @@
+"""
+Metrics for the Dad Joke Agent
+Counters and histograms rendered in the Prometheus text exposition format
+
+A small in-process registry, so /metrics needs no extra dependency. In
+multi-worker mode every process keeps its own metrics; scrapes are answered
+by whichever worker accepts the connection (see `dadjoke_worker_info`).
+"""
+
+import time
+from bisect import bisect_left
+
+
+# Latency buckets in seconds, from sub-millisecond hot-path stages to slow generations
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+
+    def inc(self, *label_values, amount: float = 1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values) -> float:
+        return self._values.get(label_values, 0)
+
+    def render(self):
+        for label_values, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}"
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram with optional labels"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+
+    def observe(self, value: float, *label_values):
+        series = self._series.get(label_values)
+        if series is None:
+            # One count per bucket plus +Inf, then the sum
+            series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def time_since(self, started: float, *label_values):
+        """Observe the seconds elapsed since `started` (a perf_counter value)"""
+        self.observe(time.perf_counter() - started, *label_values)
+
+    def count(self, *label_values) -> int:
+        series = self._series.get(label_values)
+        return sum(series[:-1]) if series else 0
+
+    def render(self):
+        for label_values, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labels, label_values, le)} {cumulative}"
+            labels = _format_labels(self.labels, label_values)
+            yield f"{self.name}_sum{labels} {_format_value(series[-1])}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class Collected:
+    """Metric read from a callback at scrape time, e.g. a pool's current depth"""
+
+    def __init__(self, name: str, kind: str, help: str, collect, labels: tuple = ()):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.labels = tuple(labels)
+        self._collect = collect
+
+    def render(self):
+        value = self._collect()
+        if value is None:
+            return
+        if not isinstance(value, dict):
+            value = {(): value}
+        for label_values, number in value.items():
+            if number is not None:
+                yield f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(number)}"
+
+
+class MetricsRegistry:
+    """Named metrics rendered together for /metrics"""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Duplicate metric: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: tuple = ()) -> Counter:
+        return self._register(Counter(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def collect(self, name: str, kind: str, help: str, collect, labels: tuple = ()) -> Collected:
+        """Register a gauge or counter whose value comes from `collect()` when scraped"""
+        return self._register(Collected(name, kind, help, collect, labels))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class AgentMetrics:
+    """
+    The agent's metrics
+
+    HTTP requests per route, dispatch time per activity type or JSON-RPC
+    method, per-stage hot-path timings, joke sources, OpenAI latency,
+    tokens, errors and retries, and generation backend routing.
+    """
+
+    def __init__(self):
+        self.registry = registry = MetricsRegistry()
+
+        self.http_requests = registry.counter(
+            "dadjoke_http_requests_total", "HTTP requests by route, method and status",
+            ("route", "method", "status"))
+        self.http_duration = registry.histogram(
+            "dadjoke_http_request_duration_seconds", "HTTP request latency by route", ("route",))
+        self.dispatch_duration = registry.histogram(
+            "dadjoke_dispatch_duration_seconds",
+            "Time spent handling /api/messages requests by activity type or JSON-RPC method", ("type",))
+        self.stage_duration = registry.histogram(
+            "dadjoke_stage_duration_seconds",
+            "Hot-path stage timings: parse, validate, joke, serialize", ("stage",))
+        self.jokes = registry.counter(
+            "dadjoke_jokes_total", "Jokes served by source", ("source",))
+        self.rate_limited = registry.counter(
+            "dadjoke_rate_limited_total", "Requests refused by the per-caller rate limit, by key type", ("key",))
+        self.shed = registry.counter(
+            "dadjoke_shed_total", "Topic requests shed under load with a classic joke or a 429", ("action",))
+
+        self.openai_duration = registry.histogram(
+            "dadjoke_openai_request_duration_seconds", "OpenAI call latency by mode", ("mode",))
+        self.openai_tokens = registry.counter(
+            "dadjoke_openai_tokens_total", "OpenAI tokens used by type", ("type",))
+        self.openai_errors = registry.counter(
+            "dadjoke_openai_errors_total", "Failed OpenAI calls by error", ("error",))
+        self.openai_retries = registry.counter(
+            "dadjoke_openai_retries_total", "OpenAI calls retried after a transient failure")
+
+        self.generation_duration = registry.histogram(
+            "dadjoke_generation_duration_seconds", "Successful topic generations by backend", ("backend",))
+        self.generation_requests = registry.counter(
+            "dadjoke_generation_requests_total", "Topic generations by backend and result (ok, error, cancelled)",
+            ("backend", "result"))
+        self.generation_routing = registry.counter(
+            "dadjoke_generation_routing_total", "Hedged requests, hedges that answered first, and failovers",
+            ("event",))
+
+        self.proactive = registry.counter(
+            "dadjoke_proactive_total",
+            "Proactive turns accepted or rejected (queue full) and replies delivered, retried or failed",
+            ("result",))
+        self.proactive_wait = registry.histogram(
+            "dadjoke_proactive_queue_wait_seconds", "Time proactive turns waited for a worker")
+
+    def render(self) -> str:
+        return self.registry.render()
@@ -0,0 +1,225 @@
+"""
+Proactive replies for the Dad Joke Agent
+Acknowledge activities at once and deliver slow replies to the channel in the background
+
+With PROACTIVE_REPLIES enabled, /api/messages answers 202 Accepted and puts
+the turn on a bounded queue. Worker tasks run the activity handler, and each
+reply it sends is POSTed to the channel's Bot Framework connector
+(`{serviceUrl}/v3/conversations/{id}/activities/{replyToId}`) through one
+pooled aiohttp session, with retries. When the queue is full the caller
+answers inline instead (backpressure).
+"""
+
+import asyncio
+import random
+import time
+from urllib.parse import quote
+
+import aiohttp
+
+from logging_setup import get_logger
+
+
+logger = get_logger("proactive")
+
+# Connector responses worth retrying
+RETRY_STATUSES = frozenset((408, 429, 500, 502, 503, 504))
+# Answers meaning the channel won't take replies without a Bot Framework token
+AUTH_STATUSES = frozenset((401, 403))
+
+
+class DeliveringTurnContext:
+    """Turn context whose replies are delivered to the channel as they are sent"""
+
+    __slots__ = ("activity", "sender", "sent")
+
+    def __init__(self, activity, sender):
+        self.activity = activity
+        self.sender = sender
+        self.sent = 0
+
+    async def send_activity(self, text_or_activity):
+        if isinstance(text_or_activity, str):
+            response = {"type": "message", "text": text_or_activity}
+        elif hasattr(text_or_activity, "type"):
+            response = {"type": text_or_activity.type, "text": getattr(text_or_activity, "text", "")}
+        else:
+            response = {"type": "message", "text": str(text_or_activity)}
+        self.sent += 1
+        await self.sender.deliver(self.activity, response)
+
+
+class ProactiveReplies:
+    """
+    Background turn queue with pooled, retried delivery
+
+    `submit()` returns False when `max_queue` turns are already waiting.
+    `handler(context, activity)` runs the turn; `build_reply(activity,
+    response)` turns each response into a Bot Framework activity.
+    Deliveries are retried `retries` times on timeouts, connection errors
+    and 408/429/5xx answers, with jittered exponential backoff (honouring
+    Retry-After).
+    """
+
+    def __init__(self, handler, build_reply, workers: int = 8, max_queue: int = 1000,
+                 retries: int = 3, backoff: float = 0.5, timeout: float = 10.0, metrics=None):
+        self.handler = handler
+        self.build_reply = build_reply
+        self.workers = max(1, workers)
+        self.max_queue = max(1, max_queue)
+        self.retries = max(0, retries)
+        self.backoff = backoff
+        self.timeout = timeout
+        self.metrics = metrics
+        self._queue = None
+        self._tasks = []
+        self._session = None
+
+        # Counters
+        self.accepted = 0
+        self.rejected = 0
+        self.delivered = 0
+        self.retried = 0
+        self.failed = 0
+        self._auth_warned = False
+
+    async def start(self):
+        """Open the session and start the workers on the running loop"""
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.workers * 2, keepalive_timeout=30),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = 10.0):
+        """Finish queued turns for up to `timeout` seconds, then shut down"""
+        if self._queue is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Dropping queued proactive turns", extra={"queued": self._queue.qsize()})
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self._session.close()
+        self._queue = None
+
+    def submit(self, activity) -> bool:
+        """Queue a turn; False (and the caller answers inline) when the queue is full"""
+        if self._queue is None:
+            return False
+        try:
+            self._queue.put_nowait((activity, time.perf_counter()))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            self._count("rejected")
+            return False
+        self.accepted += 1
+        self._count("accepted")
+        return True
+
+    async def _worker(self):
+        while True:
+            activity, queued = await self._queue.get()
+            try:
+                if self.metrics:
+                    self.metrics.proactive_wait.time_since(queued)
+                await self.handler(DeliveringTurnContext(activity, self), activity)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception("Proactive turn failed", extra={"error": type(e).__name__})
+            finally:
+                self._queue.task_done()
+
+    async def deliver(self, activity, response: dict) -> bool:
+        """POST one reply to the activity's conversation, retrying transient failures"""
+        reply = self.build_reply(activity, response)
+        url = connector_url(reply)
+        if url is None:
+            self.failed += 1
+            self._count("failed")
+            logger.warning("Cannot deliver reply without serviceUrl and conversation id")
+            return False
+
+        error = None
+        for attempt in range(self.retries + 1):
+            retry_after = None
+            try:
+                async with self._session.post(url, json=reply) as answer:
+                    if answer.status < 300:
+                        self.delivered += 1
+                        self._count("delivered")
+                        return True
+                    if answer.status not in RETRY_STATUSES:
+                        self._rejected(url, answer.status)
+                        return False
+                    retry_after = _retry_after(answer.headers.get("Retry-After"))
+                    error = f"HTTP {answer.status}"
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = type(e).__name__
+            if attempt < self.retries:
+                self.retried += 1
+                self._count("retried")
+                delay = retry_after if retry_after is not None else self.backoff * 2 ** attempt
+                await asyncio.sleep(delay * random.uniform(0.8, 1.2))
+
+        self.failed += 1
+        self._count("failed")
+        logger.warning("Proactive delivery failed", extra={"url": url, "attempts": attempt + 1, "error": error})
+        return False
+
+    def _rejected(self, url: str, status: int):
+        """Count a reply the channel refused outright; not retried"""
+        self.failed += 1
+        self._count("failed")
+        if status in AUTH_STATUSES:
+            # Every reply will fail the same way, so say so once
+            if not self._auth_warned:
+                self._auth_warned = True
+                logger.error("Channel refused proactive replies as unauthorized; replies are posted without a "
+                             "Bot Framework token, so use PROACTIVE_REPLIES=off for channels that require one",
+                             extra={"url": url, "status": status})
+            return
+        logger.warning("Proactive delivery rejected", extra={"url": url, "status": status})
+
+    def _count(self, result: str):
+        if self.metrics:
+            self.metrics.proactive.inc(result)
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queue_depth": self.queue_depth(),
+            "max_queue": self.max_queue,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "delivered": self.delivered,
+            "retried": self.retried,
+            "failed": self.failed,
+        }
+
+
+def connector_url(reply: dict):
+    """Bot Framework connector URL for a reply activity, or None"""
+    service_url = reply.get("serviceUrl")
+    conversation = reply.get("conversation") or {}
+    if not service_url or not conversation.get("id"):
+        return None
+    url = f"{service_url.rstrip('/')}/v3/conversations/{quote(conversation['id'], safe='')}/activities"
+    if reply.get("replyToId"):
+        url += f"/{quote(reply['replyToId'], safe='')}"
+    return url
+
+
+def _retry_after(value):
+    """Seconds from a Retry-After header (capped at 30), or None"""
+    try:
+        return min(max(float(value), 0.0), 30.0)
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,260 @@
+"""
+Shared state backends for the Dad Joke Agent
+Key/value storage with TTLs and counters that worker processes can share
+
+`memory://` keeps state inside the process (single worker only);
+`redis://host:port/db` talks the Redis protocol so every worker sees the
+same cache entries and counters.
+"""
+
+import asyncio
+import time
+from urllib.parse import urlparse
+
+
+class SharedStateBackend:
+    """Interface for shared key/value state; values are strings"""
+
+    shared = False
+
+    async def get(self, key: str):
+        """Return the value for `key`, or None if missing or expired"""
+        raise NotImplementedError
+
+    async def set(self, key: str, value: str, ttl: float = None):
+        """Store `value` under `key`, expiring after `ttl` seconds if given"""
+        raise NotImplementedError
+
+    async def incr(self, key: str, amount: int = 1, ttl: float = None) -> int:
+        """Add `amount` to an integer counter; `ttl` applies when it is created"""
+        raise NotImplementedError
+
+    async def delete(self, key: str):
+        """Remove `key` if present"""
+        raise NotImplementedError
+
+    async def close(self):
+        """Release any connections"""
+
+    def describe(self) -> dict:
+        return {"backend": type(self).__name__, "shared": self.shared}
+
+
+class MemoryBackend(SharedStateBackend):
+    """In-process state; each worker process has its own copy"""
+
+    def __init__(self):
+        self._values = {}
+
+    def _live(self, key: str):
+        item = self._values.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._values[key]
+            return None
+        return item
+
+    async def get(self, key: str):
+        item = self._live(key)
+        return item[0] if item else None
+
+    async def set(self, key: str, value: str, ttl: float = None):
+        expires_at = time.monotonic() + ttl if ttl else None
+        self._values[key] = (value, expires_at)
+
+    async def incr(self, key: str, amount: int = 1, ttl: float = None) -> int:
+        item = self._live(key)
+        if item is None:
+            value, expires_at = amount, (time.monotonic() + ttl if ttl else None)
+        else:
+            value, expires_at = int(item[0]) + amount, item[1]
+        self._values[key] = (str(value), expires_at)
+        return value
+
+    async def delete(self, key: str):
+        self._values.pop(key, None)
+
+    def describe(self) -> dict:
+        return {**super().describe(), "keys": len(self._values)}
+
+
+class RedisError(Exception):
+    """Error reply from a Redis-protocol server"""
+
+
+class RedisBackend(SharedStateBackend):
+    """
+    Minimal Redis (RESP2) client over asyncio streams
+
+    Keeps a small pool of connections; only the handful of commands the
+    agent needs are implemented, so no extra dependency is required.
+    """
+
+    shared = True
+
+    def __init__(self, host: str = "localhost", port: int = 6379, db: int = 0,
+                 password: str = None, prefix: str = "dadjoke:", pool_size: int = 4,
+                 timeout: float = 2.0):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.prefix = prefix
+        self.timeout = timeout
+        self.pool_size = max(1, pool_size)
+        # Built on first use, inside the running loop (Python 3.9 binds it at construction)
+        self._slots = None
+        self._idle = []
+        self._opened = 0
+        self.errors = 0
+
+    @classmethod
+    def from_url(cls, url: str, **kwargs):
+        parsed = urlparse(url)
+        db = int(parsed.path.lstrip("/") or 0)
+        return cls(
+            host=parsed.hostname or "localhost",
+            port=parsed.port or 6379,
+            db=db,
+            password=parsed.password,
+            **kwargs
+        )
+
+    @property
+    def slots(self) -> asyncio.Semaphore:
+        """One slot per connection the pool may have open, created on first use"""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.pool_size)
+        return self._slots
+
+    async def execute(self, *args):
+        """Send one command and return its decoded reply"""
+        connection = await self._acquire()
+        try:
+            reader, writer = connection
+            writer.write(_encode_command(args))
+            reply = await asyncio.wait_for(_read_reply(reader), timeout=self.timeout)
+        except BaseException:
+            # The connection state is unknown after a failure; drop it
+            self.errors += 1
+            self._discard(connection)
+            raise
+        self._idle.append(connection)
+        self.slots.release()
+        if isinstance(reply, RedisError):
+            raise reply
+        return reply
+
+    async def _acquire(self):
+        """An idle connection, or a new one; waits at most `timeout` for a free slot"""
+        await asyncio.wait_for(self.slots.acquire(), timeout=self.timeout)
+        if self._idle:
+            return self._idle.pop()
+        try:
+            connection = await self._connect()
+        except BaseException:
+            self.slots.release()
+            raise
+        self._opened += 1
+        return connection
+
+    async def _connect(self):
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), timeout=self.timeout
+        )
+        for command in self._handshake():
+            writer.write(_encode_command(command))
+            reply = await asyncio.wait_for(_read_reply(reader), timeout=self.timeout)
+            if isinstance(reply, RedisError):
+                writer.close()
+                raise reply
+        return reader, writer
+
+    def _handshake(self):
+        if self.password:
+            yield ("AUTH", self.password)
+        if self.db:
+            yield ("SELECT", str(self.db))
+
+    def _discard(self, connection):
+        """Close a checked-out connection, freeing its slot for a fresh one"""
+        self._opened -= 1
+        connection[1].close()
+        self.slots.release()
+
+    async def get(self, key: str):
+        value = await self.execute("GET", self.prefix + key)
+        return value.decode("utf-8") if value is not None else None
+
+    async def set(self, key: str, value: str, ttl: float = None):
+        if ttl:
+            await self.execute("SET", self.prefix + key, value, "PX", str(int(ttl * 1000)))
+        else:
+            await self.execute("SET", self.prefix + key, value)
+
+    async def incr(self, key: str, amount: int = 1, ttl: float = None) -> int:
+        value = await self.execute("INCRBY", self.prefix + key, str(amount))
+        if ttl and value == amount:
+            # First increment created the counter - start its window
+            await self.execute("PEXPIRE", self.prefix + key, str(int(ttl * 1000)))
+        return value
+
+    async def delete(self, key: str):
+        await self.execute("DEL", self.prefix + key)
+
+    async def close(self):
+        while self._idle:
+            self._opened -= 1
+            self._idle.pop()[1].close()
+
+    def describe(self) -> dict:
+        return {
+            **super().describe(),
+            "address": f"{self.host}:{self.port}/{self.db}",
+            "connections": self._opened,
+            "errors": self.errors,
+        }
+
+
+def _encode_command(args) -> bytes:
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+        parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+    return b"".join(parts)
+
+
+async def _read_reply(reader: asyncio.StreamReader):
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("Redis connection closed")
+    kind, payload = line[:1], line[1:-2]
+    if kind == b"+":
+        return payload.decode("utf-8")
+    if kind == b"-":
+        return RedisError(payload.decode("utf-8"))
+    if kind == b":":
+        return int(payload)
+    if kind == b"$":
+        length = int(payload)
+        if length < 0:
+            return None
+        data = await reader.readexactly(length + 2)
+        return data[:-2]
+    if kind == b"*":
+        count = int(payload)
+        if count < 0:
+            return None
+        return [await _read_reply(reader) for _ in range(count)]
+    raise RedisError(f"Unexpected reply: {line!r}")
+
+
+def create_backend(url: str = None) -> SharedStateBackend:
+    """Build a backend from a URL such as `memory://` or `redis://localhost:6379/0`"""
+    if not url or url.startswith("memory:"):
+        return MemoryBackend()
+    if url.startswith("redis:"):
+        return RedisBackend.from_url(url)
+    raise ValueError(f"Unsupported SHARED_STATE_URL: {url}")
@@ -0,0 +1,218 @@
+"""
+Warm joke pool for the Dad Joke Agent
+Keeps ready jokes for popular topics, generated in the background
+
+Topic requests that would go to OpenAI are counted with decaying weights.
+The `max_topics` most requested topics, plus any seed topics, are kept
+warm: a background task generates jokes for them until each holds `depth`,
+and refills a topic once it drops below `low_water`. Every pooled joke is
+served once, so popular topics get a fresh joke without waiting on the
+model while uncommon topics still go to live generation.
+"""
+
+import asyncio
+import heapq
+import time
+from collections import deque
+
+from joke_cache import normalize_topic
+from logging_setup import get_logger
+from shared_state import MemoryBackend
+
+
+logger = get_logger("warm_pool")
+
+# Requests (halved every half-life) before a learned topic is worth warming
+MIN_DEMAND = 2
+# Topics whose demand is tracked at once; new topics are ignored beyond this
+MAX_TRACKED = 10000
+# Tokens charged to the budget when the API reports no usage
+ESTIMATED_TOKENS = 100
+
+
+class WarmPool:
+    """
+    Pre-generated jokes for popular and seed topics
+
+    `generate(topic)` must return `(joke, tokens)` (see
+    `JokeGenerator.generate_with_usage`). Generation pauses while `busy()`
+    is true, so live requests keep the OpenAI slots, and stops for the rest
+    of the `budget_window` once `token_budget` tokens were spent (0 = no
+    limit). The budget is counted in `backend`, so with a shared
+    SHARED_STATE_URL every worker draws from the same budget.
+    """
+
+    def __init__(self, generate, max_topics: int = 20, seed_topics=(), depth: int = 5,
+                 low_water: int = 2, token_budget: int = 20000, budget_window: float = 3600.0,
+                 interval: float = 30.0, half_life: float = 600.0, backend=None, busy=None):
+        self.generate = generate
+        self.max_topics = max(0, max_topics)
+        self.seed_topics = list(dict.fromkeys(filter(None, map(normalize_topic, seed_topics))))
+        self.depth = max(1, depth)
+        self.low_water = min(max(1, low_water), self.depth)
+        self.token_budget = token_budget
+        self.budget_window = budget_window
+        self.interval = interval
+        self.half_life = half_life
+        self.backend = backend or MemoryBackend()
+        self.busy = busy
+        self._pools = {}
+        self._demand = {}
+        self._decayed_at = time.monotonic()
+        self._wakeup = None
+        self._filled = None
+        self._task = None
+
+        # Counters
+        self.served = 0
+        self.missed = 0
+        self.generated = 0
+        self.failures = 0
+        self.tokens_spent = 0
+        self.budget_stops = 0
+
+    def take(self, topic: str):
+        """A ready joke for `topic`, or None; every call counts as demand for the topic"""
+        key = normalize_topic(topic) or topic
+        demand = self._demand.get(key)
+        if demand is not None or len(self._demand) < MAX_TRACKED:
+            self._demand[key] = demand = (demand or 0) + 1
+
+        pool = self._pools.get(key)
+        if not pool:
+            self.missed += 1
+            # A topic that just became popular is picked up at once
+            if demand == MIN_DEMAND:
+                self._wake()
+            return None
+        self.served += 1
+        joke = pool.popleft()
+        if len(pool) < self.low_water:
+            self._wake()
+        return joke
+
+    def warm_topics(self) -> list:
+        """Seed topics followed by the most requested ones"""
+        learned = heapq.nlargest(
+            self.max_topics,
+            ((count, topic) for topic, count in self._demand.items()
+             if count >= MIN_DEMAND and topic not in self.seed_topics)
+        )
+        return self.seed_topics + [topic for _, topic in learned]
+
+    async def start(self):
+        """Start the background producer on the running loop"""
+        self._wakeup = asyncio.Event()
+        self._filled = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def wait_filled(self, timeout: float) -> bool:
+        """Wait up to `timeout` seconds for the first refill pass; False if it is still running"""
+        try:
+            await asyncio.wait_for(self._filled.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refill()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Warm pool refill failed", extra={"error": type(e).__name__, "detail": str(e)})
+            self._filled.set()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def refill(self) -> int:
+        """Top up every warm topic below its low-water mark; returns the jokes generated"""
+        self._decay()
+        topics = self.warm_topics()
+        # Topics that cooled down give their jokes up
+        for topic in list(self._pools):
+            if topic not in topics:
+                del self._pools[topic]
+
+        generated = 0
+        for topic in topics:
+            pool = self._pools.setdefault(topic, deque())
+            if len(pool) >= self.low_water:
+                continue
+            while len(pool) < self.depth:
+                if self.busy is not None and self.busy():
+                    return generated
+                if not await self._within_budget():
+                    self.budget_stops += 1
+                    return generated
+                try:
+                    joke, tokens = await self.generate(topic)
+                except Exception as e:
+                    # Includes an open circuit breaker; try again next interval
+                    self.failures += 1
+                    logger.debug("Warm pool generation failed", extra={"error": type(e).__name__})
+                    return generated
+                await self._spend(tokens or ESTIMATED_TOKENS)
+                pool.append(joke)
+                generated += 1
+                self.generated += 1
+        return generated
+
+    def _decay(self):
+        """Halve demand every `half_life` seconds and forget topics nobody asks for"""
+        now = time.monotonic()
+        if now - self._decayed_at < self.half_life:
+            return
+        self._decayed_at = now
+        self._demand = {topic: count // 2 for topic, count in self._demand.items() if count >= 2}
+
+    def _budget_key(self) -> str:
+        return f"warm:tokens:{int(time.time() // self.budget_window)}"
+
+    async def _within_budget(self) -> bool:
+        if self.token_budget <= 0:
+            return True
+        spent = await self.backend.get(self._budget_key())
+        return int(spent or 0) < self.token_budget
+
+    async def _spend(self, tokens: int):
+        self.tokens_spent += tokens
+        if self.token_budget > 0:
+            await self.backend.incr(self._budget_key(), tokens, ttl=self.budget_window)
+
+    def ready(self) -> int:
+        return sum(len(pool) for pool in self._pools.values())
+
+    def stats(self) -> dict:
+        return {
+            "topics": len(self._pools),
+            "max_topics": self.max_topics,
+            "seed_topics": len(self.seed_topics),
+            "ready": self.ready(),
+            "depth": self.depth,
+            "low_water": self.low_water,
+            "served": self.served,
+            "missed": self.missed,
+            "generated": self.generated,
+            "failures": self.failures,
+            "tokens_spent": self.tokens_spent,
+            "token_budget": self.token_budget,
+            "budget_stops": self.budget_stops,
+        }
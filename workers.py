@@ -0,0 +1,151 @@
+"""
+Multi-worker mode for the Dad Joke Agent
+Pre-fork supervisor that runs N worker processes on the same port
+"""
+
+import multiprocessing
+import os
+import signal
+import socket
+import time
+
+from aiohttp.web import run_app
+
+from logging_setup import get_logger
+
+
+logger = get_logger("workers")
+
+# Identity of the current process, reported on /health
+_worker = {"id": 0, "workers": 1}
+
+
+def current_worker() -> dict:
+    """The worker id, pid and pool size of this process"""
+    return {**_worker, "pid": os.getpid()}
+
+
+def resolve_worker_count(value: int) -> int:
+    """WORKERS=0 means one worker per CPU core"""
+    return value if value > 0 else (os.cpu_count() or 1)
+
+
+def _bind_socket(host: str, port: int, backlog: int) -> socket.socket:
+    """Listening socket created once by the supervisor and inherited by workers"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _worker_main(worker_id: int, workers: int, app, host: str, port: int, sock, run_kwargs: dict):
+    _worker.update(id=worker_id, workers=workers)
+    # Drop the supervisor's handlers inherited across fork; run_app installs its own
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    # A reload forwarded before the document store installs its handler must not kill the worker
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    logger.info("Worker started", extra={"worker": worker_id, "pid": os.getpid()})
+    if sock is not None:
+        run_app(app, sock=sock, print=None, **run_kwargs)
+    else:
+        run_app(app, host=host, port=port, reuse_port=True, print=None, **run_kwargs)
+
+
+class Supervisor:
+    """
+    Start and watch worker processes
+
+    Workers share the port through SO_REUSEPORT where the platform has it
+    (the kernel balances connections between them), or otherwise through a
+    listening socket bound here and inherited across fork. Crashed workers
+    are restarted; SIGHUP is forwarded to every worker (reloading its
+    documents); SIGTERM/SIGINT stop every worker gracefully, escalating
+    to SIGKILL after `shutdown_timeout` seconds.
+    """
+
+    def __init__(self, app, host: str, port: int, workers: int,
+                 shutdown_timeout: float = 30.0, backlog: int = 128, run_kwargs: dict = None):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.shutdown_timeout = shutdown_timeout
+        self.backlog = backlog
+        self.run_kwargs = run_kwargs or {}
+        self.processes = {}
+        self.stopping = False
+        self.sock = None
+        self._context = multiprocessing.get_context("fork")
+
+    def _spawn(self, worker_id: int):
+        process = self._context.Process(
+            target=_worker_main,
+            args=(worker_id, self.workers, self.app, self.host, self.port, self.sock, self.run_kwargs),
+            name=f"dad-joke-worker-{worker_id}",
+            daemon=False,
+        )
+        process.start()
+        self.processes[worker_id] = process
+
+    def _stop(self, signum, frame):
+        if self.stopping:
+            return
+        self.stopping = True
+        logger.info("Stopping workers", extra={"signal": signal.Signals(signum).name})
+        for process in self.processes.values():
+            if process.is_alive():
+                process.terminate()
+
+    def _reload(self, signum, frame):
+        """Forward SIGHUP so every worker reloads its discovery documents"""
+        logger.info("Reloading workers", extra={"signal": "SIGHUP"})
+        for process in self.processes.values():
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGHUP)
+
+    def run(self):
+        if not hasattr(socket, "SO_REUSEPORT"):
+            self.sock = _bind_socket(self.host, self.port, self.backlog)
+
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        if hasattr(signal, "SIGHUP"):
+            signal.signal(signal.SIGHUP, self._reload)
+
+        for worker_id in range(1, self.workers + 1):
+            self._spawn(worker_id)
+        logger.info("Supervisor running", extra={"workers": self.workers, "pid": os.getpid()})
+
+        while not self.stopping:
+            time.sleep(0.5)
+            for worker_id, process in list(self.processes.items()):
+                if not process.is_alive() and not self.stopping:
+                    logger.warning("Worker exited, restarting", extra={
+                        "worker": worker_id, "exitcode": process.exitcode
+                    })
+                    time.sleep(1)
+                    self._spawn(worker_id)
+
+        deadline = time.monotonic() + self.shutdown_timeout
+        for process in self.processes.values():
+            process.join(max(0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning("Worker did not stop in time, killing", extra={"pid": process.pid})
+                process.kill()
+                process.join()
+        if self.sock is not None:
+            self.sock.close()
+        logger.info("All workers stopped")
+
+
+def run_workers(app, host: str, port: int, workers: int, **kwargs):
+    """Serve `app` from `workers` forked processes until SIGTERM/SIGINT"""
+    if "fork" not in multiprocessing.get_all_start_methods():
+        logger.warning("Multi-worker mode needs fork(); running a single process")
+        run_app(app, host=host, port=port, **kwargs.get("run_kwargs", {}))
+        return
+    Supervisor(app, host, port, workers, **kwargs).run()